@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+""" Lexer and logger throughput benchmarks
+
+    python benchmarks.py            - compare with stored baselines
+    python benchmarks.py --update   - store current results as baselines
+"""
+
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+from os.path import dirname, isfile
+from os.path import join as pathjoin
+
+from lexer import Lexer
+from logger import Logger
+from subsets import compile_subset
+from tests import assert_test, subtest_result, subtests_run
+import ubml
+
+
+SIZES: tuple[int, ...] = (64 * 1024, 512 * 1024, 2 * 1024 * 1024)
+BASELINES_PATH = pathjoin(dirname(__file__), 'lexer_baselines.ubml')
+T_TRESHOLD: float = 2.0  # allowed slowdown against baseline
+M_TRESHOLD: float = 1.5  # allowed memory growth against baseline
+MAX_DEPTH: int = 12
+REPEAT: int = 3
+LOG_RECORDS: int = 20_000
+
+
+def _subset_words() -> list[str]:
+    """ Spellings of default and ru_ru subsets the lexer accepts """
+    words: set[str] = set()
+    for name in ('default', 'ru_ru'):
+        words.update(word for word in compile_subset(name).table
+                     if word.isalnum())
+    return sorted(words)
+
+
+def gen_source(size: int, seed: int = 0) -> str:
+    """ Generate UB source of about size chars without lexer errors:
+        keywords of both subsets, numbers, long strings,
+        comments and deeply nested blocks and expressions """
+    rnd = random.Random(seed)
+    words: list[str] = _subset_words()
+    names: list[str] = ['x', 'count', 'name', 'значение', 'итог', 'delay']
+    lines: list[str] = []
+    length: int = 0
+    depth: int = 0
+
+    def number() -> str:
+        if rnd.random() < 0.5:
+            return str(rnd.randint(0, 100_000))
+        return f'{rnd.uniform(0, 1000):.{rnd.randint(1, 6)}f}'
+
+    def expression(level: int = 0) -> str:
+        if level > 3 or rnd.random() < 0.3:
+            # words take the separator after them, so keep one
+            return rnd.choice((number(), rnd.choice(names) + ' '))
+        return f'({expression(level + 1)} {rnd.choice("+-*/^%")} '\
+               f'{expression(level + 1)})'
+
+    while length < size:
+        indent: str = '    ' * depth
+        kind: float = rnd.random()
+        if kind < 0.3:
+            line = f'{rnd.choice(words)} "{"text " * rnd.randint(1, 30)}'\
+                   '\\"quoted\\" tail"'
+        elif kind < 0.55:
+            line = f'{rnd.choice(words)} {rnd.choice(names)} = '\
+                   f'{expression()}'
+        elif kind < 0.7:
+            line = f'# {" ".join(rnd.choices(words, k=rnd.randint(1, 8)))}'
+        elif kind < 0.85 and depth < MAX_DEPTH:
+            line = f'{rnd.choice(words)} {rnd.choice(names)} ~ '\
+                   f'{number()} {{'
+            depth += 1
+        elif depth:
+            depth -= 1
+            line = '    ' * depth + '}'
+            indent = ''
+        else:
+            line = f'{rnd.choice(words)} {number()}'
+        lines.append(indent + line)
+        length += len(indent) + len(line) + 1
+    lines.extend('    ' * level + '}' for level in range(depth - 1, -1, -1))
+    return '\n'.join(lines) + '\n'
+
+
+def measure(text: str, repeat: int = REPEAT) -> dict[str, float]:
+    """ Tokens/sec, MB/s and peak memory (kb) of Lexer.tokenize,
+        the best time of repeat runs is taken """
+    seconds: float = float('inf')
+    for _ in range(repeat):
+        timestart: float = time.perf_counter()
+        tokens, err = Lexer(text).tokenize()
+        seconds = min(seconds, time.perf_counter() - timestart)
+    if err:
+        raise ValueError(f'benchmark source is invalid:\n{err.as_str()}')
+    tracemalloc.start()
+    Lexer(text).tokenize()
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'tokens': len(tokens),
+            'tokens_per_sec': len(tokens) / seconds,
+            'mb_per_sec': len(text.encode('utf-8')) / seconds / 1024 ** 2,
+            'peak_kb': peak / 1024}
+
+
+def load_baselines(path: str = BASELINES_PATH) -> dict:
+    """ Stored results by size """
+    if not isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as fd:
+        return ubml.load(fd) or {}
+
+
+def save_baselines(results: dict, path: str = BASELINES_PATH):
+    """ Store results as baselines """
+    with open(path, 'w', encoding='utf-8') as fd:
+        ubml.dump(results, fd, ident=4)
+
+
+def test_lexer_throughput(sizes: tuple[int, ...] = SIZES,
+                          t_treshold: float = T_TRESHOLD,
+                          m_treshold: float = M_TRESHOLD,
+                          results: dict | None = None) -> dict:
+    """ Compare lexer throughput and memory with stored baselines """
+    test_meta: dict = {'subtests_number': 0,
+                       'successes': 0,
+                       'overall': True}
+    baselines: dict = load_baselines()
+    results = {} if results is None else results
+    for size in sizes:
+        key: str = f'{size // 1024}kb'
+        res: dict = measure(gen_source(size))
+        results[key] = res
+        desc: str = f'Lexer on {key} ({res["tokens"]} tokens)'
+        msg: str = f'{res["tokens_per_sec"]:.0f} tokens/s, '\
+                   f'{res["mb_per_sec"]:.2f} MB/s, '\
+                   f'peak {res["peak_kb"]:.0f} kb'
+        base: dict | None = baselines.get(key)
+        if not base:
+            subtests_run(test_meta, subtest_result(
+                desc, 'SUCCESS', msg=msg + ' (no baseline)'))
+            continue
+        t_diff: float = base['tokens_per_sec'] / res['tokens_per_sec']
+        subtests_run(test_meta, subtest_result(
+            desc + ' speed',
+            assert_test(
+                t_diff <= t_treshold,
+                True,
+                f'Tokenizing is slower than baseline -> {msg}, '
+                f'x{t_diff:.2f} (> {t_treshold})'
+            ),
+            msg=f'{msg}, x{t_diff:.2f} of baseline time'
+        ))
+        m_diff: float = res['peak_kb'] / base['peak_kb']
+        subtests_run(test_meta, subtest_result(
+            desc + ' memory',
+            assert_test(
+                m_diff <= m_treshold,
+                True,
+                f'Tokenizing takes more memory than baseline -> '
+                f'{res["peak_kb"]:.0f} kb, x{m_diff:.2f} (> {m_treshold})'
+            ),
+            msg=f'x{m_diff:.2f} of baseline memory'
+        ))
+    return test_meta
+
+
+def measure_logger(records: int = LOG_RECORDS,
+                   async_mode: bool = False) -> float:
+    """ Records/sec of Logger.log into a file, until all are written """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        logger = Logger('bench.log', tmpdir, silent=True,
+                        async_mode=async_mode)
+        timestart: float = time.perf_counter()
+        for idx in range(records):
+            logger.log(f'record {idx} of the benchmark')
+        logger.close()
+        return records / (time.perf_counter() - timestart)
+
+
+def test_logger_throughput(records: int = LOG_RECORDS) -> dict:
+    """ Compare async logging with writing every record synchronously """
+    test_meta: dict = {'subtests_number': 0,
+                       'successes': 0,
+                       'overall': True}
+    sync_rate: float = measure_logger(records)
+    async_rate: float = measure_logger(records, async_mode=True)
+    t_diff: float = async_rate / sync_rate
+    subtests_run(test_meta, subtest_result(
+        f'Async logger on {records} records',
+        assert_test(
+            t_diff >= 1.0,
+            True,
+            f'Async logging is slower -> {async_rate:.0f} records/s, '
+            f'x{t_diff:.2f} of {sync_rate:.0f} records/s'
+        ),
+        msg=f'{async_rate:.0f} records/s, x{t_diff:.2f} of '
+            f'{sync_rate:.0f} records/s synchronously'
+    ))
+    return test_meta
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Lexer benchmarks')
+    parser.add_argument('--update', action='store_true',
+                        help='store results as new baselines')
+    parser.add_argument('--treshold', type=float, default=T_TRESHOLD,
+                        help='allowed slowdown against baseline')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='corpus sizes in kb')
+    args = parser.parse_args()
+    sizes: tuple = tuple(size * 1024 for size in args.sizes)\
+        if args.sizes else SIZES
+
+    print('Testing: test_lexer_throughput', '---{')  # }
+    results: dict = {}
+    meta: dict = test_lexer_throughput(sizes, args.treshold, results=results)
+    print('}--->', 'SUCCESS' if meta['overall'] else 'FAIL',
+          f'[{meta['successes']}/{meta['subtests_number']}]')
+    print('Testing: test_logger_throughput', '---{')  # }
+    meta = test_logger_throughput()
+    print('}--->', 'SUCCESS' if meta['overall'] else 'FAIL',
+          f'[{meta['successes']}/{meta['subtests_number']}]')
+    if args.update:
+        baselines: dict = load_baselines()
+        baselines.update(results)
+        save_baselines(baselines)
+        print(f'Baselines are saved to {BASELINES_PATH}')
+
+
+if __name__ == "__main__":
+    main()
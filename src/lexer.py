@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 """ Tokenizer for unibasic v0.01 """
 
+import codecs
+import re
+from bisect import bisect_left
 from enum import Enum
-from typing import Tuple
+from os import PathLike
+from typing import IO, Callable, Iterator, Tuple
 
-from textdata import TextData, EOF
+from textdata import TextData, EOF, DEFAULT_FILENAME
 from textdata import TextPointer as Pointer
 from errors import IllegalCharacterErr, SyntaxErr, Error
 
 
+# Bump when tokens for the same text change (invalidates token caches)
+LEXER_VERSION = 1
+
+
 # TODO: Need semicolon to do something
 class TokenType(Enum):
     """ Token types """
@@ -46,7 +54,12 @@ class TokenType(Enum):
     OP_NE      = 28
 
     NEWLINE    = 29
-    MAX        = 30
+
+    DIRECTIVE  = 30
+    TYPE       = 31
+    RESERVED   = 32
+    IDENTIFIER = 33
+    MAX        = 34
 
 
 class Token:
@@ -65,14 +78,382 @@ class Token:
         return str(self.token_type.name)
 
 
+########################################################
+# Scanning engine
+########################################################
+# Raw tokens are plain tuples: (token_type, start, end, resume, error)
+#   token_type - TokenType or None if only an error was found
+#   start, end - offsets of the token text (for comments '#' is excluded
+#                from the value, but included in the span)
+#   resume     - offset where scanning continues
+#   error      - None or (error class, message, start offset, end offset)
+RawToken = tuple[TokenType | None, int, int, int,
+                 tuple[type[Error], str, int, int] | None]
+
+_SKIP_RE = re.compile(r'[ \t]+')
+_DIGITS_RE = re.compile(r'[\d.]*')
+_WORD_RE = re.compile(r'[^\W_]*')  # same as str.isalnum()
+_NAME_RE = re.compile(r'\w*')  # words with '_', like last_err of subsets
+_DIRECTIVE_RE = re.compile(r'\$\w+')
+_RESYNC_RE = re.compile(r'[^\s"\']*')  # up to whitespace or quote
+
+_CHAR_TOKENS: dict[str, TokenType] = {
+    '+': TokenType.OP_PLUS,
+    '-': TokenType.OP_MINUS,
+    '*': TokenType.OP_MULT,
+    '/': TokenType.OP_DIV,
+    '~': TokenType.TILDE,
+    '=': TokenType.OP_ASSIGN,
+    '%': TokenType.OP_MOD,
+    '^': TokenType.OP_POW,
+    '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN,
+    '{': TokenType.RBRACE,
+    '}': TokenType.LBRACE,
+    '\n': TokenType.NEWLINE,
+}
+
+
+def _number_end(text: str, pos: int) -> int:
+    """ Offset after the run of digits and dots starting at pos """
+    end: int = _DIGITS_RE.match(text, pos).end()
+    # \d is narrower than str.isdigit() (e.g. superscripts)
+    while end < len(text) and text[end].isdigit():
+        end = _DIGITS_RE.match(text, end + 1).end()
+    return end
+
+
+def _string_end(text: str, pos: int) -> int:
+    """ Offset after the closing quote or -1 if string is unterminated """
+    quote: str = text[pos]
+    end: int = text.find(quote, pos + 1)
+    while end > 0 and text[end - 1] == '\\':
+        end = text.find(quote, end + 1)
+    return end + 1 if end > 0 else -1
+
+
+def scan(text: str, pos: int = 0, directives: bool = False,
+         recover: bool = False, names: bool = False) -> Iterator[RawToken]:
+    """ Scanning engine behind Lexer.tokenize
+        Consumes whole runs of chars per step and yields raw tokens
+        With directives $WORD is a DIRECTIVE instead of illegal '$'
+        With names words may contain '_' (reserved names of subsets)
+        With recover scanning resumes after an illegal character
+        at the next whitespace, newline or quote """
+    # pylint: disable=too-many-branches  # a branch per token kind
+    size: int = len(text)
+    word_re: re.Pattern = _NAME_RE if names else _WORD_RE
+    while pos < size:
+        char: str = text[pos]
+        token_type: TokenType | None = _CHAR_TOKENS.get(char)
+        if token_type is not None:
+            yield token_type, pos, pos + 1, pos + 1, None
+            pos += 1
+        elif char == '$' and directives and\
+                (directive := _DIRECTIVE_RE.match(text, pos)):
+            end: int = directive.end()
+            yield TokenType.DIRECTIVE, pos, end, end, None
+            pos = end
+        elif char in ' \t':
+            pos = _SKIP_RE.match(text, pos).end()
+        elif char == '#':
+            end = text.find('\n', pos + 1)
+            end = size if end < 0 else end
+            # newline after a comment is consumed with it
+            yield TokenType.COMMENT, pos, end, min(end + 1, size), None
+            pos = min(end + 1, size)
+        elif char in '"\'':
+            end = _string_end(text, pos)
+            if end < 0:
+                yield TokenType.STR, pos, size, size, \
+                    (SyntaxErr, 'unterminated string literal', pos, size)
+                pos = size
+            else:
+                yield TokenType.STR, pos, end, end, None
+                pos = end
+        elif char.isdigit():
+            end = _number_end(text, pos)
+            dots: int = text.count('.', pos, end)
+            yield TokenType.FLOAT if dots else TokenType.INT, pos, end, end, \
+                (SyntaxErr, 'too many dots for number', pos, end - 1)\
+                if dots > 1 else None
+            pos = end
+        elif char.isalpha():
+            end = word_re.match(text, pos).end()
+            if end < size and text[end] not in ' \n':
+                resume: int = _RESYNC_RE.match(text, end).end()\
+                    if recover else end
+                yield TokenType.KEYWORD, pos, end, resume, \
+                    (IllegalCharacterErr, f"'{text[end]}'", pos, end)
+                pos = resume
+            else:
+                # separator after a keyword is consumed with it
+                yield TokenType.KEYWORD, pos, end, min(end + 1, size), None
+                pos = min(end + 1, size)
+        else:
+            resume = _RESYNC_RE.match(text, pos + 1).end()\
+                if recover else pos + 1
+            yield None, pos, pos + 1, resume, \
+                (IllegalCharacterErr, f'got ({char.encode().hex()}) {char}\'',
+                 pos, pos)
+            pos = resume
+
+
+_VALUE_TOKENS: frozenset[TokenType] = frozenset((
+    TokenType.STR, TokenType.KEYWORD, TokenType.INT, TokenType.FLOAT,
+    TokenType.DIRECTIVE))
+
+
+def raw_value(text: str, raw: RawToken) -> str | None:
+    """ Value of the raw token as Token stores it """
+    token_type, start, end = raw[0], raw[1], raw[2]
+    if token_type is TokenType.COMMENT:
+        return text[start + 1:end]
+    if token_type in _VALUE_TOKENS:
+        return text[start:end]
+    return None
+
+
+class _LineTracker:
+    """ Resolves offsets into (line, col) while scanning forward """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, text: str, pos: int = 0, line: int = 1, col: int = 1):
+        self._text = text
+        self._pos = pos
+        self._ln = line
+        self._line_start = pos - col + 1
+        self._base = (pos, line, self._line_start)
+
+    def __call__(self, pos: int) -> tuple[int, int]:
+        if pos < self._pos:
+            # rare backward lookup (error start), recount from the base
+            self._pos, self._ln, self._line_start = self._base
+        newlines: int = self._text.count('\n', self._pos, pos)
+        if newlines:
+            self._ln += newlines
+            self._line_start = self._text.rfind('\n', self._pos, pos) + 1
+        self._pos = pos
+        return self._ln, pos - self._line_start + 1
+
+
+def make_token(text: str, raw: RawToken,
+               locate: Callable[[int], tuple[int, int]],
+               pos_lim: int, base: int = 0) -> Token:
+    """ Build Token from the raw token
+        base is an absolute offset of the text (for chunks of a file) """
+    token_type, start, end, _, error = raw
+    ptr_pos: int = start
+    if token_type is TokenType.STR:
+        # strings point at the closing quote or at EOF if unterminated
+        ptr_pos = end if error else end - 1
+    line, col = locate(ptr_pos)
+    return Token(token_type, Pointer(pos_lim, base + ptr_pos, col, line),
+                 raw_value(text, raw))
+
+
+def make_error(raw_error: tuple, locate: Callable[[int], tuple[int, int]],
+               pos_lim: int, filename: str, base: int = 0) -> Error:
+    """ Build Error from the error part of the raw token """
+    err_type, msg, start, end = raw_error
+    line, col = locate(start)
+    pos_start = Pointer(pos_lim, base + start, col, line)
+    line, col = locate(end)
+    return err_type(msg, pos_start, Pointer(pos_lim, base + end, col, line),
+                    filename)
+
+
+def _token_pos(token: Token) -> int:
+    return token.pos_data.pos
+
+
+def _token_bounds(token: Token, size: int) -> tuple[int, int]:
+    """ Start offset of the token and offset where scanning resumed
+        after it, restored from Token (size is the text size) """
+    pos: int = token.pos_data.pos
+    length: int = len(token.value or '')
+    match token.token_type:
+        case TokenType.STR:
+            # unterminated string points at EOF, otherwise at closing quote
+            start: int = pos - length + (pos < size)
+            return start, start + length
+        case TokenType.COMMENT:
+            return pos, min(pos + length + 2, size)
+        case TokenType.KEYWORD:
+            return pos, min(pos + length + 1, size)
+        case TokenType.INT | TokenType.FLOAT:
+            return pos, pos + length
+    return pos, pos + 1
+
+
+def _shift_pointer(pointer: Pointer, shift: tuple[int, int, int],
+                   locate: Callable[[int], tuple[int, int]], pos_lim: int):
+    """ Move pointer from behind the edit to its new place
+        shift is (offset delta, line delta, last line of the edit) """
+    delta, line_delta, end_line = shift
+    pointer.pos += delta
+    pointer.pos_lim = pos_lim
+    if pointer.ln == end_line:
+        pointer.ln, pointer.col = locate(pointer.pos)
+    else:
+        pointer.ln += line_delta
+
+
+class SubsetClassifier:
+    """ Classifies words of the token stream with a compiled subset
+        (see subsets.compile_subset) and translates them to canonical
+        spelling, $SUBSET directive switches the subset """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, subset):
+        self.subset = subset
+        self._switch: bool = False
+
+    def __call__(self, token: Token) -> Token:
+        token_type: TokenType = token.token_type
+        if self._switch and token_type in (TokenType.STR, TokenType.KEYWORD):
+            self.subset = self.subset.switch(token.value.strip('"\''))
+        elif token_type is TokenType.KEYWORD:
+            token.token_type, token.value = self.subset.lookup(token.value)\
+                or (TokenType.IDENTIFIER, token.value)
+        self._switch = token_type is TokenType.DIRECTIVE and\
+            token.value == '$SUBSET'
+        return token
+
+
 class Lexer(TextData):
     """ Tokenizing text """
 
-    def tokenize(self, other: TextData | None = None
+    def tokenize(self, other: TextData | None = None, subset=None
                  ) -> Tuple[list[Token], Error]:
         """ Token generator
             If argument is ommited, tokenizes self
+            With compiled subset words come out classified and translated
             Returns list of Tokens and no_error bool """
+        result, errors = self._tokenize(other, subset, recover=False)
+        return result, errors[0] if errors else None
+
+    def tokenize_all(self, other: TextData | None = None, subset=None
+                     ) -> Tuple[list[Token], list[Error]]:
+        """ Error-recovering tokenize: after an illegal character
+            scanning resumes at the next whitespace, newline or quote
+            Returns list of Tokens and list of all errors """
+        return self._tokenize(other, subset, recover=True)
+
+    def _tokenize(self, other: TextData | None, subset, recover: bool
+                  ) -> Tuple[list[Token], list[Error]]:
+        # pylint: disable=too-many-locals  # state of the scan loop
+        this = self
+        errors: list[Error] = []
+        if isinstance(other, TextData):
+            this = other
+        text: str = this.get_text()
+        size: int = this.get_textsize()
+        filename: str = this.get_filename()
+        locate = _LineTracker(text, this.get_pos(),
+                              this.get_line(), this.get_col())
+        result: list[Token] = []
+        pos: int = this.get_pos()
+        classify = SubsetClassifier(subset) if subset else None
+        for raw in scan(text, pos, directives=bool(subset), recover=recover,
+                        names=bool(subset)):
+            pos = raw[3]
+            if raw[0] is not None:
+                result.append(make_token(text, raw, locate, size))
+                if classify:
+                    classify(result[-1])
+            if raw[4]:
+                errors.append(this.map_error(
+                    make_error(raw[4], locate, size, filename)))
+                if not recover:
+                    break
+        line, col = locate(pos)
+        this.reset(pos=pos, line=line, col=col)
+        return result, errors
+
+    def relex(self, tokens: list[Token], start: int, removed: int,
+              inserted: str, error: Error | None = None
+              ) -> Tuple[list[Token], Error]:
+        """ Apply an edit to the text and re-tokenize it incrementally
+            tokens and error are the previous result of tokenize() from
+            the beginning of the text. Edit replaces removed chars at start
+            with inserted. Only tokens around the edit are scanned again,
+            the rest are reused with shifted positions (pointers of the
+            previous tokens are updated in place)
+            Returns the same as full tokenize() of the edited text """
+        # pylint: disable=too-many-locals, too-many-branches  # one pass
+        old_text: str = self.get_text()
+        old_size: int = len(old_text)
+        start = min(max(start, 0), old_size)
+        removed = min(max(removed, 0), old_size - start)
+        old_end: int = start + removed
+        old_stop: int = self.get_pos()
+        end_line: int = old_text.count('\n', 0, old_end) + 1
+        delta: int = len(inserted) - removed
+        line_delta: int = inserted.count('\n') -\
+            old_text.count('\n', start, old_end)
+        self.reset(text=old_text[:start] + inserted + old_text[old_end:])
+        text: str = self.get_text()
+        size: int = len(text)
+
+        # keep tokens that could not look at the edited text
+        # (the token with an error is always scanned again)
+        kept: int = bisect_left(tokens, start, hi=len(tokens) - bool(error),
+                                key=_token_pos)
+        restart: int = 0
+        while kept > 0:
+            resume: int = _token_bounds(tokens[kept - 1], old_size)[1]
+            if resume < start:
+                restart = resume
+                break
+            kept -= 1
+
+        result: list[Token] = tokens[:kept]
+        new_error: Error | None = None
+        tail: list[Token] = []
+        unchanged: int = start + len(inserted)  # first unchanged offset
+        locate = _LineTracker(text)
+        stop: int = restart
+        old_idx: int = kept
+        for raw in scan(text, restart):
+            if raw[1] >= unchanged:
+                old_idx = bisect_left(tokens, raw[1] - delta, lo=old_idx,
+                                      key=_token_pos)
+                if old_idx < len(tokens) and raw[1] - delta ==\
+                        _token_bounds(tokens[old_idx], old_size)[0]:
+                    # back in sync: the rest is the same as before
+                    tail, new_error = tokens[old_idx:], error
+                    stop = old_stop + delta
+                    break
+            stop = raw[3]
+            if raw[0] is not None:
+                result.append(make_token(text, raw, locate, size))
+            if raw[4]:
+                new_error = make_error(raw[4], locate, size,
+                                       self.get_filename())
+                break
+
+        if delta:
+            for token in tokens[:kept]:
+                token.pos_data.pos_lim = size
+        for token in tail:
+            if token.pos_data.ln != end_line and not delta and not line_delta:
+                break  # nothing changes after the line of the edit
+            _shift_pointer(token.pos_data, (delta, line_delta, end_line),
+                           locate, size)
+        if new_error and tail:
+            for pointer in (new_error.pos_start, new_error.pos_end):
+                _shift_pointer(pointer, (delta, line_delta, end_line),
+                               locate, size)
+        result += tail
+        line, col = locate(stop)
+        self.reset(text=None, pos=stop, line=line, col=col)
+        return result, new_error
+
+    def tokenize_by_char(self, other: TextData | None = None
+                         ) -> Tuple[list[Token], Error]:
+        """ Reference tokenizer walking the text char by char
+            Kept to check and benchmark tokenize() against it """
         this = self
         error: Error | None = None
         if isinstance(other, TextData):
@@ -191,3 +572,110 @@ def run(text: str) -> (Token, Error | None):
     """ Run tokenizer """
     lex = Lexer(text)
     return lex.tokenize()
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def _chunk_reader(fd: IO) -> Callable[[int], str]:
+    """ Returns read(size) function decoding binary files on the fly """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(size: int) -> str:
+        while True:
+            chunk: str | bytes = fd.read(size)
+            if not isinstance(chunk, bytes):
+                return chunk
+            text: str = decoder.decode(chunk, final=not chunk)
+            # incomplete multibyte char is not the end of file
+            if text or not chunk:
+                return text
+    return read
+
+
+def _text_reader(data: TextData) -> Callable[[int], str]:
+    """ Returns read(size) function over TextData from its position """
+    pos: int = data.get_pos()
+
+    def read(size: int) -> str:
+        nonlocal pos
+        chunk: str = data.get_text(pos, end=pos + size)
+        pos += len(chunk)
+        return chunk
+    return read
+
+
+class TokenStream:
+    """ Lazily tokenized file
+        Iterating yields Tokens while reading the file chunk by chunk.
+        Only the unfinished token at the end of a chunk is kept in memory.
+        TextData (e.g. MappedTextData) is read from its position.
+        After iteration error holds the first Error (or None) """
+
+    def __init__(self, source: str | PathLike | IO | TextData,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, subset=None):
+        self._source = source
+        self._subset = subset
+        self.chunk_size: int = max(int(chunk_size), 1)
+        self.error: Error | None = None
+        if isinstance(source, str | PathLike):
+            self.filename: str = str(source)
+        elif isinstance(source, TextData):
+            self.filename = source.get_filename()
+        else:
+            self.filename = str(getattr(source, 'name', DEFAULT_FILENAME))
+
+    def __iter__(self) -> Iterator[Token]:
+        self.error = None
+        if isinstance(self._source, str | PathLike):
+            with open(self._source, 'r', encoding='utf-8') as fd:
+                yield from self._tokens(_chunk_reader(fd))
+        elif isinstance(self._source, TextData):
+            source: TextData = self._source
+            yield from self._tokens(_text_reader(source), source.get_pos(),
+                                    source.get_line(), source.get_col())
+        else:
+            yield from self._tokens(_chunk_reader(self._source))
+        if self.error and isinstance(self._source, TextData):
+            self._source.map_error(self.error)
+
+    def _tokens(self, read: Callable[[int], str], base: int = 0,
+                line: int = 1, col: int = 1) -> Iterator[Token]:
+        # base is the absolute offset of buf[0]
+        buf: str = ''
+        eof: bool = False
+        classify = SubsetClassifier(self._subset) if self._subset else None
+        while not eof:
+            # read more at once while a long token is pending
+            chunk: str = read(max(self.chunk_size, len(buf)))
+            eof = not chunk
+            buf += chunk
+            size: int = len(buf)
+            locate = _LineTracker(buf, 0, line, col)
+            keep: int = size
+            for raw in scan(buf, directives=bool(classify),
+                            names=bool(classify)):
+                if not eof and raw[3] >= size:
+                    # token may continue in the next chunk
+                    keep = raw[1]
+                    break
+                if raw[0] is not None:
+                    token: Token = make_token(buf, raw, locate,
+                                              base + size, base)
+                    yield classify(token) if classify else token
+                if raw[4]:
+                    self.error = make_error(raw[4], locate, base + size,
+                                            self.filename, base)
+                    return
+            line, col = locate(keep)
+            buf = buf[keep:]
+            base += keep
+
+
+def iter_tokens(fd_or_path: str | PathLike | IO | TextData,
+                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                subset=None) -> TokenStream:
+    """ Tokenize file lazily with bounded memory
+        Position data of tokens stays absolute across chunks,
+        but pos_lim is the amount of text read so far """
+    return TokenStream(fd_or_path, chunk_size, subset)
@@ -1,23 +1,44 @@
 # -*- coding: utf-8 -*-
 """ Simple logger """
 
-from datetime import datetime
+import atexit
+import re
+from datetime import datetime, timedelta
 import traceback as tb
-from inspect import stack
-from os import stat
+from itertools import islice
+from os import getpid, kill, listdir, remove, replace, stat
 from os.path import isfile, isdir, abspath
 from os.path import join as pathjoin, split as pathsplit
 from pathlib import Path
+from queue import Empty, SimpleQueue
+from sys import _getframe, platform
+from threading import BoundedSemaphore, Event, Lock, Thread
+from time import monotonic, time
+from typing import NamedTuple, TextIO
 from zipfile import ZipFile, ZIP_LZMA
 from enum import Enum
 
+import ubml
+
 
 IDENT = ' ' * 2
 LOG_SEPARATOR = '=' * 100
+QUEUE_SIZE = 10_000  # records waiting for the writer, log() blocks above
+FLUSH_SIZE = 64 * 1024  # chars written before the logfile is flushed
+FLUSH_INTERVAL = 0.5  # seconds records may wait in the file buffer
+_STOP = object()  # stops the writer thread
+_ROTATE = object()  # asks the writer thread to rotate the logfile
+_ARCHIVE_STAMP = r'(\d{4})-(\d\d)-(\d\d)-(\d\d)-(\d\d)-(\d\d)-(\d+)'
+_CLAIM = r'\.(?P<pid>\d+)\.claim'  # renamed logfile taken by an archiver
+RECORDS_SUFFIX = '.ubml'  # structured records, UBML-lines
+INDEX_SUFFIX = '.idx'  # sparse index of the records
+INDEX_EVERY = 64 * 1024  # bytes of records between entries of the index
+_ARCHIVE_LOCK = Lock()  # one archiver of the process at a time
+_SKIP_CALLERS = frozenset(('<module>', 'main', 'runcode', 'log', 'log_trace'))
 
 
 class LogLevel(Enum):
-    """ Log level enum """
+    """ Log level enum, records below the minimum value are dropped """
     INFO = 1
     DEBUG = 2
     WARN = 3
@@ -25,42 +46,308 @@ class LogLevel(Enum):
     ERROR = 4
 
 
+def archive_suffix(logfile: str) -> str:
+    """ Name of the archived logfile after the timestamp """
+    return f'.{logfile}' if logfile != 'last.log' else '.log'
+
+
+def list_archives(logpath: str,
+                  pending: bool = False) -> list[tuple[datetime, str]]:
+    """ (time of the name, path) of archives of the logfile, oldest first,
+        with pending renamed logfiles waiting for compression too
+        (by their names before the archiver claimed them) """
+    logdir, logfile = pathsplit(logpath)
+    kinds: str = rf'\.zip|{_CLAIM}|' if pending else r'\.zip'
+    zip_re: re.Pattern = re.compile(
+        f'(?P<base>{_ARCHIVE_STAMP}{re.escape(archive_suffix(logfile))})'
+        f'(?P<kind>{kinds})')
+    archives: dict[str, tuple[datetime, str]] = {}
+    for name in listdir(logdir):
+        if match := zip_re.fullmatch(name):
+            stamp: list[int] = [int(match[idx]) for idx in range(2, 9)]
+            is_zip: bool = match['kind'] == '.zip'
+            if is_zip or match['base'] not in archives:  # zip is complete
+                archives[match['base']] = (
+                    datetime(*stamp[:6], min(stamp[6], 999_999)),
+                    pathjoin(logdir, match['base'] + ('.zip' if is_zip
+                                                      else '')))
+    return sorted(archives.values())
+
+
+def _caller_name() -> str:
+    """ Name of the function which called Logger.log (or log_trace),
+        empty for private and top level ones """
+    name: str = _getframe(2).f_code.co_name
+    if name == 'log_trace':
+        name = _getframe(3).f_code.co_name
+    return '' if name.startswith('_') or name in _SKIP_CALLERS else name
+
+
+def _win_pid_alive(pid: int) -> bool:
+    """ Check if the process is running on Windows, where signal 0
+        of kill() would be CTRL_C_EVENT """
+    # pylint: disable=import-outside-toplevel
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE,
+                                            ctypes.POINTER(wintypes.DWORD))
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+    handle = kernel32.OpenProcess(0x1000, False, pid)  # query limited info
+    if not handle:
+        return ctypes.get_last_error() == 5  # access denied, it exists
+    try:
+        code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == 259  # STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _pid_alive(pid: int) -> bool:
+    """ Check if the process is running """
+    if platform == 'win32':
+        return _win_pid_alive(pid)
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:  # runs under another user
+        return True
+    return True
+
+
+class _RecordsSink:
+    """ Structured records in UBML-lines file with a sparse index:
+        a UBML-lines file of {time, offset} of a record every
+        index_every bytes, where time is the latest time of the records
+        before it. Records are appended in the order they are logged,
+        in async mode their times may be out of order """
+
+    def __init__(self, path: str, index_every: int = INDEX_EVERY):
+        self.path: str = path
+        self.index_path: str = path + INDEX_SUFFIX
+        self.index_every: int = index_every
+        self._dumper: ubml.UBMLDumper = ubml.UBMLDumper(mark_str='"')
+        self._offset: int = 0
+        self._next_index: int = 0
+        self._latest: float = 0.0  # time of the records written
+        if isfile(path):  # continued, next record gets into the index
+            file_stat = stat(path)
+            self._offset = self._next_index = file_stat.st_size
+            self._latest = file_stat.st_mtime  # records are written later
+
+    def reset(self):
+        """ Start empty files """
+        for path in (self.path, self.index_path):
+            with open(path, 'wb'):
+                pass
+        self._offset = self._next_index = 0
+        self._latest = 0.0
+
+    def write(self, records: list[dict]):
+        """ Append records, indexing them by the offset """
+        chunks: list[bytes] = []
+        entries: list[bytes] = []
+        offset: int = self._offset
+        latest: float = self._latest
+        for record in records:
+            data: bytes = (self._dumper.encode_line(record) + '\n')\
+                .encode('utf-8')
+            if offset >= self._next_index:
+                entries.append((self._dumper.encode_line(
+                    {'time': latest, 'offset': offset}) + '\n')
+                    .encode('utf-8'))
+                self._next_index = offset + self.index_every
+            latest = max(latest, record['time'])
+            chunks.append(data)
+            offset += len(data)
+        with open(self.path, 'ab') as file:
+            file.write(b''.join(chunks))
+        self._offset = offset
+        self._latest = latest
+        if entries:
+            with open(self.index_path, 'ab') as file:
+                file.write(b''.join(entries))
+
+
+class Rotation(NamedTuple):
+    """ Rotation policy: the logfile is archived on start (on_startup),
+        after max_size chars are written or interval seconds after
+        it is created (0 - never). Archives are compressed by
+        a background thread and only max_archives last ones are kept
+        (0 - all) """
+    on_startup: bool = True
+    max_size: int = 0
+    interval: float = 0
+    compression: int = ZIP_LZMA
+    compresslevel: int | None = 9
+    max_archives: int = 0
+
+
 class Logger:
     """ Logger write logs to file and console with log()
         It also can print traceback with log_trace()
+        In async mode log() only puts records to the queue, a background
+        thread keeps the logfile open and writes them by batches, in order
+        Records below min_level cost only the check of the level
+        Logfiles are rotated by the rotation policy, see Rotation
+        With structured records are also written as dicts of time, level,
+        owner, caller and msg into logfile.ubml, see logquery
     """
 
+    # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
     def __init__(self, logfile='last.log', logroot='logs', silent=False,
-                 announce=False):
+                 announce=False, async_mode=False, queue_size=QUEUE_SIZE,
+                 flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 min_level=LogLevel.INFO, rotation=Rotation(),
+                 structured=False):
         self.logfile: str = logfile
         self.silent: bool = silent
+        self.min_level: LogLevel = LogLevel.INFO
+        self._min_value: int = LogLevel.INFO.value
+        self.set_min_level(min_level)
+        self.queue_size: int = queue_size
+        self.flush_size: int = flush_size
+        self.flush_interval: float = flush_interval
+        self._queue: SimpleQueue | None = None
+        self._queue_lock: Lock = Lock()  # orders records and close()
+        self._slots: BoundedSemaphore | None = None
+        self._writer: Thread | None = None
+        self._error: OSError | None = None
+        self.rotation: Rotation = rotation
+        self._written: int = 0  # chars in the logfile
+        self._created: float = time()
+        self._archivers: list[Thread] = []
         if not logroot:
             logroot = abspath('.')
         self.logpath: str = abspath(pathjoin(logroot, logfile))
         if not isdir(pathsplit(self.logpath)[0]):
             Path(pathsplit(self.logpath)[0]).mkdir(parents=True, exist_ok=True)
+        self._sink: _RecordsSink | None = _RecordsSink(
+            self.logpath + RECORDS_SUFFIX) if structured else None
 
         if announce:
             self.log("Logging is active", no_log=True)
+        if not self.check_logfile():
+            self._create_logfile()
+        elif rotation.on_startup:
+            self._rotate()
+        else:  # continue the previous logfile
+            file_stat = stat(self.logpath)
+            self._written, self._created = file_stat.st_size, \
+                file_stat.st_ctime
+        if async_mode:
+            self.set_async(True)
+
+    def _rotate(self):
+        """ Rename the logfile for the archiver unless it has only
+            the header and start a new one """
         if self.check_logfile():
             with open(self.logpath, 'r', encoding='utf-8') as file:
-                line_count = sum(1 for _ in file)
-            if line_count <= 4:
-                self._create_logfile()
-                return
-            file_ctime: float = stat(self.logpath).st_ctime
-            raw_dt = datetime.fromtimestamp(file_ctime)
-            timeformat: str = f'%Y-%m-%d-%H-%M-%S-{raw_dt.microsecond}'
-            new_filename: str = raw_dt.strftime(timeformat)
-            new_filename += f'.{self.logfile}' if self.logfile != 'last.log'\
-                            else '.log'
-            new_filepath = Path(pathsplit(self.logpath)[0])
-            new_filepath /= (new_filename + '.zip')
-            with ZipFile(new_filepath, mode='x',
-                         compression=ZIP_LZMA, compresslevel=9) as filezip:
-                filezip.write(self.logpath, new_filename)
+                has_records: bool = sum(1 for _ in islice(file, 5)) > 4
+            if has_records:
+                logdir: str = pathsplit(self.logpath)[0]
+                raw_dt = datetime.fromtimestamp(stat(self.logpath).st_ctime)
+                while True:
+                    timeformat: str = \
+                        f'%Y-%m-%d-%H-%M-%S-{raw_dt.microsecond}'
+                    new_filename: str = raw_dt.strftime(timeformat) +\
+                        archive_suffix(self.logfile)
+                    new_filepath: str = pathjoin(logdir, new_filename)
+                    if not isfile(new_filepath) and\
+                            not isfile(new_filepath + '.zip'):
+                        break
+                    raw_dt += timedelta(microseconds=1)
+                for extra in (RECORDS_SUFFIX, RECORDS_SUFFIX + INDEX_SUFFIX):
+                    if isfile(self.logpath + extra):
+                        replace(self.logpath + extra, new_filepath + extra)
+                replace(self.logpath, new_filepath)
+                archiver: Thread = Thread(target=self._compress_archives,
+                                          name=f'Archiver {self.logfile}',
+                                          daemon=True)
+                self._archivers = [thread for thread in self._archivers
+                                   if thread.is_alive()] + [archiver]
+                archiver.start()
         self._create_logfile()
 
+    def _rotation_due(self) -> bool:
+        rotation: Rotation = self.rotation
+        return bool(rotation.max_size and self._written >= rotation.max_size
+                    or rotation.interval and
+                    time() >= self._created + rotation.interval)
+
+    def _compress_archives(self):
+        """ Archiver thread: compresses every renamed logfile with its
+            structured records, leftovers of stopped processes too,
+            then removes the oldest archives over max_archives.
+            A logfile is claimed by renaming it to a name with the pid,
+            so other processes and loggers skip it """
+        with _ARCHIVE_LOCK:
+            logdir: str = pathsplit(self.logpath)[0]
+            raw_re: re.Pattern = re.compile(
+                f'(?P<base>{_ARCHIVE_STAMP}'
+                f'{re.escape(archive_suffix(self.logfile))})(?:{_CLAIM})?')
+            rotation: Rotation = self.rotation
+            pid: int = getpid()
+            for name in listdir(logdir):
+                match: re.Match | None = raw_re.fullmatch(name)
+                if not match:
+                    continue
+                owner: str | None = match['pid']
+                if owner and int(owner) != pid and _pid_alive(int(owner)):
+                    continue  # compressed by another process
+                raw_path: str = pathjoin(logdir, match['base'])
+                claimed: str = f'{raw_path}.{pid}.claim'
+                try:
+                    replace(pathjoin(logdir, name), claimed)
+                except FileNotFoundError:  # claimed by another archiver
+                    continue
+                if owner and isfile(f'{raw_path}.{owner}.zip.part'):
+                    remove(f'{raw_path}.{owner}.zip.part')
+                extras: list[str] = [
+                    raw_path + extra for extra in
+                    (RECORDS_SUFFIX, RECORDS_SUFFIX + INDEX_SUFFIX)
+                    if isfile(raw_path + extra)]
+                part: str = f'{raw_path}.{pid}.zip.part'
+                with ZipFile(part, mode='w',
+                             compression=rotation.compression,
+                             compresslevel=rotation.compresslevel)\
+                        as filezip:
+                    filezip.write(claimed, match['base'])
+                    for extra in extras:
+                        filezip.write(extra, pathsplit(extra)[1])
+                replace(part, raw_path + '.zip')
+                for path in extras + [claimed]:
+                    remove(path)
+            if not rotation.max_archives:
+                return
+            for _, path in list_archives(self.logpath)[
+                    :-rotation.max_archives]:
+                remove(path)
+
+    def rotate(self):
+        """ Start a new logfile now, the previous one is compressed
+            in the background """
+        queue: SimpleQueue | None = self._queue
+        if queue is not None:
+            queue.put(_ROTATE)
+        else:
+            self._rotate()
+
+    def wait_archived(self, timeout: float | None = None):
+        """ Wait until rotated logfiles are compressed,
+            no longer than timeout seconds if it is given """
+        deadline: float | None = None if timeout is None\
+            else monotonic() + timeout
+        for archiver in self._archivers:
+            archiver.join(None if deadline is None
+                          else max(deadline - monotonic(), 0))
+        self._archivers = [archiver for archiver in self._archivers
+                           if archiver.is_alive()]
+
     def _create_logfile(self):
         with open(self.logpath, 'w+', encoding='utf-8') as file:
             if file.writable():
@@ -68,6 +355,10 @@ class Logger:
                 header += f'# Created: {datetime.now()}\n'
                 header += LOG_SEPARATOR + '\n\n'
                 file.write(header)
+                self._written = len(header)
+                self._created = time()
+                if self._sink:
+                    self._sink.reset()
             else:
                 raise OSError(f'Error @Logger: {self.logfile} '
                               'is not writable!')
@@ -76,30 +367,41 @@ class Logger:
         """ Check if logfile exists and creates it if not"""
         return self.logpath and isfile(self.logpath)
 
-    def log(self, msg: str, level=LogLevel.INFO, owner=None, no_log=False):
-        """ Log a message """
-        if not msg:
+    # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+    def log(self, msg: str, level=LogLevel.INFO, owner=None, no_log=False,
+            args: tuple = ()):
+        """ Log a message, formatted as msg % args if there are args,
+            only when the level is not below the minimum one """
+        level = level if isinstance(level, LogLevel) else LogLevel.INFO
+        if level.value < self._min_value or not msg:
             return
-        if not isinstance(level, LogLevel):
-            level = LogLevel.INFO
+        if args:
+            msg = msg % args
 
-        if owner is None:
-            owner = ''
-            caller = ''
-        else:
-            owner = '@' + owner
-            caller = stack()[1].function
-        if caller == 'log_trace':
-            caller = stack()[2].function
-
-        skip_names = {'<module>', 'main', 'runcode', 'log', 'log_trace'}
-        if caller and not caller.startswith('_') and caller not in skip_names:
-            caller = '#' + caller
-        else:
-            caller = ''
+        caller: str = '' if owner is None else _caller_name()
 
-        whole_msg = f"{datetime.now()} [{level.name}] "\
-                    f"{owner}{caller}\t: {msg}\n"
+        now: datetime = datetime.now()
+        whole_msg = f"{now} [{level.name}] "\
+                    f"{'' if owner is None else '@' + owner}"\
+                    f"{'#' + caller if caller else ''}\t: {msg}\n"
+        record: dict | None = None
+        if self._sink and not no_log:
+            record = {'time': now.timestamp(), 'level': level.name,
+                      'owner': owner, 'caller': caller or None, 'msg': msg}
+        slots: BoundedSemaphore | None = self._slots
+        if self._queue is not None:
+            if self._error:
+                raise self._error
+            # released by the writer thread or below
+            # pylint: disable=consider-using-with
+            slots.acquire()  # waits while the queue is full
+            with self._queue_lock:  # close() can't stop the writer now
+                queue: SimpleQueue | None = self._queue
+                if queue is not None:
+                    queue.put((whole_msg, not self.silent, not no_log,
+                               record))
+                    return
+            slots.release()  # closed meanwhile, written here after all
         if not self.silent:
             print(whole_msg, end='', flush=True)
         if not self.check_logfile():
@@ -112,10 +414,20 @@ class Logger:
                 raise OSError("Error @Logger: "
                               f"'{self.logfile}' is not writable!")
             file.write(whole_msg)
+        if record:
+            self._sink.write([record])
+        self._written += len(whole_msg)
+        if self._rotation_due():
+            self._rotate()
 
+    # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
     def log_trace(self, msg: str, err=Exception,
-                  level=LogLevel.ERROR, owner=None):
-        """ Log with trace """
+                  level=LogLevel.ERROR, owner=None, args: tuple = ()):
+        """ Log with trace, the stack is taken only for enabled levels """
+        if not self.is_enabled(level):
+            return
+        if args:
+            msg = msg % args
         rawtrace = tb.extract_stack()
         tracelist: list = tb.format_list(rawtrace)
         errtype: str = type(err).__name__
@@ -129,6 +441,149 @@ class Logger:
         message += '\n'
         self.log(message, level, owner)
 
+    @staticmethod
+    def _take_batch(queue: SimpleQueue, slots: BoundedSemaphore,
+                    timeout: float) -> tuple[list[str], list[str], list[dict],
+                                             list[Event], bool, bool]:
+        """ Items waiting in the queue, the first one is waited for up to
+            timeout seconds: lines to print, lines to write, records,
+            flush waiters, stop and rotate """
+        printed: list[str] = []
+        written: list[str] = []
+        records: list[dict] = []
+        waiters: list[Event] = []
+        stop: bool = False
+        rotate: bool = False
+        try:
+            item = queue.get(timeout=timeout)
+        except Empty:
+            item = None
+        while item is not None:
+            if item is _STOP:
+                stop = True
+            elif item is _ROTATE:
+                rotate = True
+            elif isinstance(item, Event):
+                waiters.append(item)
+            else:
+                slots.release()
+                if item[1]:
+                    printed.append(item[0])
+                if item[2]:
+                    written.append(item[0])
+                if item[3]:
+                    records.append(item[3])
+            try:
+                item = queue.get_nowait()
+            except Empty:
+                item = None
+        return printed, written, records, waiters, stop, rotate
+
+    def _write_batch(self, file: TextIO, written: list[str],
+                     records: list[dict], rotate: bool) -> tuple[TextIO, int]:
+        """ Write lines and records, rotate the logfile if asked or due.
+            Returns the logfile and chars written into it unflushed """
+        pending: int = 0
+        if written:
+            text: str = ''.join(written)
+            file.write(text)
+            pending = len(text)
+            self._written += pending
+        if records:
+            self._sink.write(records)
+        if rotate or self._rotation_due():
+            file.close()
+            pending = -1  # the closed logfile is flushed
+            self._rotate()
+            # pylint: disable=consider-using-with
+            file = open(self.logpath, 'a', encoding='utf8')
+        return file, pending
+
+    def _write_records(self, queue: SimpleQueue, slots: BoundedSemaphore,
+                       file: TextIO):
+        """ Writer thread: takes all waiting records at once, prints and
+            writes them, flushes the logfile by size, by time, on flush()
+            and when it is stopped """
+        pending: int = 0  # chars written since the last flush
+        last_flush: float = monotonic()
+        stop: bool = False
+        while not stop:
+            printed, written, records, waiters, stop, rotate =\
+                self._take_batch(queue, slots, self.flush_interval)
+            if printed:
+                print(''.join(printed), end='', flush=True)
+            try:
+                if not self._error:
+                    file, added = self._write_batch(file, written, records,
+                                                    rotate)
+                    pending = 0 if added < 0 else pending + added
+                if pending and (stop or waiters or pending >= self.flush_size
+                                or monotonic() - last_flush >=
+                                self.flush_interval):
+                    file.flush()
+                    pending = 0
+            except OSError as err:
+                self._error = OSError("Error @Logger: "
+                                      f"cannot write '{self.logfile}': {err}")
+            if not pending:
+                last_flush = monotonic()
+            for waiter in waiters:
+                waiter.set()
+        file.close()
+
+    def set_async(self, async_mode: bool = None):
+        """ Switch writing by the background thread """
+        if not isinstance(async_mode, bool):
+            async_mode = self._queue is None
+        if not async_mode:
+            self.close()
+            return
+        if self._queue is not None:
+            return
+        # pylint: disable=consider-using-with
+        file: TextIO = open(self.logpath, 'a', encoding='utf8')
+        if not file.writable():
+            raise OSError("Error @Logger: "
+                          f"'{self.logfile}' is not writable!")
+        self._error = None
+        self._slots = BoundedSemaphore(self.queue_size)
+        queue: SimpleQueue = SimpleQueue()
+        self._writer = Thread(target=self._write_records,
+                              args=(queue, self._slots, file),
+                              name=f'Logger {self.logfile}', daemon=True)
+        self._writer.start()
+        with self._queue_lock:
+            self._queue = queue
+        atexit.register(self.close)
+
+    def get_async(self) -> bool:
+        """ Getter for async mode """
+        return self._queue is not None
+
+    def flush(self):
+        """ Wait until queued records are written to the logfile """
+        queue: SimpleQueue | None = self._queue
+        if queue is None:
+            return
+        done: Event = Event()
+        queue.put(done)
+        done.wait()
+        if self._error:
+            raise self._error
+
+    def close(self):
+        """ Write queued records and stop the writer thread,
+            archivers are not waited for (see wait_archived): they are
+            daemons and the next process takes over their logfiles """
+        with self._queue_lock:
+            queue, self._queue = self._queue, None
+            if queue is None:
+                return
+            atexit.unregister(self.close)
+            queue.put(_STOP)
+            self._writer.join()  # records logged meanwhile follow them
+            self._writer = None
+
     def set_silent(self, silent: bool = None):
         """ Switch console print """
         if not isinstance(silent, bool):
@@ -140,6 +595,19 @@ class Logger:
         """ Getter fo silent"""
         return self.silent
 
+    def set_min_level(self, level: LogLevel):
+        """ Set the minimum level of logged records """
+        if not isinstance(level, LogLevel):
+            level = LogLevel.INFO
+        self.min_level = level
+        self._min_value = level.value
+
+    def is_enabled(self, level: LogLevel) -> bool:
+        """ Check if records of the level are logged """
+        if not isinstance(level, LogLevel):
+            level = LogLevel.INFO
+        return level.value >= self._min_value
+
 
 logger = Logger()
 log = logger.log
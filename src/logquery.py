@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+""" Query structured logs of Logger(structured=True)
+
+    python logquery.py [--level ERROR ...] [--owner name ...]
+                       [--since 2026-01-01T10:00] [--until ...]
+                       [--logfile last.log] [--logroot logs]
+"""
+
+import argparse
+import io
+from bisect import bisect_left
+from datetime import datetime
+from os.path import abspath, isdir, isfile
+from os.path import join as pathjoin, split as pathsplit
+from typing import IO, Iterable, Iterator
+from zipfile import ZipFile
+
+from logger import INDEX_SUFFIX, RECORDS_SUFFIX, LogLevel, list_archives
+import ubml
+
+
+def _read_index(fd: IO) -> tuple[list[float], list[int]]:
+    """ Times and offsets of the index entries """
+    times: list[float] = []
+    offsets: list[int] = []
+    for entry in ubml.load_lines(io.TextIOWrapper(fd, encoding='utf-8',
+                                                  newline='')):
+        times.append(entry['time'])
+        offsets.append(entry['offset'])
+    return times, offsets
+
+
+# pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+def _iter_records(fd: IO, index: tuple[list[float], list[int]],
+                  levels: set[str] | None, owners: set[str] | None,
+                  since: float | None, until: float | None
+                  ) -> Iterator[dict]:
+    """ Matching records of the binary records file, it is read from
+        the last indexed record with only earlier records before it
+        up to the end: in async mode times of records may be out
+        of order """
+    times, offsets = index
+    if since is not None and times:
+        entry: int = bisect_left(times, since) - 1
+        if entry >= 0:
+            fd.seek(offsets[entry])
+    for record in ubml.load_lines(io.TextIOWrapper(fd, encoding='utf-8',
+                                                   newline='')):
+        stamp: float = record['time']
+        if since is not None and stamp < since or\
+                until is not None and stamp > until:
+            continue
+        if levels and record['level'] not in levels:
+            continue
+        if owners and record['owner'] not in owners:
+            continue
+        yield record
+
+
+def query(logfile: str = 'last.log', logroot: str = 'logs',
+          levels: Iterable[str | LogLevel] | None = None,
+          owners: Iterable[str] | None = None,
+          since: datetime | float | None = None,
+          until: datetime | float | None = None,
+          archives: bool = True) -> Iterator[dict]:
+    """ Yields records of the logfile with the levels and owners in the
+        time range (datetime or timestamp) in the order they were logged,
+        oldest logfile first. Archives are searched too, read from
+        the zip files without extracting """
+    logpath: str = abspath(pathjoin(logroot or '.', logfile))
+    level_names: set[str] | None = {
+        (level if isinstance(level, LogLevel) else LogLevel[level]).name
+        for level in levels} if levels else None
+    owner_names: set[str] | None = set(owners) if owners else None
+    if isinstance(since, datetime):
+        since = since.timestamp()
+    if isinstance(until, datetime):
+        until = until.timestamp()
+    found: list[tuple[datetime, str]] = list_archives(logpath, True)\
+        if archives and isdir(pathsplit(logpath)[0]) else []
+    filters: tuple = (level_names, owner_names, since, until)
+    for _, path in found:
+        if path.endswith('.zip'):
+            yield from _iter_zipped(path, *filters)
+        elif isfile(path + RECORDS_SUFFIX):  # waits for compression
+            yield from _iter_logfile(path, *filters)
+        elif isfile(path + '.zip'):  # compressed after the listing
+            yield from _iter_zipped(path + '.zip', *filters)
+    yield from _iter_logfile(logpath, *filters)
+
+
+def _iter_logfile(logpath: str, *filters) -> Iterator[dict]:
+    """ Matching records of the logfile """
+    if not isfile(logpath + RECORDS_SUFFIX):
+        return
+    index: tuple[list[float], list[int]] = ([], [])
+    if isfile(logpath + RECORDS_SUFFIX + INDEX_SUFFIX):
+        with open(logpath + RECORDS_SUFFIX + INDEX_SUFFIX, 'rb') as fd:
+            index = _read_index(fd)
+    with open(logpath + RECORDS_SUFFIX, 'rb') as fd:
+        yield from _iter_records(fd, index, *filters)
+
+
+def _iter_zipped(path: str, *filters) -> Iterator[dict]:
+    """ Matching records of the archive, read without extracting """
+    with ZipFile(path) as filezip:
+        member: str = pathsplit(path)[1][:-len('.zip')] + RECORDS_SUFFIX
+        names: set[str] = set(filezip.namelist())
+        if member not in names:
+            return
+        index: tuple[list[float], list[int]] = ([], [])
+        if member + INDEX_SUFFIX in names:
+            with filezip.open(member + INDEX_SUFFIX) as fd:
+                index = _read_index(fd)
+        with filezip.open(member) as fd:
+            yield from _iter_records(fd, index, *filters)
+
+
+def format_record(record: dict) -> str:
+    """ Record as a line of the logfile """
+    owner: str = '' if record['owner'] is None else '@' + record['owner']
+    caller: str = '#' + record['caller'] if record['caller'] else ''
+    return f"{datetime.fromtimestamp(record['time'])} "\
+           f"[{record['level']}] {owner}{caller}\t: {record['msg']}"
+
+
+def _parse_time(value: str) -> datetime | float:
+    """ ISO datetime or timestamp """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Query structured logs')
+    parser.add_argument('--logfile', default='last.log')
+    parser.add_argument('--logroot', default='logs')
+    parser.add_argument('--level', nargs='+', choices=LogLevel.__members__,
+                        help='levels of the records')
+    parser.add_argument('--owner', nargs='+', help='owners of the records')
+    parser.add_argument('--since', type=_parse_time,
+                        help='ISO datetime or timestamp')
+    parser.add_argument('--until', type=_parse_time,
+                        help='ISO datetime or timestamp')
+    parser.add_argument('--no-archives', action='store_true',
+                        help='search the current logfile only')
+    args = parser.parse_args()
+    for record in query(args.logfile, args.logroot, args.level, args.owner,
+                        args.since, args.until, not args.no_archives):
+        print(format_record(record))
+
+
+if __name__ == "__main__":
+    main()
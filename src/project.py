@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+""" Working with unibasic projects (package.ubml + .ub files) """
+
+import re
+from concurrent.futures import ProcessPoolExecutor, Future, wait
+from concurrent.futures import FIRST_COMPLETED
+from os import cpu_count
+from os.path import abspath, dirname, isfile
+from os.path import join as pathjoin
+from pathlib import Path
+
+from errors import Error
+from tokenbuffer import TokenBuffer
+import ubml
+
+
+MANIFEST = 'package.ubml'
+SOURCE_EXT = '.ub'
+LIB_ROOT = abspath(pathjoin(dirname(__file__), '..', 'lib'))
+
+_LIB_RE = re.compile(r'\$LIB\(\s*["\']([^"\']+)["\']\s*\)')
+
+
+class ProjectTokens:
+    """ Tokenized project: manifest, TokenBuffer for every source file
+        and $LIB references which were not found """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, manifest: dict):
+        self.manifest: dict = manifest
+        self.files: dict[str, TokenBuffer] = {}
+        self.missing_libs: dict[str, list[str]] = {}
+
+    def errors(self) -> dict[str, Error]:
+        """ First error of every file that has one """
+        return {path: buf.error for path, buf in self.files.items()
+                if buf.error}
+
+    def all_errors(self) -> dict[str, list[Error]]:
+        """ Every error of every file that has one
+            (all of them only if the project was tokenized with recover) """
+        return {path: buf.errors for path, buf in self.files.items()
+                if buf.errors}
+
+
+def load_manifest(project_dir: str) -> dict:
+    """ Load package.ubml of the project """
+    manifest = ubml.load_cached(pathjoin(project_dir, MANIFEST))
+    if not isinstance(manifest, dict):
+        raise TypeError(f'{MANIFEST} of {project_dir} should be a dict, '
+                        f'got {type(manifest).__name__}')
+    return manifest
+
+
+def find_sources(project_dir: str) -> list[str]:
+    """ All .ub files of the project """
+    return sorted(str(path.resolve())
+                  for path in Path(project_dir).rglob('*' + SOURCE_EXT)
+                  if path.is_file())
+
+
+def lib_path(lib: str, lib_root: str = LIB_ROOT) -> str:
+    """ Path of $LIB("lib") source """
+    return abspath(pathjoin(lib_root, lib + SOURCE_EXT))
+
+
+def _tokenize_file(path: str, recover: bool = False
+                   ) -> tuple[TokenBuffer, list[str]]:
+    """ Worker: tokenize file, also returns its $LIB references """
+    with open(path, 'r', encoding='utf-8') as fd:
+        text: str = fd.read()
+    return TokenBuffer(text, path, recover), _LIB_RE.findall(text)
+
+
+def tokenize_project(project_dir: str, workers: int | None = None,
+                     lib_root: str = LIB_ROOT,
+                     recover: bool = False) -> ProjectTokens:
+    """ Tokenize every source of the project and libraries it loads
+        with $LIB(...) across a process pool of workers processes
+        (cpu count by default, 1 tokenizes in this process)
+        With recover every file reports all its errors in one pass """
+    result = ProjectTokens(load_manifest(project_dir))
+    queue: list[str] = find_sources(project_dir)
+    seen: set[str] = set(queue)
+
+    def collect(path: str, buf: TokenBuffer, libs: list[str]):
+        result.files[path] = buf
+        for lib in libs:
+            source: str = lib_path(lib, lib_root)
+            if source in seen:
+                continue
+            seen.add(source)
+            if isfile(source):
+                queue.append(source)
+            else:
+                result.missing_libs.setdefault(path, []).append(lib)
+
+    workers = workers or cpu_count() or 1
+    if workers == 1:
+        while queue:
+            path: str = queue.pop(0)
+            collect(path, *_tokenize_file(path, recover))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending: dict[Future, str] = {}
+            while queue or pending:
+                while queue:
+                    path = queue.pop(0)
+                    pending[pool.submit(_tokenize_file, path, recover)] = path
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(pending.pop(future), *future.result())
+    result.files = dict(sorted(result.files.items()))
+    return result
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 """ Working with subsets """
+from os.path import abspath, dirname, isfile
+from os.path import join as pathjoin
+
 from logger import log_trace
+from lexer import TokenType
+import ubml
 
 DEFAULT = {
         "ASSERT",
@@ -13,7 +18,42 @@ DEFAULT = {
         "EXIT",
         }
 
+TYPES = {
+        "NIL",
+        "ID",
+        "STR",
+        "INT8",
+        "INT16",
+        "INT32",
+        "INT",
+        "UINT8",
+        "UINT16",
+        "UINT32",
+        "UINT",
+        "FLOAT",
+        "DOUBLE",
+        "NUMERIC",
+        }
+
+RESERVED = {
+        "result",
+        "last_err",
+        "last_errmsg",
+        "last_cmd",
+        "true",
+        "false",
+        "nil",
+        }
+
+CATEGORIES: dict[TokenType, set[str]] = {
+    TokenType.KEYWORD: DEFAULT | {"LIB"},
+    TokenType.TYPE: TYPES,
+    TokenType.RESERVED: RESERVED,
+}
+
 LOGOWNER = 'subsets'
+SUBSETS_DIR = abspath(pathjoin(dirname(__file__), '..', 'subsets'))
+SUBSET_ALIASES = {'default': 'en_us'}
 
 
 def gen_subset(ubsub: dict, default: set[str] | None = None) -> dict:
@@ -23,18 +63,17 @@ def gen_subset(ubsub: dict, default: set[str] | None = None) -> dict:
 
     res: dict = {}
     if not isinstance(default, set):
-        log_trace("Invalid argument 'default'. "
-                  f"Expected set, got {type(default).__name__}",
-                  TypeError, owner=LOGOWNER)
+        log_trace("Invalid argument 'default'. Expected set, got %s",
+                  TypeError, owner=LOGOWNER,
+                  args=(type(default).__name__,))
         return res
 
     if not ubsub:
         # autogenerate default
         return {k: k for k in default}
     if not isinstance(ubsub, dict):
-        log_trace("Invalid argument 'ubsub'. "
-                  f"Expected dict, got {type(ubsub).__name__}",
-                  TypeError, owner=LOGOWNER)
+        log_trace("Invalid argument 'ubsub'. Expected dict, got %s",
+                  TypeError, owner=LOGOWNER, args=(type(ubsub).__name__,))
         return res
     for item in default:
         key = ubsub.get(item)
@@ -45,3 +84,63 @@ def gen_subset(ubsub: dict, default: set[str] | None = None) -> dict:
 
 
 DEFAULT_SUBSET = gen_subset(None)
+
+
+class CompiledSubset:
+    """ Classification table of a subset
+        Maps every spelling to (token type, canonical word) in one lookup,
+        words missing in the subset keep their canonical spelling """
+
+    def __init__(self, name: str, ubsub: dict | None = None,
+                 subsets_dir: str = SUBSETS_DIR):
+        self.name: str = name
+        self.subsets_dir: str = subsets_dir
+        self.table: dict[str, tuple[TokenType, str]] = {}
+        ubsub = {_canonical_key(k): v for k, v in (ubsub or {}).items()}
+        for token_type, words in CATEGORIES.items():
+            for word in words:
+                spelling = ubsub.get(word)
+                self.table[spelling if isinstance(spelling, str) and spelling
+                           else word] = (token_type, word)
+
+    def lookup(self, word: str) -> tuple[TokenType, str] | None:
+        """ (token type, canonical word) or None for unknown words """
+        return self.table.get(word)
+
+    def switch(self, name: str) -> 'CompiledSubset':
+        """ Compiled subset for $SUBSET directive """
+        return compile_subset(name, self.subsets_dir)
+
+
+def _canonical_key(key) -> str:
+    """ UBML turns true/false/nil keys into python values """
+    if key is None:
+        return 'nil'
+    if isinstance(key, bool):
+        return str(key).lower()
+    return str(key)
+
+
+_COMPILED: dict[str, CompiledSubset] = {}
+
+
+def compile_subset(name: str = 'default',
+                   subsets_dir: str = SUBSETS_DIR) -> CompiledSubset:
+    """ Compiled subset by name, built once per process
+        Unknown subsets fall back to canonical (en_us) spelling """
+    name = SUBSET_ALIASES.get(name, name)
+    path: str = pathjoin(subsets_dir, name + '.ubml')
+    if path not in _COMPILED:
+        ubsub: dict | None = None
+        if isfile(path):
+            ubsub = ubml.load_cached(path)
+        else:
+            log_trace("No subset '%s' in %s", FileNotFoundError,
+                      owner=LOGOWNER, args=(name, subsets_dir))
+        if ubsub is not None and not isinstance(ubsub, dict):
+            log_trace("Invalid subset '%s'. Expected dict, got %s",
+                      TypeError, owner=LOGOWNER,
+                      args=(name, type(ubsub).__name__))
+            ubsub = None
+        _COMPILED[path] = CompiledSubset(name, ubsub, subsets_dir)
+    return _COMPILED[path]
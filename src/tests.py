@@ -1,11 +1,26 @@
 # -*- coding: utf-8 -*-
 """ Tests """
 
+import io
+import os
 import time
 import json
-from typing import Any, Callable
+import tempfile
+import threading
+import tracemalloc
+import zipfile
+from array import array
+from typing import Any, Callable, NamedTuple
 
-from textdata import TextData, EOF
+from textdata import TextData, MappedTextData, EOF
+from lexer import Lexer, iter_tokens
+from logger import Logger, LogLevel, Rotation, list_archives
+import logquery
+from tokenbuffer import TokenBuffer
+import project
+from tokencache import TokenCache
+from file_worker import HashCheckFailed
+from subsets import compile_subset
 import ubml
 
 
@@ -180,6 +195,561 @@ def test_textdata() -> dict:
             'Addition is not working as intended'
         )
     ))
+
+    subtests_run(test_meta, subtest_result(
+        'Line and column of the offset',
+        assert_test(
+            [td.pos_to_linecol(pos) for pos in (0, 7, 8, 16, 17, 21)],
+            [(1, 1), (1, 8), (2, 1), (2, 9), (3, 1), (3, 5)],
+            'Wrong line or column'
+        )
+    ))
+
+    subtests_run(test_meta, subtest_result(
+        'Offset of the line and column round-trip',
+        assert_test(
+            [td.linecol_to_pos(*td.pos_to_linecol(pos))
+             for pos in range(len(test_text) + 1)],
+            list(range(len(test_text) + 1)),
+            'Wrong offset'
+        )
+    ))
+
+    td = TextData(test_text)
+    for _ in range(17):
+        td.next()
+    td.previous()
+    tmp = {'pos_lim': len(test_text), 'pos': 16, 'col': 9, 'ln': 2}
+    subtests_run(test_meta, subtest_result(
+        'Pointer state after previous() to the end of second line',
+        assert_test(td.get_pointer().as_dict(), tmp, 'Pointer mismatch')
+    ))
+
+    rope = TextData('PRELUDE\n', filename='prelude.ub') +\
+        TextData('', filename='empty.ub') +\
+        TextData('LIB 1\n2\n', filename='lib.ub') +\
+        TextData('MAIN', filename='main.ub')
+    subtests_run(test_meta, subtest_result(
+        'Concatenation keeps segments and their sources',
+        assert_test(
+            ([seg.get_filename() for seg in rope.get_segments()],
+             rope.get_text(), rope.get_text(5, end=15),
+             [rope.source_of(pos) for pos in (0, 8, 14, 16, 20)]),
+            (['prelude.ub', 'lib.ub', 'main.ub'], 'PRELUDE\nLIB 1\n2\nMAIN',
+             'DE\nLIB 1\n2',
+             [('prelude.ub', 1, 1), ('lib.ub', 1, 1), ('lib.ub', 2, 1),
+              ('main.ub', 1, 1), ('main.ub', 1, 5)]),
+            'Wrong segments or source mapping'
+        )
+    ))
+
+    flat = TextData('PRELUDE\nLIB 1\n2\nMAIN')
+    subtests_run(test_meta, subtest_result(
+        'Texts are equal by content whatever their storage is',
+        assert_test(
+            (rope == flat, flat == rope, rope != flat,
+             TextData('ab\n') + TextData('cd') == TextData('ab\ncd'),
+             rope == TextData('PRELUDE'), flat == flat.get_text()),
+            (True, True, False, True, False, False),
+            'Wrong comparison'
+        )
+    ))
+
+    test_text = 'ВЫВОДНС "привет"\n# ёжик 𝄞\nЖДИ 1.5\n'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path: str = os.path.join(tmpdir, 'mapped.ub')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(test_text)
+        # regions of 5 bytes cut through multibyte chars
+        with MappedTextData(path, region_size=5) as mapped:
+            td = TextData(test_text)
+            got: list = []
+            expected: list = []
+            for _ in range(len(test_text) + 1):
+                got.append((mapped.next(), mapped.get_pointer().as_dict()))
+                expected.append((td.next(), td.get_pointer().as_dict()))
+            subtests_run(test_meta, subtest_result(
+                'MappedTextData walks the text like TextData',
+                assert_test(got, expected, 'Chars or pointers mismatch')
+            ))
+
+            subtests_run(test_meta, subtest_result(
+                'MappedTextData decodes slices across regions',
+                assert_test(
+                    [mapped.get_text(start, end=start + 7)
+                     for start in range(len(test_text))] +
+                    [mapped.get_text(), mapped.get_text(-4)],
+                    [test_text[start:start + 7]
+                     for start in range(len(test_text))] +
+                    [test_text, test_text[-4:]],
+                    'Text mismatch'
+                )
+            ))
+
+            subtests_run(test_meta, subtest_result(
+                'MappedTextData equals TextData of the same text',
+                assert_test(
+                    (mapped == TextData(test_text),
+                     TextData(test_text) == mapped,
+                     mapped == TextData(test_text[:-1])),
+                    (True, True, False),
+                    'Wrong comparison'
+                )
+            ))
+
+            mapped.reset_pos()
+            tokens = [str(t) for t in iter_tokens(mapped, 4)]
+            subtests_run(test_meta, subtest_result(
+                'Streaming tokens of MappedTextData',
+                assert_test(
+                    tokens,
+                    [str(t) for t in Lexer(test_text).tokenize()[0]],
+                    'Tokens mismatch'
+                )
+            ))
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(test_text * 1_000_000)
+        times: list[float] = []
+        with MappedTextData(path) as mapped:
+            timestart: float = time.perf_counter()
+            first = next(iter(iter_tokens(mapped)))
+            times.append(time.perf_counter() - timestart)
+        with MappedTextData(path) as mapped:
+            timestart = time.perf_counter()
+            mapped.get_textsize()
+            times.append(time.perf_counter() - timestart)
+        t_treshold: float = 0.5
+        t_diff: float = times[0] / times[1]
+        subtests_run(test_meta, subtest_result(
+            'First token of a large MappedTextData without indexing it all',
+            assert_test(
+                (first.value, t_diff <= t_treshold),
+                ('ВЫВОДНС', True),
+                f'First token took too much -> {times[0]:.6f}, '
+                f'x{t_diff:.2f} (> {t_treshold}) of indexing the file'
+            ),
+            msg=f'Done in {times[0]:.6f}, x{t_diff:.2f} of indexing the file'
+        ))
+    return test_meta
+
+
+def _tokens_as_tuples(tokens: list) -> list[tuple]:
+    """ Comparable representation of tokens """
+    return [(t.token_type, t.value, t.pos_data.as_dict()) for t in tokens]
+
+
+def _error_as_tuple(err) -> tuple | None:
+    """ Comparable representation of error """
+    if err is None:
+        return None
+    return (err.name, err.msg, err.pos_start.as_dict(),
+            err.pos_end.as_dict(), err.filename)
+
+
+def test_lexer() -> dict:
+    """ Testing lexer """
+    test_meta: dict = {'subtests_number': 0,
+                       'successes': 0,
+                       'overall': True}
+
+    tokens, err = Lexer('PRINTLN "Hello, World!"\n# comment\n3 + 4.5\n'
+                        ).tokenize()
+    subtests_run(test_meta, subtest_result(
+        'Tokenizing simple script',
+        assert_test(
+            [str(t) for t in tokens] + [err],
+            ['KEYWORD:PRINTLN', 'STR:"Hello, World!"', 'NEWLINE',
+             'COMMENT: comment',
+             'INT:3', 'OP_PLUS', 'FLOAT:4.5', 'NEWLINE', None],
+            'Wrong tokens'
+        )
+    ))
+
+    sources: tuple = ('x = 1.2.3', '"unterminated', 'PRINT:', 'a $ b',
+                      '(1 + 2) ^ 3 % 4\n\n"esc\\"aped" ~ {x}\t# end',
+                      '5\n6', 'ВЫВОД 12²\nЖДИ')
+    mismatches: list = []
+    for source in sources:
+        expected, exp_err = Lexer(source).tokenize_by_char()
+        got, got_err = Lexer(source).tokenize()
+        if _tokens_as_tuples(expected) != _tokens_as_tuples(got) or\
+                _error_as_tuple(exp_err) != _error_as_tuple(got_err):
+            mismatches.append(source)
+    subtests_run(test_meta, subtest_result(
+        'Scanning engine matches char-by-char path (tokens and errors)',
+        assert_test(mismatches, [], 'Mismatching sources')
+    ))
+
+    def stream_key(tokens: list) -> list[tuple]:
+        return [(t.token_type, t.value, t.pos_data.pos, t.pos_data.ln,
+                 t.pos_data.col) for t in tokens]
+
+    mismatches = []
+    for source in sources:
+        expected, exp_err = Lexer(source).tokenize()
+        for chunk_size in (1, 3, 16):
+            for fd in (io.StringIO(source), io.BytesIO(source.encode())):
+                stream = iter_tokens(fd, chunk_size)
+                got = list(stream)
+                if stream_key(got) != stream_key(expected) or\
+                        (exp_err and exp_err.as_str()) !=\
+                        (stream.error and stream.error.as_str()):
+                    mismatches.append((source, chunk_size))
+    subtests_run(test_meta, subtest_result(
+        'Streaming tokenizer keeps positions across chunks',
+        assert_test(mismatches, [], 'Mismatching sources')
+    ))
+
+    mismatches = []
+    for source in sources:
+        expected, exp_err = Lexer(source).tokenize()
+        got, got_err = TokenBuffer(source).to_tokens()
+        if _tokens_as_tuples(expected) != _tokens_as_tuples(got) or\
+                _error_as_tuple(exp_err) != _error_as_tuple(got_err):
+            mismatches.append(source)
+    subtests_run(test_meta, subtest_result(
+        'TokenBuffer adapter yields the same Tokens',
+        assert_test(mismatches, [], 'Mismatching sources')
+    ))
+
+    source = 'PRINT a_b 1\nx = 1.2.3 $y "ok"\nWAIT @"s"\n"open'
+    tokens, errors = Lexer(source).tokenize_all()
+    subtests_run(test_meta, subtest_result(
+        'Recovering tokenizer reports all errors',
+        assert_test(
+            ([str(t) for t in tokens],
+             [(e.name, e.pos_start.ln, e.pos_start.col) for e in errors]),
+            (['KEYWORD:PRINT', 'KEYWORD:a', 'INT:1', 'NEWLINE',
+              'KEYWORD:x', 'OP_ASSIGN', 'FLOAT:1.2.3', 'STR:"ok"', 'NEWLINE',
+              'KEYWORD:WAIT', 'STR:"s"', 'NEWLINE', 'STR:"open'],
+             [('Illegal Character', 1, 7), ('Syntax Error', 2, 5),
+              ('Illegal Character', 2, 11), ('Illegal Character', 3, 6),
+              ('Syntax Error', 4, 1)]),
+            'Wrong tokens or errors'
+        )
+    ))
+
+    rope = TextData('PRINT 1\n', filename='prelude.ub') +\
+        TextData('WAIT 2\nx = 1.2.3\n', filename='lib.ub') +\
+        TextData('PRINT "main"\nINPUT $x\n', filename='main.ub')
+    _, errors = Lexer('').tokenize_all(rope)
+    subtests_run(test_meta, subtest_result(
+        'Errors of concatenated sources point at their files',
+        assert_test(
+            [err.as_str().split('\n')[0] for err in errors] +
+            [TokenBuffer(rope).error.as_str().split('\n')[0]],
+            ['File lib.ub, line 2, column 5', 'File main.ub, line 2, column 7',
+             'File lib.ub, line 2, column 5'],
+            'Wrong error positions'
+        )
+    ))
+
+    mismatches = []
+    for source in sources:
+        expected, exp_err = Lexer(source).tokenize()
+        got, got_errors = Lexer(source).tokenize_all()
+        buf = TokenBuffer(source, recover=True)
+        if _tokens_as_tuples(got[:len(expected)]) !=\
+                _tokens_as_tuples(expected) or\
+                _error_as_tuple(exp_err) !=\
+                _error_as_tuple(got_errors[0] if got_errors else None) or\
+                _tokens_as_tuples(buf) != _tokens_as_tuples(got) or\
+                list(map(_error_as_tuple, buf.errors)) !=\
+                list(map(_error_as_tuple, got_errors)):
+            mismatches.append(source)
+    subtests_run(test_meta, subtest_result(
+        'Recovering tokenizer agrees with tokenize up to the first error',
+        assert_test(mismatches, [], 'Mismatching sources')
+    ))
+
+    source = 'PRINTLN result\nSTR x last_err\n$SUBSET "ru_ru"\nВЫВОДНС '\
+        'результат посл_ошибка_сообщение ВЫВОД\n$SUBSET default\n'\
+        'PRINT правда\n'
+    tokens, err = Lexer(source).tokenize(subset=compile_subset())
+    subtests_run(test_meta, subtest_result(
+        'Words (with _ too) are classified and translated by subsets',
+        assert_test(
+            [f'{t.token_type.name}:{t.value}' for t in tokens
+             if t.token_type.name in ('KEYWORD', 'TYPE', 'RESERVED',
+                                      'IDENTIFIER')] + [err],
+            ['KEYWORD:PRINTLN', 'RESERVED:result', 'TYPE:STR',
+             'IDENTIFIER:x', 'RESERVED:last_err', 'KEYWORD:PRINTLN',
+             'RESERVED:result', 'RESERVED:last_errmsg', 'KEYWORD:PRINT',
+             'KEYWORD:default', 'KEYWORD:PRINT',
+             'IDENTIFIER:правда', None],
+            'Wrong classification'
+        )
+    ))
+
+    stream = iter_tokens(io.StringIO(source), 4, compile_subset())
+    subtests_run(test_meta, subtest_result(
+        'Compiled subsets are shared and work with streaming',
+        assert_test(
+            (compile_subset('ru_ru') is compile_subset('ru_ru'),
+             stream_key(list(stream))),
+            (True, stream_key(tokens)),
+            'Subsets are compiled twice or stream mismatch'
+        )
+    ))
+
+    line: str = 'SET x % INT = (12 + 3.25) * 7 ^ 2 / ВЫВОД ~ "some long '\
+                'string literal \\" with escaped quote"  # comment\n'
+    large_text: str = line * 5_000
+    times: list[float] = []
+    t_treshold: float = 1.5
+
+    timestart: float = time.perf_counter()
+    expected, _ = Lexer(large_text).tokenize_by_char()
+    times.append(time.perf_counter() - timestart)
+    timestart = time.perf_counter()
+    got, _ = Lexer(large_text).tokenize()
+    times.append(time.perf_counter() - timestart)
+    t_diff: float = times[0] / times[1]
+    subtests_run(test_meta, subtest_result(
+        'Same tokens for large text',
+        assert_test(_tokens_as_tuples(got), _tokens_as_tuples(expected),
+                    'Token streams mismatch')
+    ))
+    subtests_run(test_meta, subtest_result(
+        'Lexer speedup over char-by-char path '
+        f'({len(large_text) / 1024:.2f} kb)',
+        assert_test(
+            t_diff >= t_treshold,
+            True,
+            f'Tokenizing took too much -> {times[1]:.6f}, x{t_diff:.2f} '
+            f'(< {t_treshold}) faster than char-by-char'
+        ),
+        msg=f'Done in {times[1]:.6f}, x{t_diff:.2f} faster than char-by-char'
+    ))
+
+    edits: tuple = ((len(large_text) // 2, 0, '7'),
+                    (len(large_text) // 2, 40, ''),
+                    (10, 3, '"12\n'),
+                    (len(large_text) - 5, 5, 'ЖДИ'))
+    times = [0.0, 0.0]
+    mismatches = []
+    lex = Lexer(large_text)
+    tokens, err = lex.tokenize()
+    for edit in edits:
+        timestart = time.perf_counter()
+        tokens, err = lex.relex(tokens, *edit, error=err)
+        times[1] += time.perf_counter() - timestart
+        timestart = time.perf_counter()
+        expected, exp_err = Lexer(lex.get_text()).tokenize()
+        times[0] += time.perf_counter() - timestart
+        if _tokens_as_tuples(tokens) != _tokens_as_tuples(expected) or\
+                _error_as_tuple(err) != _error_as_tuple(exp_err):
+            mismatches.append(edit)
+    subtests_run(test_meta, subtest_result(
+        'Incremental re-lexing equals full re-lexing',
+        assert_test(mismatches, [], 'Mismatching edits')
+    ))
+    t_treshold = 5.0
+    t_diff = times[0] / times[1]
+    subtests_run(test_meta, subtest_result(
+        f'Incremental re-lexing speedup ({len(edits)} edits)',
+        assert_test(
+            t_diff >= t_treshold,
+            True,
+            f'Re-lexing took too much -> {times[1]:.6f}, x{t_diff:.2f} '
+            f'(< {t_treshold}) faster than full re-lexing'
+        ),
+        msg=f'Done in {times[1]:.6f}, x{t_diff:.2f} faster than '
+            'full re-lexing'
+    ))
+
+    memory: list[int] = []
+    for action in (lambda: Lexer(large_text).tokenize(),
+                   lambda: TokenBuffer(large_text)):
+        tracemalloc.start()
+        result = action()
+        memory.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del result
+    m_treshold: float = 10.0
+    m_diff: float = memory[0] / memory[1]
+    subtests_run(test_meta, subtest_result(
+        f'TokenBuffer memory usage ({len(got)} tokens)',
+        assert_test(
+            m_diff >= m_treshold,
+            True,
+            f'TokenBuffer takes too much -> {memory[1] / 1024:.2f} kb, '
+            f'x{m_diff:.2f} (< {m_treshold}) less than list of Tokens'
+        ),
+        msg=f'{memory[1] / 1024:.2f} kb, x{m_diff:.2f} less than '
+            f'list of Tokens ({memory[0] / 1024:.2f} kb)'
+    ))
+    return test_meta
+
+
+def test_project() -> dict:
+    """ Testing project tokenization """
+    test_meta: dict = {'subtests_number': 0,
+                       'successes': 0,
+                       'overall': True}
+
+    res = project.tokenize_project('../examples/default_proj', workers=1)
+    subtests_run(test_meta, subtest_result(
+        'Tokenizing examples/default_proj',
+        assert_test(
+            ([os.path.basename(path) for path in res.files],
+             res.manifest['name']),
+            (['master.ub'], 'master'),
+            'Wrong files or manifest'
+        )
+    ))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lib_root: str = os.path.join(tmpdir, 'lib')
+        proj_dir: str = os.path.join(tmpdir, 'proj')
+        os.makedirs(os.path.join(lib_root, 'std'))
+        os.makedirs(os.path.join(proj_dir, 'sub'))
+        files: dict[str, str] = {
+            os.path.join(proj_dir, 'package.ubml'): 'name = proj',
+            os.path.join(proj_dir, 'main.ub'):
+                'LOADPKG $LIB("std/a")\nPRINT "main"\n',
+            os.path.join(proj_dir, 'sub', 'other.ub'): 'x = 1.2.3\n',
+            os.path.join(lib_root, 'std', 'a.ub'):
+                'LOAD $LIB("std/b")\nLOAD $LIB("std/none")\n',
+            os.path.join(lib_root, 'std', 'b.ub'): 'WAIT 1\n',
+        }
+        for path, text in files.items():
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        serial = project.tokenize_project(proj_dir, 1, lib_root)
+        parallel = project.tokenize_project(proj_dir, 2, lib_root)
+        recovered = project.tokenize_project(proj_dir, 1, lib_root,
+                                             recover=True)
+
+    subtests_run(test_meta, subtest_result(
+        'Project sources and $LIB references are found',
+        assert_test(
+            sorted(os.path.relpath(path, tmpdir) for path in parallel.files),
+            sorted(os.path.relpath(path, tmpdir) for path in files
+                   if path.endswith('.ub')),
+            'Wrong files'
+        )
+    ))
+
+    subtests_run(test_meta, subtest_result(
+        'Missing libraries and errors are reported',
+        assert_test(
+            ([os.path.basename(path) for path in parallel.missing_libs],
+             {os.path.basename(path): err.msg
+              for path, err in parallel.errors().items()}),
+            (['a.ub'], {'a.ub': "got (24) $'", 'main.ub': "got (24) $'",
+                        'other.ub': 'too many dots for number'}),
+            'Wrong report'
+        )
+    ))
+
+    subtests_run(test_meta, subtest_result(
+        'Parallel and serial results are the same',
+        assert_test(
+            {path: _tokens_as_tuples(buf)
+             for path, buf in parallel.files.items()},
+            {path: _tokens_as_tuples(buf)
+             for path, buf in serial.files.items()},
+            'Results mismatch'
+        )
+    ))
+
+    subtests_run(test_meta, subtest_result(
+        'Recovering mode reports every error of a file',
+        assert_test(
+            {os.path.basename(path): [err.msg for err in errors]
+             for path, errors in recovered.all_errors().items()},
+            {'a.ub': ["got (24) $'", "got (24) $'"],
+             'main.ub': ["got (24) $'"],
+             'other.ub': ['too many dots for number']},
+            'Wrong report'
+        )
+    ))
+    return test_meta
+
+
+def test_tokencache() -> dict:
+    """ Testing token cache """
+    test_meta: dict = {'subtests_number': 0,
+                       'successes': 0,
+                       'overall': True}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source: str = '../lib/std/testing.ub'
+        cache = TokenCache(os.path.join(tmpdir, '__ubcache__'))
+        first = cache.tokenize(source)
+        second = cache.tokenize(source)
+        subtests_run(test_meta, subtest_result(
+            'Second tokenization is a cache hit',
+            assert_test(
+                (cache.hits, cache.misses,
+                 _tokens_as_tuples(second) == _tokens_as_tuples(first)),
+                (1, 1, True),
+                'Wrong counters or tokens'
+            )
+        ))
+
+        with open(source, 'r', encoding='utf-8') as f:
+            entry: str = cache.entry_path(f.read())
+        with open(entry, 'rb') as f:
+            data: bytes = f.read()
+        with open(entry, 'wb') as f:
+            f.write(data[:-1] + bytes([data[-1] ^ 1]))
+        subtests_run(test_meta, subtest_result(
+            'Tampered entry is rejected',
+            error_test(lambda: cache.load_entry(entry), HashCheckFailed)
+        ))
+        third = cache.tokenize(source)
+        subtests_run(test_meta, subtest_result(
+            'Tampered entry is replaced',
+            assert_test(
+                (cache.rejected, cache.misses,
+                 _tokens_as_tuples(third) == _tokens_as_tuples(first)),
+                (1, 2, True),
+                'Wrong counters or tokens'
+            )
+        ))
+
+        entry_size: int = cache.stats()['bytes']
+        cache.max_bytes = entry_size * 2
+        for idx in range(3):
+            cache.tokenize_text(f'PRINT {idx}\n' * 100)
+        subtests_run(test_meta, subtest_result(
+            'Least recently used entries are evicted',
+            assert_test(
+                (cache.stats()['bytes'] <= cache.max_bytes,
+                 cache.evictions > 0),
+                (True, True),
+                f'Cache is too big: {cache.stats()}'
+            )
+        ))
+
+        stale: str = os.path.join(cache.cache_dir, 'v0-stale.ubtok')
+        with open(stale, 'wb'):
+            pass
+        TokenCache(cache.cache_dir)
+        subtests_run(test_meta, subtest_result(
+            'Entries of other lexer versions are dropped',
+            assert_test(os.path.isfile(stale), False,
+                        'Stale entry is still here')
+        ))
+
+        text: str = 'PRINT "versioned"\n'
+        cache = TokenCache(os.path.join(tmpdir, '__versioned__'))
+        cache.tokenize_text(text)
+        entry = cache.entry_path(text)
+        old_entry: str = os.path.join(
+            cache.cache_dir, 'v1-' + os.path.basename(entry).split('-', 1)[1])
+        os.replace(entry, old_entry)
+        cache = TokenCache(cache.cache_dir)
+        cache.tokenize_text(text)
+        subtests_run(test_meta, subtest_result(
+            'Entry of another version prefix is a cache miss',
+            assert_test((cache.hits, cache.misses, os.path.isfile(old_entry)),
+                        (0, 1, False),
+                        'Entry of another version is used')
+        ))
     return test_meta
 
 
@@ -276,6 +846,342 @@ def test_ubml() -> dict:
                 ubml.InvalidSymbolError
             )
         ))
+    sources: tuple = (
+        'a = 1, b = [x, 2.5, {c: nil}], "d": "e\\"f", g: true',
+        '# comment \nkey = 1\n# next  \nother = -2',
+        "[\\,a, 'q\\'s', \"\\n\\t\\\\\", ёжик, +3]",
+        'x = "unterminated', 'a = 1.2.3', '[a: b]', 'k = [1} ', '{a = [1, {b')
+    mismatches: list = []
+    for source in sources:
+        results: list = []
+        for action in (lambda text=source: ubml.UBMLParser(text, '').result(),
+                       lambda text=source: ubml.loads(text)):
+            try:
+                results.append(action())
+            except (SyntaxError, TypeError, ubml.InvalidNumberError,
+                    ubml.InvalidSymbolError) as exc:
+                results.append(type(exc))
+        if results[0] != results[1]:
+            mismatches.append(source)
+    subtests_run(test_meta, subtest_result(
+        'Scanning engine matches UBMLParser (results and errors)',
+        assert_test(mismatches, [], 'Mismatching sources')
+    ))
+
+    subtests_run(test_meta, subtest_result(
+        'Streaming parser events',
+        assert_test(
+            list(ubml.iterparse(io.StringIO('a = [1, {b: nil}], c = x'), 3)),
+            [('start_map', None), ('key', 'a'), ('start_list', None),
+             ('value', 1), ('start_map', None), ('key', 'b'),
+             ('value', None), ('end_map', None), ('end_list', None),
+             ('key', 'c'), ('value', 'x'), ('end_map', None)],
+            'Wrong events'
+        )
+    ))
+
+    mismatches = []
+    for source in sources:
+        for chunk_size in (1, 4, 64):
+            results = []
+            for action in (lambda text=source: ubml.loads(text),
+                           lambda text=source, size=chunk_size:
+                           ubml.UBMLEvents(io.StringIO(text), size).result()):
+                try:
+                    results.append(action())
+                except (SyntaxError, TypeError, ubml.InvalidNumberError,
+                        ubml.InvalidSymbolError) as exc:
+                    results.append((type(exc), str(exc)))
+            if results[0] != results[1]:
+                mismatches.append((source, chunk_size))
+    subtests_run(test_meta, subtest_result(
+        'Objects built from events match loads (results and errors)',
+        assert_test(mismatches, [], 'Mismatching sources')
+    ))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = ubml.LoadCache(max_entries=2, check_hash=True)
+        paths: list[str] = [os.path.join(tmpdir, f'{name}.ubml')
+                            for name in 'abc']
+        for idx, path in enumerate(paths):
+            with open(path, 'w', encoding='utf-8') as f:
+                ubml.dump({'idx': idx, 'items': [idx]}, f)
+        first: dict = cache.load(paths[0])
+        first['items'].append('mutated')
+        view = cache.load(paths[0], readonly=True)
+        subtests_run(test_meta, subtest_result(
+            'Load cache hit gives a copy or a read-only view',
+            assert_test(
+                (cache.load(paths[0]), view['items'],
+                 error_test(lambda: view.update(idx=1), AttributeError),
+                 cache.stats()['hits'], cache.stats()['misses']),
+                ({'idx': 0, 'items': [0]}, (0,), 'SUCCESS', 2, 1),
+                'Cached data is mutable or not reused'
+            ),
+            msg=f'Stats: {cache.stats()}'
+        ))
+
+        stat: os.stat_result = os.stat(paths[0])
+        with open(paths[0], 'w', encoding='utf-8') as f:
+            ubml.dump({'idx': 9, 'items': [0]}, f)
+        os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        changed: dict = cache.load(paths[0])
+        with open(paths[0], 'w', encoding='utf-8') as f:
+            ubml.dump({'idx': 10}, f)
+        subtests_run(test_meta, subtest_result(
+            'Load cache invalidation on changed files',
+            assert_test(
+                (changed['idx'], cache.load(paths[0])['idx'],
+                 cache.stats()['invalidations']),
+                (9, 10, 2),
+                'Stale data is returned'
+            ),
+            msg=f'Stats: {cache.stats()}'
+        ))
+
+        for path in paths:
+            cache.load(path)
+        stats: dict = cache.stats()
+        subtests_run(test_meta, subtest_result(
+            'Load cache LRU eviction',
+            assert_test(
+                (stats['entries'], stats['evictions'],
+                 cache.load(paths[2])['idx'], cache.stats()['hits'] -
+                 stats['hits']),
+                (2, 1, 2, 1),
+                'Wrong eviction'
+            ),
+            msg=f'Stats: {cache.stats()}'
+        ))
+
+        crlf_path: str = os.path.join(tmpdir, 'crlf.ubml')
+        with open(crlf_path, 'wb') as f:
+            f.write(b'a = "x\r\ny",\r\nb = 2 # c\r\n,c=[1,\r\n2]\r\n')
+        with open(crlf_path, 'r', encoding='utf-8') as f:
+            loaded_crlf: Any = ubml.load(f)
+        subtests_run(test_meta, subtest_result(
+            'Load cache of CRLF file matches load',
+            assert_test(
+                (cache.load(crlf_path), loaded_crlf),
+                ({'a': 'x\ny', 'b': 2, 'c': [1, 2]},) * 2,
+                'Newlines are not translated'
+            )
+        ))
+
+    compiled_obj: dict = {'nil': None, 'flags': [True, False],
+                          'ints': [0, 127, 128, -1, -129, 2 ** 70, -2 ** 70],
+                          'floats': [0.5, -1e300], 'text': 'Ёж 𝄞 "\n"',
+                          1: {'nested': [[], {}]}, None: 'nil key'}
+    subtests_run(test_meta, subtest_result(
+        'Compiled UBML round trip',
+        assert_test(
+            (ubml.loads_compiled(ubml.dumps_compiled(compiled_obj)),
+             error_test(ubml.loads_compiled, ubml.InvalidCompiledError,
+                        (ubml.dumps_compiled(compiled_obj)[:-1],))),
+            (compiled_obj, 'SUCCESS'),
+            'Wrong decoding of compiled UBML'
+        )
+    ))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path: str = os.path.join(tmpdir, 'conf.ubml')
+        with open(path, 'w', encoding='utf-8') as f:
+            ubml.dump(test_dict, f)
+        target: str = ubml.compile(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            compiled_res: Any = ubml.load(f)
+        stat: os.stat_result = os.stat(path)
+        with open(target, 'wb') as f:  # proves that load reads it
+            f.write(ubml.dumps_compiled(
+                'compiled', (stat.st_mtime_ns, stat.st_size)))
+        with open(path, 'r', encoding='utf-8') as f:
+            preferred: Any = ubml.load(f)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(', extra=1')
+        with open(path, 'r', encoding='utf-8') as f:
+            stale: Any = ubml.load(f)
+    subtests_run(test_meta, subtest_result(
+        'Load prefers a fresh compiled file',
+        assert_test(
+            (target.endswith('conf.ubmlc'), compiled_res, preferred,
+             stale == dict(test_dict, extra=1)),
+            (True, test_dict, 'compiled', True),
+            'Compiled file is ignored or stale one is used'
+        )
+    ))
+
+    empty: dict = {'a': [], 'b': {}, 'c': [1, {}]}
+    subtests_run(test_meta, subtest_result(
+        'Empty containers are dumped unquoted',
+        assert_test(
+            (ubml.dumps(empty, mark_str='"'), ubml.dumps(empty, as_json=True),
+             ubml.loads(ubml.dumps(empty, mark_str='"'))),
+            ('"a"=[],"b"={},"c"=[1,{}]', '{"a": [], "b": {}, "c": [1, {}]}',
+             empty),
+            'Wrong empty containers'
+        )
+    ))
+
+    line_values: list = [test_dict, 5, 'x, y', None, True, [], {}, [[1]],
+                         'q "x"', 'a\rb', 'c\r\nd',
+                         {'k': {}, 1: [-1.5, '12']}]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'records.ubmll')
+        with open(path, 'w', encoding='utf-8') as f:
+            ubml.dump_lines(line_values[:5], f)
+        with open(path, 'ab') as f:
+            f.write(b'[broken')  # interrupted write, parser closes the list
+        ubml.append_lines(path, line_values[5:])
+        with open(path, 'r', encoding='utf-8') as f:
+            loaded: list = list(ubml.load_lines(f))
+        parallel: list = list(ubml.load_lines_parallel(path, workers=2,
+                                                       chunk_size=16))
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('[1, 2]\n')
+        errors: list[str] = []
+        for workers in (1, 2):
+            try:
+                list(ubml.load_lines_parallel(path, workers, chunk_size=16))
+            except ubml.InvalidSymbolError as err:
+                errors.append(str(err).rsplit(':', 1)[-1])
+    expected_lines: list = line_values[:5] + ['broken'] + line_values[5:]
+    subtests_run(test_meta, subtest_result(
+        'UBML-lines dump, append and load in default newline mode',
+        assert_test(
+            (loaded, parallel, errors),
+            (expected_lines, expected_lines, ['14', '14']),
+            'Wrong values or error lines'
+        )
+    ))
+
+    class Pet(NamedTuple):
+        """ Pet record """
+        name: str
+        specie: str | None = None
+
+    person = ubml.record_class('Person', {
+        'Name': str, 'Sirname': str, 'Age': int, 'pets': list[Pet],
+        'Money': float, 'Debt': float, 'alive': bool,
+        'Friends': list[str] | None, 'Enemies': list[str]})
+    people: list = ubml.loads('[{Name=Ann, Sirname=Lee, Age=30, pets=[{name: '
+                              'Rex}], Money=10, Debt=0.5, alive=false, '
+                              'Friends=nil, Enemies=[]}]',
+                              schema=list[person])
+    subtests_run(test_meta, subtest_result(
+        'Decoding into record types',
+        assert_test(
+            (people, people[0].pets[0].specie, type(people[0].Money)),
+            ([person('Ann', 'Lee', 30, [Pet('Rex')], 10.0, 0.5, False,
+                     None, [])], None, float),
+            'Wrong records'
+        )
+    ))
+    node = ubml.record_class('Node', {'name': str,
+                                      'children': list['Node']})
+    subtests_run(test_meta, subtest_result(
+        'Records referring to themselves',
+        assert_test(
+            ubml.loads('{name: a, children: [{name: b, children: []}]}',
+                       schema=node),
+            node('a', [node('b', [])]),
+            'Wrong records'
+        )
+    ))
+    subtests_run(test_meta, subtest_result(
+        'Schema errors are raised while parsing',
+        assert_test(
+            tuple(error_test(ubml.loads, ubml.SchemaError, (text, 1, schema))
+                  for text, schema in (
+                      ('[{name: 1}]', list[Pet]),
+                      ('[{name: x, age: 1}]', list[Pet]),
+                      ('[{specie: x}]', list[Pet]),
+                      ('a: [1, true]', dict[str, list[int]]))),
+            ('SUCCESS',) * 4,
+            'Wrong values are accepted'
+        )
+    ))
+
+    typed_text: str = json.dumps([test_dict] * 10_000)
+    sizes: list[int] = []
+    for schema in (None, list[person]):
+        tracemalloc.start()
+        typed_res: Any = ubml.loads(typed_text, schema=schema)
+        sizes.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del typed_res
+    m_treshold = 0.6
+    subtests_run(test_meta, subtest_result(
+        'Memory of records against dicts',
+        assert_test(
+            sizes[1] <= sizes[0] * m_treshold,
+            True,
+            f'Records take too much memory -> {sizes[1] / 1024:.2f} kb, '
+            f'x{sizes[1] / sizes[0]:.2f} (> {m_treshold}) of dicts'
+        ),
+        msg=f'{sizes[1] / 1024:.2f} kb, x{sizes[1] / sizes[0]:.2f} of dicts'
+    ))
+
+    records: dict = {'meta': {'items': [1, 2]},
+                     'records': [dict(test_dict, id=idx)
+                                 for idx in range(20_000)],
+                     'tail': None}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path: str = os.path.join(tmpdir, 'records.ubml')
+        with open(path, 'w', encoding='utf-8') as f:
+            size: int = ubml.dump(records, f)
+        with open(path, 'r', encoding='utf-8') as f:
+            subtests_run(test_meta, subtest_result(
+                'Items of the nested list',
+                assert_test(list(ubml.iter_items(f, ('meta', 'items'))),
+                            [1, 2], 'Wrong items')
+            ))
+        tracemalloc.start()
+        matches: int = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for idx, item in enumerate(ubml.iter_items(f, 'records')):
+                matches += item == records['records'][idx]
+        peak: int = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    m_treshold: float = 0.5
+    subtests_run(test_meta, subtest_result(
+        f'Iterating items of large file ({size / 1024:.2f} kb)',
+        assert_test(
+            (matches, peak <= size * m_treshold),
+            (len(records['records']), True),
+            f'Wrong items or too much memory -> {peak / 1024:.2f} kb'
+        ),
+        msg=f'peak {peak / 1024:.2f} kb'
+    ))
+
+    chunks: list[str] = list(ubml.UBMLDumper(ident=2).iterencode(records))
+    subtests_run(test_meta, subtest_result(
+        'Dumping by chunks',
+        assert_test(
+            (len(chunks) > 1, ''.join(chunks)),
+            (True, ubml.dumps(records, ident=2)),
+            'Chunks differ from dumps'
+        ),
+        msg=f'{len(chunks)} chunks'
+    ))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, 'records.ubml'), 'w',
+                  encoding='utf-8') as f:
+            tracemalloc.start()
+            size = ubml.dump(records, f, ident=4)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    m_treshold = 0.1
+    subtests_run(test_meta, subtest_result(
+        f'Dumping large object into file ({size / 1024:.2f} kb)',
+        assert_test(
+            peak <= size * m_treshold,
+            True,
+            f'Too much memory -> {peak / 1024:.2f} kb'
+        ),
+        msg=f'peak {peak / 1024:.2f} kb'
+    ))
+
     large_object: list[dict] = [test_dict.copy() for _ in range(10_000)]
     times: list[float] = []
     t_treshold: float = 25.0
@@ -300,12 +1206,12 @@ def test_ubml() -> dict:
     ))
 
     times = []
-    t_treshold: float = 70.0
+    t_treshold: float = 15.0
     timestart = time.perf_counter()
     json.loads(large_text)
     times.append(time.perf_counter() - timestart)
     timestart = time.perf_counter()
-    ubml.loads(large_text)
+    serial_res: Any = ubml.loads(large_text)
     times.append(time.perf_counter() - timestart)
     t_diff = times[1] / times[0]
     subtests_run(test_meta, subtest_result(
@@ -320,6 +1226,343 @@ def test_ubml() -> dict:
         msg=f'Done in {times[1]:.6f}, x{t_diff:.2f} of JSON time'
     ))
 
+    timestart = time.perf_counter()
+    parallel_res: Any = ubml.loads(large_text, workers=2)
+    parallel_time: float = time.perf_counter() - timestart
+    bad_text: str = large_text[:-5000] + '%' + large_text[-5000:]
+    messages: list[str] = []
+    for workers in (1, 2):
+        try:
+            ubml.loads(bad_text, workers=workers)
+        except ubml.InvalidNumberError as err:
+            messages.append(str(err))
+    subtests_run(test_meta, subtest_result(
+        'UBML loads of large list across processes',
+        assert_test(
+            (parallel_res == serial_res == large_object, len(messages),
+             len(set(messages))),
+            (True, 2, 1),
+            f'Wrong result or error -> {messages}'
+        ),
+        msg=f'Done in {parallel_time:.6f} with 2 workers '
+            f'({os.cpu_count()} CPUs), '
+            f'x{parallel_time / times[1]:.2f} of one process time'
+    ))
+
+    compiled: bytes = ubml.dumps_compiled(large_object)
+    timestart = time.perf_counter()
+    ubml.loads_compiled(compiled)
+    times.append(time.perf_counter() - timestart)
+    t_treshold = 5.0
+    t_diff = times[2] / times[0]
+    subtests_run(test_meta, subtest_result(
+        'Compiled UBML loads performance comparison with JSON and UBML '
+        f'({len(compiled) / 1024:.2f} kb)',
+        assert_test(
+            (t_diff <= t_treshold, times[2] < times[1]),
+            (True, True),
+            f'Loading took too much -> {times[2]:.6f}, x{t_diff:.2f} '
+            f'(> {t_treshold}) of JSON time, '
+            f'x{times[2] / times[1]:.2f} of UBML time'
+        ),
+        msg=f'Done in {times[2]:.6f}, x{t_diff:.2f} of JSON time, '
+            f'x{times[2] / times[1]:.2f} of UBML time'
+    ))
+
+    numbers: dict = {'ints': [1, -2, +3], 'floats': [0.5, -1.25],
+                     'mixed': [1, 2.5], 'nested': [[1, 2], [3]],
+                     'other': [1, 'a']}
+    packed: dict = ubml.loads(ubml.dumps(numbers), arrays=True)
+    subtests_run(test_meta, subtest_result(
+        'Numeric lists as arrays',
+        assert_test(
+            (ubml.loads(ubml.dumps(numbers)), packed,
+             ubml.dumps(packed, ident=2)),
+            (numbers, {'ints': array('q', [1, -2, 3]),
+                       'floats': array('d', [0.5, -1.25]),
+                       'mixed': array('d', [1.0, 2.5]),
+                       'nested': [array('q', [1, 2]), array('q', [3])],
+                       'other': [1, 'a']},
+             ubml.dumps(dict(numbers, mixed=[1.0, 2.5]), ident=2)),
+            'Wrong numeric lists'
+        )
+    ))
+
+    numeric_text: str = json.dumps({'ints': list(range(-100_000, 100_000)),
+                                    'floats': [idx / 8 for idx in
+                                               range(200_000)]})
+    times = []
+    for kwargs in ({}, {'arrays': True}):
+        timestart = time.perf_counter()
+        numeric_res: Any = ubml.loads(numeric_text, **kwargs)
+        times.append(time.perf_counter() - timestart)
+        del numeric_res
+    timestart = time.perf_counter()
+    json.loads(numeric_text)
+    t_diff = times[0] / (time.perf_counter() - timestart)
+    t_treshold = 5.0
+    subtests_run(test_meta, subtest_result(
+        'UBML loads of numeric lists performance comparison with JSON '
+        f'({len(numeric_text) / 1024:.2f} kb)',
+        assert_test(
+            t_diff <= t_treshold,
+            True,
+            f'Loading took too much -> {times[0]:.6f}, x{t_diff:.2f} '
+            f'(> {t_treshold}) of JSON time'
+        ),
+        msg=f'Done in {times[0]:.6f}, x{t_diff:.2f} of JSON time, '
+            f'{times[1]:.6f} into arrays'
+    ))
+
+    return test_meta
+
+
+def test_logger() -> dict:
+    """ Testing logger """
+    test_meta: dict = {'subtests_number': 0,
+                       'successes': 0,
+                       'overall': True}
+
+    def records(path: str) -> list[str]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.rsplit(': ', 1)[1] for line in f.read().splitlines()
+                    if '[INFO]' in line]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        logger = Logger('async.log', tmpdir, silent=True, async_mode=True,
+                        queue_size=8)
+
+        def write(thread: int):
+            for idx in range(500):
+                logger.log(f'{thread} {idx}')
+
+        threads: list = [threading.Thread(target=write, args=(thread,))
+                         for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.log('hidden', no_log=True)
+        logger.flush()
+        written: list[str] = records(logger.logpath)
+        subtests_run(test_meta, subtest_result(
+            'Async records of every thread are written in order',
+            assert_test(
+                (len(written), [[item for item in written
+                                 if item.startswith(f'{thread} ')]
+                                for thread in range(4)]),
+                (2000, [[f'{thread} {idx}' for idx in range(500)]
+                        for thread in range(4)]),
+                'Records are lost or reordered'
+            )
+        ))
+
+        logger.log('last queued')
+        logger.close()
+        logger.log('synchronous')
+        subtests_run(test_meta, subtest_result(
+            'Closing writes queued records and switches to sync mode',
+            assert_test(
+                (records(logger.logpath)[-2:], logger.get_async()),
+                (['last queued', 'synchronous'], False),
+                'Wrong records'
+            )
+        ))
+
+        closing = Logger('closing.log', tmpdir, silent=True,
+                         async_mode=True, queue_size=8)
+
+        def write_closing(thread: int):
+            for idx in range(500):
+                closing.log(f'{thread} {idx}')
+
+        threads = [threading.Thread(target=write_closing, args=(thread,))
+                   for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        closing.close()
+        for thread in threads:
+            thread.join()
+        written = records(closing.logpath)
+        subtests_run(test_meta, subtest_result(
+            'Records logged while closing are kept in order',
+            assert_test(
+                [[item for item in written if item.startswith(f'{thread} ')]
+                 for thread in range(4)],
+                [[f'{thread} {idx}' for idx in range(500)]
+                 for thread in range(4)],
+                'Records are lost or reordered'
+            )
+        ))
+
+        formatted: list[int] = []
+
+        class Lazy:
+            """ Counts formatting """
+            def __str__(self) -> str:
+                formatted.append(1)
+                return 'lazy'
+
+        def caller_name():
+            logger.log('from %s', LogLevel.ERROR, 'tests', args=(Lazy(),))
+
+        logger.set_min_level(LogLevel.WARN)
+        logger.log('dropped %s', LogLevel.DEBUG, 'tests', args=(Lazy(),))
+        logger.log_trace('dropped %s', ValueError, LogLevel.INFO, 'tests',
+                         args=(Lazy(),))
+        caller_name()
+        with open(logger.logpath, 'r', encoding='utf-8') as f:
+            last_line: str = f.read().splitlines()[-1]
+        subtests_run(test_meta, subtest_result(
+            'Records below the minimum level are not formatted',
+            assert_test(
+                (len(formatted), last_line.split(' ', 2)[2]),
+                (1, '[ERROR] @tests#caller_name\t: from lazy'),
+                'Wrong records'
+            )
+        ))
+
+        times: list[float] = []
+        for level in (LogLevel.DEBUG, LogLevel.ERROR):
+            logger.set_silent(True)
+            logger.set_async(True)
+            timestart: float = time.perf_counter()
+            for idx in range(10_000):
+                logger.log('record %d', level, 'tests', args=(idx,))
+            times.append(time.perf_counter() - timestart)
+            logger.close()
+        t_treshold: float = 10.0
+        t_diff: float = times[1] / times[0]
+        subtests_run(test_meta, subtest_result(
+            'Filtered records against logged ones',
+            assert_test(
+                t_diff >= t_treshold,
+                True,
+                f'Filtering took too much -> {times[0]:.6f}, '
+                f'x{t_diff:.2f} (< {t_treshold}) faster than logging'
+            ),
+            msg=f'Done in {times[0]:.6f}, x{t_diff:.2f} faster than logging'
+        ))
+
+        with open(logger.logpath, 'a', encoding='utf-8') as f:
+            f.write('previous record\n' * 200_000)
+        timestart = time.perf_counter()
+        logger = Logger('async.log', tmpdir, silent=True)
+        startup: float = time.perf_counter() - timestart
+        logger.wait_archived()
+        archives: list[str] = [name for name in os.listdir(tmpdir)
+                               if name.endswith('.async.log.zip')]
+        with zipfile.ZipFile(os.path.join(tmpdir, archives[0])) as f:
+            archived: bytes = f.read(f.namelist()[0])
+        subtests_run(test_meta, subtest_result(
+            'Previous logfile is archived in the background',
+            assert_test(
+                (len(archives), archived.count(b'previous record'),
+                 len(records(logger.logpath))),
+                (1, 200_000, 0),
+                'Wrong archive or logfile'
+            ),
+            msg=f'Started in {startup:.6f}'
+        ))
+
+        dead_pid: int = 2 ** 22 + 1  # over pid_max
+        stale: str = os.path.join(
+            tmpdir, f'2020-01-01-00-00-00-0.claimed.log.{dead_pid}.claim')
+        taken: str = os.path.join(
+            tmpdir, f'2020-01-01-00-00-01-0.claimed.log.{os.getppid()}.claim')
+        for path in (stale, taken, stale[:-len('.claim')] + '.zip.part'):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('old record\n')
+        logger = Logger('claimed.log', tmpdir, silent=True)
+        logger.log('record')
+        logger.rotate()
+        logger.wait_archived(10.0)
+        claimed: list[str] = sorted(name for name in os.listdir(tmpdir)
+                                    if 'claimed.log' in name)
+        subtests_run(test_meta, subtest_result(
+            'Archivers skip logfiles claimed by running processes',
+            assert_test(
+                (claimed[0], os.path.basename(taken) in claimed,
+                 [name for name in claimed if name.endswith('.part')],
+                 [os.path.basename(path) for _, path in
+                  list_archives(logger.logpath, True)][:2]),
+                ('2020-01-01-00-00-00-0.claimed.log.zip', True, [],
+                 ['2020-01-01-00-00-00-0.claimed.log.zip',
+                  '2020-01-01-00-00-01-0.claimed.log']),
+                f'Wrong archives -> {claimed}'
+            )
+        ))
+
+        logger = Logger('sized.log', tmpdir, silent=True, rotation=Rotation(
+            max_size=2000, compression=zipfile.ZIP_DEFLATED,
+            compresslevel=6, max_archives=3))
+        for idx in range(200):
+            logger.log(f'record {idx}')
+        logger.wait_archived()
+        archives = sorted(name for name in os.listdir(tmpdir)
+                          if name.endswith('.sized.log.zip'))
+        written = []
+        for name in archives:
+            with zipfile.ZipFile(os.path.join(tmpdir, name)) as f:
+                written.extend(line.rsplit(': ', 1)[1] for line in
+                               f.read(f.namelist()[0]).decode().splitlines()
+                               if '[INFO]' in line)
+        written.extend(records(logger.logpath))
+        subtests_run(test_meta, subtest_result(
+            'Rotation by size keeps last archives',
+            assert_test(
+                (len(archives), written[-1],
+                 written == [f'record {idx}' for idx in
+                             range(200 - len(written), 200)]),
+                (3, 'record 199', True),
+                'Wrong archives'
+            )
+        ))
+
+        logger = Logger('records.log', tmpdir, silent=True, structured=True,
+                        rotation=Rotation(max_size=50_000))
+        for idx in range(3000):
+            logger.log('record %d', LogLevel.ERROR if idx % 100 == 0
+                       else LogLevel.INFO, 'even' if idx % 2 else 'odd',
+                       args=(idx,))
+        logger.wait_archived()
+        archived: int = len(list_archives(logger.logpath))
+        found: list[dict] = list(logquery.query(
+            'records.log', tmpdir, levels=['ERROR'], owners=['odd']))
+        middle: float = next(logquery.query(
+            'records.log', tmpdir, owners=['even']))['time']
+        timestart = time.perf_counter()
+        ranged: list[dict] = list(logquery.query(
+            'records.log', tmpdir, owners=['even'], since=middle,
+            until=middle))
+        subtests_run(test_meta, subtest_result(
+            'Structured records are found in logfile and archives',
+            assert_test(
+                (archived > 1,
+                 [record['msg'] for record in found],
+                 [record['msg'] for record in ranged]),
+                (True, [f'record {idx}' for idx in range(0, 3000, 100)],
+                 ['record 1']),
+                'Wrong records'
+            ),
+            msg=f'{archived} archives, time range found in '
+                f'{time.perf_counter() - timestart:.6f}'
+        ))
+
+        with open(os.path.join(tmpdir, 'shuffled.log.ubml'), 'w',
+                  encoding='utf-8') as f:  # queued out of order in async mode
+            ubml.dump_lines([{'time': stamp, 'msg': str(stamp)}
+                             for stamp in (1.0, 3.0, 2.0, 4.0, 2.5)], f)
+        subtests_run(test_meta, subtest_result(
+            'Records out of order are found in the time range',
+            assert_test(
+                [record['msg'] for record in logquery.query(
+                    'shuffled.log', tmpdir, since=2.0, until=2.5,
+                    archives=False)],
+                ['2.0', '2.5'],
+                'Wrong records'
+            )
+        ))
     return test_meta
 
 
@@ -327,7 +1570,8 @@ def main():
     """ Main function """
     print("Starting tests\n")
     outer_start_time: float = time.perf_counter()
-    tests: tuple = (test_textdata, test_ubml)
+    tests: tuple = (test_textdata, test_lexer, test_project,
+                    test_tokencache, test_ubml, test_logger)
     counter: int = 0
     successes: int = 0
     for test in tests:
@@ -2,11 +2,21 @@
 """ Working with text (filename, pos, etc)"""
 # pylint: disable=too-many-positional-arguments, too-many-arguments,
 
+import copy
+import mmap
+from bisect import bisect_right
+from collections import OrderedDict
+from os import PathLike
+from typing import Callable
+
 from textpointer import TextPointer
 
 
 DEFAULT_FILENAME = '<stdin>'
 EOF = '<EOF>'
+DEFAULT_REGION_SIZE = 1024 * 1024
+MAX_REGIONS = 4
+_CONTINUATION = bytes(range(0x80, 0xc0))  # utf-8 continuation bytes
 
 
 class TextData:
@@ -16,6 +26,7 @@ class TextData:
         self._text: str = text if isinstance(text, str) else str(text) or ''
         self._txtsize: int = len(self._text)
         self._filename: str = str(filename)
+        self._line_starts: list[int] | None = None
 
         _pos: int = max(pos, 0) if isinstance(pos, int) else 0
         _line: int = max(line, 1) if isinstance(line, int) else 1
@@ -29,11 +40,14 @@ class TextData:
                        filename=self._filename)
         # pylint: disable = protected-access
         res._pointer = self._pointer.copy()
+        res._line_starts = self._line_starts
         return res
 
     def reset(self, text=None, pos=0, line=1, col=1, filename=None):
         """ Reset to initial values, or change certain parameters """
-        self._text = text if isinstance(text, str) else self._text
+        if isinstance(text, str):
+            self._text = text
+            self._line_starts = None
         self._txtsize = len(self._text)
         self._pointer.reset(self._txtsize, pos, col, line)
         self._filename = self._filename if not filename else str(filename)
@@ -46,7 +60,7 @@ class TextData:
         """ Return char at current position
             Returns EOF at the end of text """
         text_pos: int = self._pointer.pos
-        if pos and isinstance(pos, int):
+        if isinstance(pos, int):
             text_pos = max(0, pos)
         if text_pos >= self._txtsize:
             return EOF
@@ -88,6 +102,33 @@ class TextData:
             end = None
         return self._text[start:end:step]
 
+    def _get_line_starts(self) -> list[int]:
+        """ Offsets of the line beginnings, computed on first use """
+        if self._line_starts is None:
+            line_starts: list[int] = [0]
+            newline: int = self._text.find('\n')
+            while newline >= 0:
+                line_starts.append(newline + 1)
+                newline = self._text.find('\n', newline + 1)
+            self._line_starts = line_starts
+        return self._line_starts
+
+    def pos_to_linecol(self, pos: int) -> tuple[int, int]:
+        """ Line and column of the offset in the text """
+        pos = min(max(pos, 0), self._txtsize)
+        line_starts: list[int] = self._get_line_starts()
+        line: int = bisect_right(line_starts, pos)
+        return line, pos - line_starts[line - 1] + 1
+
+    def linecol_to_pos(self, line: int, col: int) -> int:
+        """ Offset of the line and column in the text
+            Column is clamped to the end of the line """
+        line_starts: list[int] = self._get_line_starts()
+        line = min(max(line, 1), len(line_starts))
+        line_end: int = line_starts[line] - 1 if line < len(line_starts)\
+            else self._txtsize
+        return min(line_starts[line - 1] + max(col, 1) - 1, line_end)
+
     def next(self) -> str:
         """ Move pointer to the next char
         in text and returns this char """
@@ -98,25 +139,371 @@ class TextData:
     def previous(self) -> str:
         """ Move pointer to the previous char
         in text and returns this char """
-        newline = self.get_char(self.get_pos() - 1) == '\n'
-        prev_col = self.get_pos() -\
-            max(self._text.rfind('\n', 0, self.get_pos() - 1), 0)
+        pos: int = self.get_pos()
+        newline = pos > 0 and self.get_char(pos - 1) == '\n'
+        prev_col = self.pos_to_linecol(pos - 1)[1] if newline else 0
         self._pointer.recede(newline, prev_col)
         return self.get_char()
 
     def __eq__(self, other) -> bool:
-        return type(self) is type(other) and self._text == other.get_text()
+        """ Texts are compared by content whatever their storage is """
+        return isinstance(other, TextData) and\
+            self.get_textsize() == other.get_textsize() and\
+            self.get_text() == other.get_text()
 
     def __ne__(self, other) -> bool:
-        return type(self) is not type(other) or not self == other
+        return not self == other
+
+    def source_of(self, pos: int) -> tuple[str, int, int]:
+        """ Filename, line and column where the offset comes from """
+        return self.get_filename(), *self.pos_to_linecol(pos)
+
+    def map_error(self, error):
+        """ Point error at its source, the text itself is the source """
+        return error
 
     def __add__(self, other) -> 'TextData':
-        if type(self) is not type(other):
+        """ Concatenation is a rope of both texts, nothing is copied """
+        if not isinstance(other, TextData):
             err = TypeError("unsupported operand type(s) for +: "
                             f"'{type(self).__name__}' and "
                             f"'{type(other).__name__}'")
             raise err
-        res = self.copy()
-        if other.get_textsize() > 0:
-            res._text += str(other.get_text())
+        res = RopeTextData((self, other))
+        # pylint: disable = protected-access
+        res._pointer = self._pointer.copy()
+        res._pointer.pos_lim = res.get_textsize()
+        return res
+
+
+class _LazyLimitPointer(TextPointer):
+    """ Pointer of MappedTextData: pos_lim (the text size) is found
+        only when it is asked for, advance() checks the next char only """
+    # pylint: disable=super-init-not-called
+
+    def __init__(self, size: Callable[[], int],
+                 has_char: Callable[[int], bool],
+                 pos: int = 0, column: int = 0, line: int = 0):
+        self._size = size
+        self._has_char = has_char
+        self.reset(pos, pos, column, line)
+
+    @property
+    def pos_lim(self) -> int:
+        """ Size of the text """
+        return self._size()
+
+    def copy(self):
+        return _LazyLimitPointer(self._size, self._has_char, pos=self.pos,
+                                 column=self.col, line=self.ln)
+
+    def reset(self, pos_lim: int = 0, pos: int = 0,
+              column: int = 0, line: int = 0):
+        """ Reset pointer, pos past the end of the text is moved to it """
+        pos = min(max(pos, 0), pos_lim)
+        self.pos = pos if not pos or self._has_char(pos - 1)\
+            else self._size()
+        self.col = max(column, 1)
+        self.ln = max(line, 1)
+
+    def advance(self, newline: bool = False):
+        if self._has_char(self.pos):
+            self.pos += 1
+        self.col += 1
+        if newline:
+            self.col = 1
+            self.ln += 1
+
+    def as_dict(self) -> dict:
+        return {'pos_lim': self.pos_lim, 'pos': self.pos,
+                'col': self.col, 'ln': self.ln}
+
+
+class MappedTextData(TextData):
+    """ Read-only TextData over a memory-mapped utf-8 file
+        Text is decoded lazily by regions cut at char boundaries,
+        only the last MAX_REGIONS decoded regions are kept in memory.
+        Positions are char offsets, the same as for TextData """
+    # pylint: disable=super-init-not-called
+
+    def __init__(self, path: str | PathLike, pos=0, line=1, col=1,
+                 filename=None, region_size: int = DEFAULT_REGION_SIZE):
+        self._path: str = str(path)
+        self._filename: str = str(filename or path)
+        with open(path, 'rb') as fd:
+            try:
+                self._mmap: mmap.mmap | bytes = mmap.mmap(
+                    fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file can't be mapped
+                self._mmap = b''
+        self._bytesize: int = len(self._mmap)
+        # a utf-8 char takes up to 4 bytes
+        self._region_size: int = max(int(region_size), 4)
+        # byte and char offsets of the indexed regions (and their end)
+        self._byte_starts: list[int] = [0]
+        self._char_starts: list[int] = [0]
+        self._regions: OrderedDict[int, str] = OrderedDict()
+        self._line_starts: list[int] | None = None
+        self._start: tuple[int, int, int] = (
+            max(pos, 0) if isinstance(pos, int) else 0,
+            max(line, 1) if isinstance(line, int) else 1,
+            max(col, 1) if isinstance(col, int) else 1)
+        self._lazy_pointer: TextPointer | None = None
+
+    @property
+    def _txtsize(self) -> int:
+        """ Size of text in chars, indexes the whole file on first use """
+        while self._index_next():
+            pass
+        return self._char_starts[-1]
+
+    @property
+    def _pointer(self) -> TextPointer:
+        if self._lazy_pointer is None:
+            pos, line, col = self._start
+            self._lazy_pointer = _LazyLimitPointer(
+                self.get_textsize, self._has_char, pos=pos,
+                line=line, column=col)
+        return self._lazy_pointer
+
+    def _has_char(self, pos: int) -> bool:
+        """ Check if there is a char at pos, indexing regions up to it """
+        return self._region_idx(pos) >= 0
+
+    def _index_next(self) -> bool:
+        """ Index the next region, False if the whole file is indexed """
+        start: int = self._byte_starts[-1]
+        if start >= self._bytesize:
+            return False
+        end: int = min(start + self._region_size, self._bytesize)
+        while start < end < self._bytesize and\
+                self._mmap[end] in _CONTINUATION:
+            end -= 1
+        if end == start:  # not utf-8, decoding will tell where
+            end = min(start + self._region_size, self._bytesize)
+        chars: int = len(self._mmap[start:end].translate(None, _CONTINUATION))
+        self._byte_starts.append(end)
+        self._char_starts.append(self._char_starts[-1] + chars)
+        return True
+
+    def _region_idx(self, pos: int) -> int:
+        """ Index of the region with the char at pos, -1 after the end """
+        while pos >= self._char_starts[-1] and self._index_next():
+            pass
+        if pos >= self._char_starts[-1]:
+            return -1
+        return bisect_right(self._char_starts, pos) - 1
+
+    def _region(self, idx: int) -> str:
+        """ Decoded region """
+        text: str | None = self._regions.get(idx)
+        if text is None:
+            text = str(self._mmap[self._byte_starts[idx]:
+                                  self._byte_starts[idx + 1]], 'utf-8')
+            self._regions[idx] = text
+            if len(self._regions) > MAX_REGIONS:
+                self._regions.popitem(last=False)
+        else:
+            self._regions.move_to_end(idx)
+        return text
+
+    def close(self):
+        """ Unmap the file """
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._regions.clear()
+
+    def __enter__(self) -> 'MappedTextData':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def copy(self):
+        """ Returns copy of self sharing the mapping and its index """
+        res = copy.copy(self)
+        # pylint: disable = protected-access
+        res._lazy_pointer = self._pointer.copy()
+        return res
+
+    def reset(self, text=None, pos=0, line=1, col=1, filename=None):
+        """ Reset position or filename, text of the file can't be changed """
+        if text is not None:
+            raise TypeError('MappedTextData is read-only')
+        self._start = (pos, line, col)
+        self._lazy_pointer = None
+        self._filename = self._filename if not filename else str(filename)
+
+    def get_char(self, pos=None) -> str:
+        """ Return char at current position
+            Returns EOF at the end of text """
+        text_pos: int = max(0, pos) if isinstance(pos, int)\
+            else self._pointer.pos
+        idx: int = self._region_idx(text_pos)
+        if idx < 0:
+            return EOF
+        return self._region(idx)[text_pos - self._char_starts[idx]]
+
+    def get_text(self, start=None, step=None, end=None) -> str:
+        """ Get text whole or from start to end by step
+            Only the regions of the slice are decoded """
+        start = start if isinstance(start, int) else None
+        step = step if isinstance(step, int) else None
+        end = end if isinstance(end, int) else None
+        if (start or 0) < 0 or end is None or end < 0 or (step or 1) < 0:
+            start, end, _ = slice(start, end, step).indices(self._txtsize)
+        start = start or 0
+        if end <= start:
+            return ''
+        parts: list[str] = []
+        idx: int = self._region_idx(start)
+        while 0 <= idx < len(self._char_starts) - 1 and\
+                self._char_starts[idx] < end:
+            region_start: int = self._char_starts[idx]
+            parts.append(self._region(idx)[max(start - region_start, 0):
+                                           end - region_start])
+            idx = self._region_idx(self._char_starts[idx + 1])
+        return ''.join(parts)[::step]
+
+    def _get_line_starts(self) -> list[int]:
+        """ Offsets of the line beginnings, computed on first use """
+        if self._line_starts is None:
+            line_starts: list[int] = [0]
+            idx: int = self._region_idx(0)
+            while idx >= 0:
+                region: str = self._region(idx)
+                base: int = self._char_starts[idx]
+                newline: int = region.find('\n')
+                while newline >= 0:
+                    line_starts.append(base + newline + 1)
+                    newline = region.find('\n', newline + 1)
+                idx = self._region_idx(self._char_starts[idx + 1])
+            self._line_starts = line_starts
+        return self._line_starts
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MappedTextData):
+            return super().__eq__(other)
+        # pylint: disable = protected-access
+        if self._bytesize != other._bytesize:
+            return False
+        for start in range(0, self._bytesize, self._region_size):
+            end: int = start + self._region_size
+            if self._mmap[start:end] != other._mmap[start:end]:
+                return False
+        return True
+
+
+class RopeTextData(TextData):
+    """ Concatenation of TextData segments (prelude, libraries, script)
+        Segments are shared, not copied, so joining is O(segments).
+        Positions are offsets in the whole text, source_of() maps them
+        back to the file, line and column of the segment """
+    # pylint: disable=super-init-not-called
+
+    def __init__(self, segments, pos=0, line=1, col=1, filename=None):
+        self._segments: list[TextData] = []
+        for segment in segments:
+            if isinstance(segment, RopeTextData):
+                # pylint: disable = protected-access
+                self._segments.extend(segment._segments)
+            elif segment.get_textsize():
+                self._segments.append(segment.copy())
+        if not filename and segments:
+            filename = segments[0].get_filename()
+        self._filename: str = str(filename)
+        self._index_segments()
+        _pos: int = max(pos, 0) if isinstance(pos, int) else 0
+        _line: int = max(line, 1) if isinstance(line, int) else 1
+        _col: int = max(col, 1) if isinstance(col, int) else 1
+        self._pointer = TextPointer(self._txtsize, pos=_pos,
+                                    line=_line, column=_col)
+
+    def _index_segments(self):
+        """ Offsets of the segments in the whole text """
+        self._starts: list[int] = [0]
+        for segment in self._segments:
+            self._starts.append(self._starts[-1] + segment.get_textsize())
+        self._txtsize: int = self._starts[-1]
+        self._line_starts: list[int] | None = None
+
+    def _segment_idx(self, pos: int) -> int:
+        """ Index of the segment with the offset """
+        return min(bisect_right(self._starts, pos) - 1,
+                   len(self._segments) - 1)
+
+    def get_segments(self) -> list[TextData]:
+        """ Segments of the text """
+        return list(self._segments)
+
+    def copy(self):
+        """ Returns copy of self sharing the segments """
+        res = copy.copy(self)
+        # pylint: disable = protected-access
+        res._pointer = self._pointer.copy()
         return res
+
+    def reset(self, text=None, pos=0, line=1, col=1, filename=None):
+        """ Reset to initial values, or change certain parameters
+            New text replaces all segments """
+        self._filename = self._filename if not filename else str(filename)
+        if isinstance(text, str):
+            self._segments = [TextData(text, filename=self._filename)]
+            self._index_segments()
+        self._pointer.reset(self._txtsize, pos, col, line)
+
+    def get_char(self, pos=None) -> str:
+        """ Return char at current position
+            Returns EOF at the end of text """
+        text_pos: int = max(0, pos) if isinstance(pos, int)\
+            else self._pointer.pos
+        if text_pos >= self._txtsize:
+            return EOF
+        idx: int = self._segment_idx(text_pos)
+        return self._segments[idx].get_char(text_pos - self._starts[idx])
+
+    def get_text(self, start=None, step=None, end=None) -> str:
+        """ Get text whole or from start to end by step """
+        start = start if isinstance(start, int) else None
+        step = step if isinstance(step, int) else None
+        end = end if isinstance(end, int) else None
+        if (step or 1) < 0:
+            return self.get_text()[start:end:step]
+        start, end, _ = slice(start, end).indices(self._txtsize)
+        parts: list[str] = []
+        idx: int = self._segment_idx(start)
+        while start < end and idx < len(self._segments):
+            seg_start: int = self._starts[idx]
+            parts.append(self._segments[idx].get_text(
+                start - seg_start, end=min(end, self._starts[idx + 1])
+                - seg_start))
+            start = self._starts[idx + 1]
+            idx += 1
+        return ''.join(parts)[::step]
+
+    def _get_line_starts(self) -> list[int]:
+        """ Offsets of the line beginnings, computed on first use """
+        if self._line_starts is None:
+            line_starts: list[int] = [0]
+            for seg_start, segment in zip(self._starts, self._segments):
+                # pylint: disable = protected-access
+                line_starts.extend(seg_start + line_start for line_start
+                                   in segment._get_line_starts()[1:])
+            self._line_starts = line_starts
+        return self._line_starts
+
+    def source_of(self, pos: int) -> tuple[str, int, int]:
+        """ Filename, line and column where the offset comes from """
+        if not self._segments:
+            return self.get_filename(), 1, 1
+        pos = min(max(pos, 0), self._txtsize)
+        idx: int = self._segment_idx(pos)
+        return self._segments[idx].source_of(pos - self._starts[idx])
+
+    def map_error(self, error):
+        """ Point error at the file, line and column of its segment """
+        error.filename, error.pos_start.ln, error.pos_start.col =\
+            self.source_of(error.pos_start.pos)
+        _, error.pos_end.ln, error.pos_end.col =\
+            self.source_of(error.pos_end.pos)
+        return error
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+""" Compact token storage for large sources """
+
+from array import array
+from typing import Iterator
+
+from textdata import TextData, TextPointer as Pointer, DEFAULT_FILENAME
+from errors import Error
+from lexer import Token, TokenType, scan, make_error
+
+
+# Bump when attributes of TokenBuffer change (invalidates token caches)
+BUFFER_VERSION = 2
+
+_TYPE_BY_CODE: dict[int, TokenType] = {t.value: t for t in TokenType}
+
+
+class TokenBuffer:
+    """ Tokens stored as columns of array.array:
+        type code, start offset and end offset.
+        Values are sliced from the source and line/col are resolved
+        only on demand, Token objects are built by the adapter methods
+        With recover scanning goes on after errors (see Lexer.tokenize_all)
+        and all of them are collected in errors """
+
+    def __init__(self, text: str | TextData, filename: str | None = None,
+                 recover: bool = False):
+        source: TextData | None = None  # maps errors to their files
+        if isinstance(text, TextData):
+            filename = filename or text.get_filename()
+            source = text
+            text = text.get_text()
+        self._text: str = text
+        self._lines: TextData = TextData(text)  # line index
+        self.filename: str = filename or DEFAULT_FILENAME
+        offset_code: str = 'I' if len(text) < 2 ** 32 else 'Q'
+        self.types: array = array('B')
+        self.starts: array = array(offset_code)
+        self.ends: array = array(offset_code)
+        self.error: Error | None = None
+        self.errors: list[Error] = []
+        self._error_idx: int = -1
+        self._fill(recover, source)
+
+    def _fill(self, recover: bool, source: TextData | None):
+        types, starts, ends = self.types, self.starts, self.ends
+        for token_type, start, end, _, raw_error in scan(self._text,
+                                                         recover=recover):
+            if token_type is not None:
+                types.append(token_type.value)
+                starts.append(start)
+                ends.append(end)
+            if raw_error:
+                self._error_idx = len(types) - 1 if token_type else -1
+                error: Error = make_error(raw_error, self.linecol,
+                                          len(self._text), self.filename)
+                self.errors.append(source.map_error(error)
+                                   if source else error)
+                if not recover:
+                    break
+        self.error = self.errors[0] if self.errors else None
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, idx: int) -> Token:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('token index out of range')
+        return self.token(idx)
+
+    def __iter__(self) -> Iterator[Token]:
+        for idx in range(len(self)):
+            yield self.token(idx)
+
+    def get_text(self) -> str:
+        """ Source text """
+        return self._text
+
+    def type_of(self, idx: int) -> TokenType:
+        """ Type of token idx """
+        return _TYPE_BY_CODE[self.types[idx]]
+
+    def span(self, idx: int) -> tuple[int, int]:
+        """ Start and end offsets of token idx """
+        return self.starts[idx], self.ends[idx]
+
+    def value(self, idx: int) -> str | None:
+        """ Value of token idx, the same as Token.value """
+        token_type: TokenType = self.type_of(idx)
+        if token_type is TokenType.COMMENT:
+            return self._text[self.starts[idx] + 1:self.ends[idx]]
+        if token_type in (TokenType.STR, TokenType.KEYWORD, TokenType.INT,
+                          TokenType.FLOAT, TokenType.DIRECTIVE):
+            return self._text[self.starts[idx]:self.ends[idx]]
+        return None
+
+    def pointer_pos(self, idx: int) -> int:
+        """ Offset Token.pos_data of token idx points at """
+        if self.types[idx] == TokenType.STR.value:
+            # strings point at the closing quote or at EOF if unterminated
+            return self.ends[idx] - (idx != self._error_idx)
+        return self.starts[idx]
+
+    def linecol(self, pos: int) -> tuple[int, int]:
+        """ Line and column of the offset in the source """
+        return self._lines.pos_to_linecol(pos)
+
+    def token(self, idx: int) -> Token:
+        """ Build Token object for token idx """
+        pos: int = self.pointer_pos(idx)
+        line, col = self.linecol(pos)
+        return Token(self.type_of(idx),
+                     Pointer(len(self._text), pos, col, line),
+                     self.value(idx))
+
+    def to_tokens(self) -> tuple[list[Token], Error | None]:
+        """ Same result as Lexer.tokenize() """
+        return list(self), self.error
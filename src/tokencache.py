@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+""" On-disk cache of tokenized sources """
+
+import hashlib
+import os
+from os.path import abspath, isfile
+from os.path import join as pathjoin
+from pathlib import Path
+
+from file_worker import _secure_dumps, _secure_loads, HashCheckFailed
+from lexer import LEXER_VERSION
+from tokenbuffer import TokenBuffer, BUFFER_VERSION
+
+
+CACHE_DIR = '__ubcache__'
+CACHE_EXT = '.ubtok'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class TokenCache:
+    """ Cache of TokenBuffers in a directory
+        Entries are keyed by SHA-256 of the source and the versions of
+        the lexer and of the TokenBuffer layout,
+        stored with secure pickle and evicted by least recent access
+        when the directory grows over max_bytes """
+
+    def __init__(self, cache_dir: str = CACHE_DIR,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir: str = abspath(cache_dir)
+        self.max_bytes: int = max(max_bytes, 0)
+        self.hits: int = 0
+        self.misses: int = 0
+        self.rejected: int = 0
+        self.evictions: int = 0
+        self._prefix: str = f'v{LEXER_VERSION}.{BUFFER_VERSION}-'
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        self._drop_stale()
+
+    def _entries(self) -> list[os.DirEntry]:
+        with os.scandir(self.cache_dir) as entries:
+            return [entry for entry in entries
+                    if entry.is_file() and entry.name.endswith(CACHE_EXT)]
+
+    def _drop_stale(self):
+        """ Remove entries of other lexer or TokenBuffer versions """
+        for entry in self._entries():
+            if not entry.name.startswith(self._prefix):
+                os.remove(entry.path)
+
+    def entry_path(self, text: str) -> str:
+        """ Path of the cache entry for the source text """
+        digest: str = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return pathjoin(self.cache_dir, self._prefix + digest + CACHE_EXT)
+
+    def load_entry(self, path: str) -> TokenBuffer:
+        """ Load cache entry
+            Raises HashCheckFailed if the entry was tampered with """
+        with open(path, 'rb') as fd:
+            data: bytes = fd.read()
+        try:
+            buf = _secure_loads(data)
+        except ValueError:  # no header at all
+            raise HashCheckFailed(f'broken cache entry {path}') from None
+        if not isinstance(buf, TokenBuffer):
+            raise HashCheckFailed(f'unexpected cache entry {path}')
+        os.utime(path)  # mark as recently used
+        return buf
+
+    def store_entry(self, path: str, buf: TokenBuffer):
+        """ Write cache entry and evict old ones if needed """
+        tmp_path: str = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as fd:
+            fd.write(_secure_dumps(buf))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries: list = [(entry.stat().st_mtime_ns, entry.stat().st_size,
+                          entry.path) for entry in self._entries()]
+        total: int = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+    def tokenize_text(self, text: str, filename: str | None = None
+                      ) -> TokenBuffer:
+        """ TokenBuffer for the text, from cache if possible """
+        path: str = self.entry_path(text)
+        if isfile(path):
+            try:
+                buf: TokenBuffer = self.load_entry(path)
+            except HashCheckFailed:
+                self.rejected += 1
+                os.remove(path)
+            else:
+                if buf.get_text() == text:
+                    self.hits += 1
+                    buf.filename = filename or buf.filename
+                    if buf.error:
+                        buf.error.filename = buf.filename
+                    return buf
+        self.misses += 1
+        buf = TokenBuffer(text, filename)
+        self.store_entry(path, buf)
+        return buf
+
+    def tokenize(self, source: str) -> TokenBuffer:
+        """ TokenBuffer for the source file, from cache if possible """
+        with open(source, 'r', encoding='utf-8') as fd:
+            text: str = fd.read()
+        return self.tokenize_text(text, source)
+
+    def clear(self):
+        """ Remove all entries """
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def stats(self) -> dict[str, int]:
+        """ Hit/miss counters and current size of the cache """
+        entries: list = self._entries()
+        return {'hits': self.hits, 'misses': self.misses,
+                'rejected': self.rejected, 'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(entry.stat().st_size for entry in entries)}
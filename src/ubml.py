@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 """ UniBasic Markup Language """
 
+import hashlib
+import os
 import re
-from typing import Any, IO
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from itertools import repeat
+from os.path import abspath, getsize, splitext
+from types import MappingProxyType, NoneType, UnionType
+from typing import Any, IO, Iterator, NamedTuple, Union
+from typing import get_args, get_origin, get_type_hints
 
 
 def _get_from_subscr(source_sub: list | tuple | str, idx: int) -> Any:
@@ -12,6 +24,10 @@ def _get_from_subscr(source_sub: list | tuple | str, idx: int) -> Any:
     return source_sub[idx]
 
 
+# Marks that no key is waiting for a value (keys may be falsy: 0, false, nil)
+_NO_KEY = object()
+
+
 class NotSupported(Exception):
     """ Error for unsupported types """
 
@@ -25,8 +41,35 @@ class InvalidSymbolError(Exception):
         like using : or = in lists """
 
 
+def _detect_object_type(text: str) -> type[dict[Any, Any]] | type[list[Any]]:
+    """ dict if the text looks like a dict without braces, else list """
+    if text.startswith('{'):  # }
+        return dict
+    if text.startswith('['):  # ]
+        return list
+
+    # Looking for less obvious dict pattern
+    skip_ch: bool = False
+    skip_str: bool = False
+    for ch in text[:text.find(',' if ',' in text else '\n')]:
+        if ch == '\\':
+            skip_ch = True
+        elif skip_ch:
+            skip_ch = False
+        elif ch in '"\'' and not skip_str:
+            skip_str = True
+        elif ch in '"\'' and skip_str:
+            skip_str = False
+        elif ch in ':=' and not skip_str and not skip_ch:
+            break  # found
+    else:
+        return list  # pattern not found
+    return dict  # if cycle breaks (pattern found)
+
+
 class UBMLParser:
     """ Main class for parsing ubml files
+        Char-by-char reference parser, loads and load use UBMLScanner
     """
 
     def __init__(self, text: str, filename: str):
@@ -35,33 +78,7 @@ class UBMLParser:
         self._col: int = 1
         self._filename: str = filename or '<stdin>'
         self._text: str = text.strip() or '{}'
-        self._textsize: int = len(text)
-
-    @staticmethod
-    def _detect_object_type(
-            text: str) -> type[dict[Any, Any]] | type[list[Any]]:
-        if text.startswith('{'):  # }
-            return dict
-        if text.startswith('['):  # ]
-            return list
-
-        # Looking for less obvious dict pattern
-        skip_ch: bool = False
-        skip_str: bool = False
-        for ch in text[:text.find(',' if ',' in text else '\n')]:
-            if ch == '\\':
-                skip_ch = True
-            elif skip_ch:
-                skip_ch = False
-            elif ch in '"\'' and not skip_str:
-                skip_str = True
-            elif ch in '"\'' and skip_str:
-                skip_str = False
-            elif ch in ':=' and not skip_str and not skip_ch:
-                break  # found
-        else:
-            return list  # pattern not found
-        return dict  # if cycle breaks (pattern found)
+        self._textsize: int = len(self._text)
 
     @staticmethod
     def _append_to_obj(obj: dict | list, item: Any):
@@ -84,10 +101,10 @@ class UBMLParser:
         if type_ch and type_ch in '[{':  # }]
             obj: type = dict if type_ch == '{' else list  # }
         else:
-            obj = self._detect_object_type(self._text[self._pos:])
+            obj = _detect_object_type(self._text[self._pos:])
         self._skip_first_br()
         parsed: dict | list = obj()
-        add_key: Any = ''
+        add_key: Any = _NO_KEY
 
         while self._pos < self._textsize:
             ch: str = self._text[self._pos]
@@ -129,9 +146,9 @@ class UBMLParser:
         is_dict: bool = isinstance(parsed, dict)
         new_obj: dict | list = self._process_text(last_char) or\
             ([] if last_char == '[' else {})
-        if is_dict and add_key:
+        if is_dict and add_key is not _NO_KEY:
             self._append_to_obj(parsed, {add_key: new_obj})
-            add_key = ''
+            add_key = _NO_KEY
         elif is_dict:
             raise TypeError(f'unhashable type: \'{type(new_obj).__name__}\'')
         else:
@@ -172,7 +189,7 @@ class UBMLParser:
         word: str = self._collect_string()
         res: str | bool | None = self._process_str(word)
         if res is None:
-            return None
+            return add_key
         stripped_word: str = word.strip().strip('\n')
         if stripped_word in ('nil', 'null', ''):
             res = None
@@ -180,9 +197,9 @@ class UBMLParser:
             res = True
         elif stripped_word == 'false':
             res = False
-        if isinstance(parsed, dict) and add_key:
+        if isinstance(parsed, dict) and add_key is not _NO_KEY:
             self._append_to_obj(parsed, {add_key: res})
-            add_key = ''
+            add_key = _NO_KEY
         elif isinstance(parsed, dict):
             add_key = res
         else:
@@ -190,7 +207,7 @@ class UBMLParser:
         return add_key
 
     def _process_num(self, parsed: dict | list,
-                     add_key: int | float | str) -> int | float | str:
+                     add_key: Any) -> Any:
         obj: type = type(parsed)
         num = self._cut_text_part()
         try:
@@ -199,11 +216,11 @@ class UBMLParser:
             raise InvalidNumberError(f'got invalid number "{num}"'
                                      f' in file {self._filename}'
                                      f':{self._ln}:{self._col}') from None
-        if not add_key and obj is dict:
+        if add_key is _NO_KEY and obj is dict:
             add_key = converted_num
         elif obj is dict:
             UBMLParser._append_to_obj(parsed, {add_key: converted_num})
-            add_key = ''
+            add_key = _NO_KEY
         else:
             UBMLParser._append_to_obj(parsed, converted_num)
         return add_key
@@ -243,7 +260,7 @@ class UBMLParser:
         res: str = text.strip()
         if res and res[0] in '"\'' and res[0] == res[-1]:
             res = res[1:-1]  # manual strip only if double ' or "
-        to_replace: dict = {'\\n': '\n', '\\t': '\t',
+        to_replace: dict = {'\\n': '\n', '\\r': '\r', '\\t': '\t',
                             '\\"': '"', '\\\\': '\\'}
         for old, new in to_replace.items():
             res = res.replace(old, new)
@@ -258,8 +275,899 @@ class UBMLParser:
         return self._pos, self._ln, self._col
 
 
+# Scanning engine patterns
+_DICT_SKIP_RE = re.compile(r'[\n\r\t, :=]*')
+_LIST_SKIP_RE = re.compile(r'[\n\r\t, ]*')
+_WORD_RUN_RE = re.compile(r'[^\]},:=\\]*')  # unquoted word up to \\
+_NUMBER_RE = re.compile(r'[+-]?\d+(\.\d+)?')
+_NUMBER_END_RE = re.compile(r'[^\n\r\t ,\]}:=]*')
+_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+# list of numbers only, up to ]
+_NUMBERS_RE = re.compile(r'[\n\r\t, ]*(?:(?:[+-]\d+|[0-9]\d*)(?:\.\d+)?'
+                         r'(?:[\n\r\t, ]+(?:[+-]\d+|[0-9]\d*)(?:\.\d+)?)*'
+                         r'[\n\r\t, ]*)?')
+_NUMBER_ITEM_RE = re.compile(r'[+-]?\d+(?:\.\d+)?')
+_NUMERIC_CHARS = str.maketrans('', '', '0123456789+-.,\n\r\t ')  # deleted
+# dots float() takes, while they are not numbers: .5, 5.
+_LOOSE_DOTS: tuple[str, ...] = tuple(ch + '.' for ch in '+-., \n\r\t') +\
+    tuple('.' + ch for ch in '+-, \n\r\t')
+_NUMBER_ENDS = frozenset('\n\r\t ,]}:=')
+_UNESCAPED = frozenset('\'",:=}]')
+_WORD_VALUES: dict[str, Any] = {'nil': None, 'null': None, '': None,
+                                'true': True, 'false': False}
+# Pre-scan patterns: values other than containers and comments,
+# tokenized as UBMLScanner does it wherever it does not fail.
+# A word may not end with \ at the end of text, as slices are parsed
+# inside [], where it would escape the ]
+_SCAN_SKIP: str = r'[\n\r\t, :=]*'
+_SCAN_VALUE: str = (r'"[^"\\]*(?:\\.[^"\\]*)*"|\'[^\'\\]*(?:\\.[^\'\\]*)*\''
+                    r'|(?=[+\-0-9])[+-]?\d+(?:\.\d+)?(?![^\n\r\t ,\]}:=])'
+                    r'|(?=[^\W\d_]|\\.)[^\]},:=\\]*(?:\\.[^\]},:=\\]*)*')
+_SCAN_DEPTH: int = 4  # containers nested deeper are walked by brackets
+
+
+def _scan_nested(depth: int) -> str:
+    """ Pattern of a value or a container with up to depth levels """
+    inner: str = _SCAN_VALUE
+    for _ in range(depth):
+        items: str = f'(?:{_SCAN_SKIP}(?:{inner}))*+{_SCAN_SKIP}'
+        inner = f'{_SCAN_VALUE}|\\[{items}\\]|\\{{{items}\\}}'
+    return inner
+
+
+_SCAN_ONE_RE = re.compile(f'{_SCAN_SKIP}({_scan_nested(_SCAN_DEPTH)})?+',
+                          re.DOTALL)
+_SCAN_RUN_RE = re.compile(f'(?:{_SCAN_SKIP}(?:{_SCAN_VALUE}))*+{_SCAN_SKIP}',
+                          re.DOTALL)
+_CLOSING: dict[str, str] = {'[': ']', '{': '}'}
+PARALLEL_MIN_SIZE = 256 * 1024  # smaller texts are parsed in one process
+
+
+def _usable_workers(workers: int, parts: int) -> int:
+    """ Workers worth starting for parts of the input, no more than
+        the number of CPUs, 1 means parsing in this process """
+    return max(min(workers, os.cpu_count() or 1, parts), 1)
+
+
+def _packed(values: list) -> list | array:
+    """ array('q') of ints or array('d') of numbers with a float,
+        values as they are if there are other values """
+    types: set[type] = set(map(type, values))
+    if not values or not types <= {int, float}:  # bool is not a number here
+        return values
+    try:
+        return array('q' if types == {int} else 'd', values)
+    except OverflowError:
+        return values
+
+
+def _decode_text(data: bytes) -> str:
+    """ utf-8 text with newlines translated as open() does it """
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _unescape(match: re.Match) -> str:
+    char: str = match.group(1)
+    return char if char in _UNESCAPED else match.group()
+
+
+class UBMLScanner:
+    """ Parsing engine behind loads and load
+        Finds token boundaries with str.find and compiled patterns,
+        containers are kept on an explicit stack and line/column
+        are computed only for error messages.
+        Results are the same as of UBMLParser """
+
+    def __init__(self, text: str, filename: str, arrays: bool = False):
+        self._filename: str = filename or '<stdin>'
+        self._text: str = text.strip() or '{}'
+        self._arrays: bool = arrays  # numeric lists as array.array
+
+    def _where(self, pos: int) -> str:
+        """ filename:line:column of the offset """
+        line: int = self._text.count('\n', 0, pos) + 1
+        col: int = pos - self._text.rfind('\n', 0, pos)
+        return f'{self._filename}:{line}:{col}'
+
+    def _offset(self, pos: int) -> int:
+        """ Offset in the whole (stripped) text """
+        return pos
+
+    def _comment_end(self, pos: int) -> int:
+        """ Offset after the comment starting at pos
+            Like UBMLParser, a newline right after an odd run
+            of whitespace is skipped and the comment goes on """
+        text: str = self._text
+        while True:
+            newline: int = text.find('\n', pos + 1)
+            if newline < 0:
+                return len(text)
+            spaces: int = newline - 1
+            while spaces > pos and text[spaces] in '\r\t ':
+                spaces -= 1
+            if not (newline - 1 - spaces) % 2:
+                return newline + 1
+            pos = newline
+
+    def _quoted_end(self, pos: int) -> int:
+        """ Offset after the closing quote or -1 if there is none """
+        text: str = self._text
+        quote: str = text[pos]
+        end: int = text.find(quote, pos + 1)
+        while end > 0:
+            escapes: int = end - 1
+            while text[escapes] == '\\':
+                escapes -= 1
+            if not (end - 1 - escapes) % 2:
+                return end + 1
+            end = text.find(quote, end + 1)
+        return -1
+
+    def _word_end(self, pos: int) -> int:
+        """ Offset after the word, -1 for unterminated quoted word """
+        text: str = self._text
+        if text[pos] in '"\'':
+            return self._quoted_end(pos)
+        size: int = len(text)
+        end: int = pos
+        while True:
+            end = _WORD_RUN_RE.match(text, end).end()
+            if end >= size or text[end] != '\\':
+                return end
+            end += 2 if end + 1 < size else 1
+
+    def _word(self, pos: int, end: int | None = None) -> tuple[Any, int]:
+        """ Word value and offset after it (end if already known) """
+        text: str = self._text
+        end = self._word_end(pos) if end is None else end
+        if end < 0:
+            end = len(text)
+            if text[-1] != text[pos]:
+                raise SyntaxError(f'unterminated string literal '
+                                  f'{text[pos]} in {self._where(pos)} '
+                                  f'(pos: {self._offset(pos)})')
+        word: str = text[pos:end]
+        if '\\' in word:
+            word = _ESCAPE_RE.sub(_unescape, word)
+        res: Any = word.strip()
+        if res in _WORD_VALUES:
+            return _WORD_VALUES[res], end
+        if res[0] in '"\'' and res[0] == res[-1]:
+            res = res[1:-1]
+        if '\\' in res:
+            res = res.replace('\\n', '\n').replace('\\r', '\r')\
+                .replace('\\t', '\t').replace('\\"', '"')\
+                .replace('\\\\', '\\')
+        return res, end
+
+    def _number(self, pos: int) -> tuple[int | float, int]:
+        """ Number value and offset after it """
+        text: str = self._text
+        match: re.Match | None = _NUMBER_RE.match(text, pos)
+        if match:
+            end: int = match.end()
+            if end >= len(text) or text[end] in _NUMBER_ENDS:
+                if match.group(1):
+                    return float(match.group()), end
+                return int(match.group()), end
+        end = _NUMBER_END_RE.match(text, pos).end()
+        raise InvalidNumberError(f'got invalid number "{text[pos:end]}"'
+                                 f' in file {self._where(end)}')
+
+    def _numbers_end(self, pos: int) -> int:
+        """ Offset of ] (or the end of text) closing the list from pos,
+            -1 if the list holds anything but characters of numbers """
+        text: str = self._text
+        first: int = _LIST_SKIP_RE.match(text, pos).end()
+        if first < len(text) and text[first] not in '+-0123456789]':
+            return -1
+        end: int = text.find(']', first)
+        if end < 0:
+            end = len(text)
+        return -1 if text[first:end].translate(_NUMERIC_CHARS) else end
+
+    def _numbers(self, pos: int, end: int) -> list | array | None:
+        """ Numbers of the list from pos to end, converted in one pass,
+            None if the list is not of numbers only """
+        text: str = self._text
+        chunk: str = text[pos:end]
+        has_float: bool = '.' in chunk
+        try:
+            if has_float and ('.' in (chunk[0], chunk[-1]) or
+                              any(dot in chunk for dot in _LOOSE_DOTS)):
+                raise ValueError('loose dot')
+            return self._converted(chunk.split(','), has_float)
+        except ValueError:
+            pass  # not split by commas only, or not numbers
+        if _NUMBERS_RE.match(text, pos).end() != end:
+            return None
+        return self._converted(_NUMBER_ITEM_RE.findall(text, pos, end),
+                               has_float)
+
+    def _converted(self, items: list[str], has_float: bool) -> list | array:
+        """ Numbers of items, with arrays to array('q'),
+            or array('d') if there is a float """
+        if self._arrays and items:
+            try:
+                return array('d' if has_float else 'q',
+                             map(float if has_float else int, items))
+            except OverflowError:
+                pass  # ints do not fit into 'q'
+        if has_float:
+            return [float(item) if '.' in item else int(item)
+                    for item in items]
+        return list(map(int, items))
+
+    def _list_slices(self, parts: int) -> list[tuple[int, int]] | None:
+        """ About parts (start, end) ranges of the top level list,
+            each holding whole elements, or None if the text is not
+            a list or something is unusual, like errors, comments
+            outside of nested containers or an early end of the list """
+        text: str = self._text
+        if _detect_object_type(text) is not list:
+            return None
+        size: int = len(text)
+        pos: int = 1 if text[0] == '[' else 0  # ]
+        if self._numbers_end(pos) >= 0:
+            return None  # converted in one pass faster
+        step: int = max(size // parts, 1)
+        target: int = pos + step
+        starts: list[int] = [pos]
+        stack: list[str] = []  # containers opened inside the list
+        while True:
+            if stack:
+                pos = _SCAN_RUN_RE.match(text, pos).end()
+            else:
+                if pos >= target:
+                    starts.append(pos)
+                    target = pos + step
+                match: re.Match = _SCAN_ONE_RE.match(text, pos)
+                pos = match.end()
+                if match.group(1) is not None:
+                    continue
+            ch: str = text[pos] if pos < size else ''
+            if ch in '[{' and ch:  # }]
+                stack.append(_CLOSING[ch])
+                pos += 1
+            elif ch == '#' and stack:
+                pos = self._comment_end(pos)
+            elif ch and stack and ch == stack[-1]:
+                stack.pop()
+                pos += 1
+            elif not stack and (ch == ']' and pos == size - 1 or not ch):
+                break  # end of the list
+            else:
+                return None
+        ends: list[int] = starts[1:] + [pos]
+        return [(start, end) for start, end in zip(starts, ends)
+                if start < end]
+
+    def parallel_result(self, workers: int) -> Any:
+        """ Result of parsing with the top level list split into slices
+            which are parsed across a process pool of workers processes.
+            Other objects, small texts (under PARALLEL_MIN_SIZE a worker),
+            texts with errors and all texts with one CPU are parsed
+            in this process, so errors point to the whole text """
+        slices: list[tuple[int, int]] | None = None
+        workers = _usable_workers(workers,
+                                  len(self._text) // PARALLEL_MIN_SIZE)
+        if workers > 1:
+            slices = self._list_slices(workers * 2)
+        if not slices or len(slices) < 2:
+            return self.result()
+        text: str = self._text
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts: list[list] = list(pool.map(
+                    _load_slice, (text[start:end] for start, end in slices),
+                    repeat(self._arrays)))
+        except Exception:  # pylint: disable=broad-exception-caught
+            return self.result()  # raises with global line and column
+        res: list = []
+        for part in parts:
+            res.extend(part)
+        return res
+
+    # pylint: disable=too-many-branches, too-many-statements
+    def result(self) -> Any:
+        """ Result of parsing """
+        text: str = self._text
+        size: int = len(text)
+        find = text.find
+        dict_skip = _DICT_SKIP_RE.match
+        list_skip = _LIST_SKIP_RE.match
+        number = _NUMBER_RE.match
+        arrays: bool = self._arrays
+        is_dict: bool = _detect_object_type(text) is dict
+        skip = dict_skip if is_dict else list_skip
+        container: dict | list = {} if is_dict else []
+        pos: int = 1 if text[0] in '{[' else 0  # ]}
+        key: Any = _NO_KEY
+        # parents of the container: (parent, its key, is parent a dict)
+        stack: list[tuple[dict | list, Any, bool]] = []
+        value: Any = None
+        end: int = -1 if is_dict else self._numbers_end(pos)
+        if end >= 0 and (value := self._numbers(pos, end)) is not None:
+            return value
+
+        while True:
+            pos = skip(text, pos).end()
+            ch: str = text[pos] if pos < size else ''
+            if ch == '"':
+                # fast path for strings without escapes
+                end: int = find('"', pos + 1)
+                value = text[pos + 1:end]
+                if end < 0 or '\\' in value:
+                    value, pos = self._word(pos)
+                else:
+                    pos = end + 1
+            elif ch in '+-0123456789' and ch:
+                match: re.Match | None = number(text, pos)
+                end = match.end() if match else pos
+                if match and (end >= size or text[end] in _NUMBER_ENDS):
+                    value = float(match.group()) if match.group(1)\
+                        else int(match.group())
+                    pos = end
+                else:
+                    value, pos = self._number(pos)
+            elif not ch or (ch == ']' and not is_dict) or\
+                    (ch == '}' and is_dict):
+                # end of text closes every container
+                pos += 1
+                value = container
+                if arrays and not is_dict:
+                    value = _packed(value)  # not a list of numbers only
+                if not stack:
+                    return value
+                container, key, is_dict = stack.pop()
+                skip = dict_skip if is_dict else list_skip
+                if is_dict and key is _NO_KEY:
+                    closed: str = 'list' if isinstance(value, array)\
+                        else type(value).__name__
+                    raise TypeError(f'unhashable type: \'{closed}\'')
+            elif ch == '[' and (not is_dict or key is not _NO_KEY) and\
+                    (end := self._numbers_end(pos + 1)) >= 0 and\
+                    (value := self._numbers(pos + 1, end)) is not None:
+                pos = end + 1
+            elif ch in '[{':  # }]
+                stack.append((container, key, is_dict))
+                is_dict = ch == '{'  # }
+                skip = dict_skip if is_dict else list_skip
+                container = {} if is_dict else []
+                key = _NO_KEY
+                pos += 1
+                continue
+            elif ch == '#':
+                pos = self._comment_end(pos)
+                continue
+            elif ch.isalpha() or ch in '\'\\':
+                value, pos = self._word(pos)
+            elif ch in ':=':
+                raise InvalidSymbolError(f"unexpected '{ch}' for object of "
+                                         f"type list in {self._where(pos)} "
+                                         f"(pos: {self._offset(pos)})")
+            else:
+                raise InvalidSymbolError(f"invalid symbol in "
+                                         f"{self._where(pos)} - '{ch}' "
+                                         f"(pos: {self._offset(pos)})")
+            if not is_dict:
+                container.append(value)
+            elif key is _NO_KEY:
+                key = value
+            else:
+                container[key] = value
+                key = _NO_KEY
+
+
+def _load_slice(text: str, arrays: bool = False) -> list:
+    """ Elements of the slice of the top level list """
+    return UBMLScanner(f'[{text}]', '', arrays).result()
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+_CONTAINER_EVENTS: dict[str, tuple[str, type]] = {
+    'start_map': ('end_map', dict), 'start_list': ('end_list', list)}
+
+
+class UBMLEvents(UBMLScanner):
+    """ Event parser reading UBML file chunk by chunk
+        Iterating yields (event, value) pairs: ('start_map', None),
+        ('key', key), ('value', value), ('end_map', None),
+        ('start_list', None) and ('end_list', None).
+        Only the text of the unfinished token is kept in memory """
+    # pylint: disable=super-init-not-called
+
+    def __init__(self, fd: IO, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self._fd: IO = fd
+        self._filename: str = getattr(fd, 'name', '') or '<stdin>'
+        self.chunk_size: int = max(int(chunk_size), 1)
+        self._buf: str = ''  # text read and not consumed yet
+        self._text: str = ''  # _buf without trailing whitespace
+        self._eof: bool = False
+        self._base: int = 0  # offset of _buf[0] in the stripped text
+        self._lines: int = 0  # newlines before _buf
+        self._line_start: int = 0  # offset of the line start before _buf
+
+    def _where(self, pos: int) -> str:
+        newline: int = self._text.rfind('\n', 0, pos)
+        line_start: int = self._base + newline + 1 if newline >= 0\
+            else self._line_start
+        line: int = self._lines + self._text.count('\n', 0, pos) + 1
+        return f'{self._filename}:{line}:{self._offset(pos) - line_start + 1}'
+
+    def _offset(self, pos: int) -> int:
+        return self._base + pos
+
+    def _more(self, pos: int) -> int:
+        """ Drop the text before pos and read the next chunk
+            Returns pos in the new buffer """
+        consumed: str = self._buf[:pos]
+        newlines: int = consumed.count('\n')
+        if newlines:
+            self._lines += newlines
+            self._line_start = self._base + consumed.rfind('\n') + 1
+        self._base += pos
+        self._buf = self._buf[pos:]
+        chunk: str = self._fd.read(self.chunk_size)
+        self._eof = not chunk
+        if not self._base and not self._buf:
+            chunk = chunk.lstrip()  # text is stripped
+        self._buf += chunk
+        # trailing whitespace is shown only when more text follows
+        self._text = self._buf.rstrip()
+        return 0
+
+    def __iter__(self) -> Iterator[tuple[str, Any]]:
+        # pylint: disable=too-many-branches, too-many-statements
+        # one loop over chunks like UBMLScanner.result, refills are inline
+        pos: int = 0
+        while not self._eof and (not self._text or (
+                self._text[0] not in '{[' and ',' not in self._text)):  # ]}
+            pos = self._more(pos)
+        if not self._text:
+            self._buf = self._text = '{}'
+        is_dict: bool = _detect_object_type(self._text) is dict
+        pos = 1 if self._text[0] in '{[' else 0  # ]}
+        yield ('start_map' if is_dict else 'start_list'), None
+        has_key: bool = False
+        # parents of the container: (had a key, is parent a dict)
+        stack: list[tuple[bool, bool]] = []
+
+        while True:
+            text: str = self._text
+            pos = (_DICT_SKIP_RE if is_dict else _LIST_SKIP_RE
+                   ).match(text, pos).end()
+            ch: str = text[pos] if pos < len(text) else ''
+            end: int = pos + 1
+            if not ch and not self._eof:
+                pos = self._more(pos)
+                continue
+            if ch and (ch.isalpha() or ch in '\'"\\'):
+                end = self._word_end(pos)
+                if not self._eof and (end < 0 or end >= len(text)):
+                    pos = self._more(pos)
+                    continue
+                value, pos = self._word(pos, end)
+            elif ch in '+-0123456789' and ch:
+                end = _NUMBER_END_RE.match(text, pos).end()
+                if not self._eof and end >= len(text):
+                    pos = self._more(pos)
+                    continue
+                value, pos = self._number(pos)
+            elif ch == '#':
+                end = self._comment_end(pos)
+                if not self._eof and end >= len(text):
+                    pos = self._more(pos)
+                    continue
+                pos = end
+                continue
+            elif not ch or (ch == ']' and not is_dict) or\
+                    (ch == '}' and is_dict):
+                # end of text closes every container
+                yield ('end_map' if is_dict else 'end_list'), None
+                if not stack:
+                    return
+                pos = end
+                closed: str = 'dict' if is_dict else 'list'
+                had_key, is_dict = stack.pop()
+                has_key = False
+                if is_dict and not had_key:
+                    raise TypeError(f'unhashable type: \'{closed}\'')
+                continue
+            elif ch in '[{':  # }]
+                stack.append((has_key, is_dict))
+                has_key = False
+                is_dict = ch == '{'  # }
+                pos = end
+                yield ('start_map' if is_dict else 'start_list'), None
+                continue
+            elif ch in ':=':
+                raise InvalidSymbolError(f"unexpected '{ch}' for object of "
+                                         f"type list in {self._where(pos)} "
+                                         f"(pos: {self._offset(pos)})")
+            else:
+                raise InvalidSymbolError(f"invalid symbol in "
+                                         f"{self._where(pos)} - '{ch}' "
+                                         f"(pos: {self._offset(pos)})")
+            if is_dict and not has_key:
+                yield 'key', value
+            else:
+                yield 'value', value
+            has_key = is_dict and not has_key
+
+    def result(self) -> Any:
+        """ Result of parsing, the same as of load """
+        events: Iterator[tuple[str, Any]] = iter(self)
+        return _build(*_next_event(events), events)
+
+
+def _next_event(events: Iterator[tuple[str, Any]]) -> tuple[str, Any]:
+    """ Next event, events must not end before their containers do """
+    event: tuple[str, Any] | None = next(events, None)
+    if event is None:
+        raise InvalidSymbolError('unexpected end of text')
+    return event
+
+
+def _build(event: str, value: Any,
+           events: Iterator[tuple[str, Any]]) -> Any:
+    """ Object built from the event and the events of its content """
+    if event not in _CONTAINER_EVENTS:
+        return value
+    end_event, obj_type = _CONTAINER_EVENTS[event]
+    obj: dict | list = obj_type()
+    key: Any = _NO_KEY
+    # parents: (object, its end event, key of the parent)
+    stack: list[tuple[dict | list, str, Any]] = []
+    for kind, item in events:
+        if kind == end_event:
+            if not stack:
+                return obj
+            item = obj
+            obj, end_event, key = stack.pop()
+        elif kind in _CONTAINER_EVENTS:
+            stack.append((obj, end_event, key))
+            end_event, obj_type = _CONTAINER_EVENTS[kind]
+            obj, key = obj_type(), _NO_KEY
+            continue
+        elif kind == 'key':
+            key = item
+            continue
+        if isinstance(obj, list):
+            obj.append(item)
+        else:
+            obj[key] = item
+            key = _NO_KEY
+    raise InvalidSymbolError('unexpected end of text')
+
+
+def _skip(events: Iterator[tuple[str, Any]]):
+    """ Skip the content of the container which was just started """
+    depth: int = 1
+    for event, _ in events:
+        if event in _CONTAINER_EVENTS:
+            depth += 1
+        elif event in ('end_map', 'end_list'):
+            depth -= 1
+            if not depth:
+                return
+    raise InvalidSymbolError('unexpected end of text')
+
+
+########################################################
+# Typed decoding
+########################################################
+class SchemaError(TypeError):
+    """ Error for values which do not match the schema """
+
+
+class Record:
+    """ Base of slotted record classes made by record_class,
+        has the interface of named tuples (_fields, _field_defaults,
+        _make and _asdict), but is mutable """
+    __slots__ = ()
+    _fields: tuple[str, ...] = ()
+    _field_defaults: dict[str, Any] = {}
+    _setters: tuple = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._setters = tuple(getattr(cls, name).__set__
+                             for name in cls._fields)
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        if len(args) > len(self._fields):
+            raise TypeError(f'{type(self).__name__} takes '
+                            f'{len(self._fields)} arguments, got {len(args)}')
+        values: dict[str, Any] = dict(self._field_defaults)
+        values.update(zip(self._fields, args))
+        for name, value in kwargs.items():
+            if name not in self._fields or name in self._fields[:len(args)]:
+                raise TypeError(f'unexpected or repeated argument {name!r}'
+                                f' of {type(self).__name__}')
+            values[name] = value
+        for setter, name in zip(self._setters, self._fields):
+            if name not in values:
+                raise TypeError(f'missing argument {name!r} '
+                                f'of {type(self).__name__}')
+            setter(self, values[name])
+
+    @classmethod
+    def _make(cls, values: Any) -> 'Record':
+        """ Record from the values of all fields in order """
+        obj: Record = cls.__new__(cls)
+        for setter, value in zip(cls._setters, values):
+            setter(obj, value)
+        return obj
+
+    def _asdict(self) -> dict[str, Any]:
+        """ Fields and their values """
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __eq__(self, other: Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self._fields)
+
+    def __repr__(self) -> str:
+        values: str = ', '.join(f'{name}={getattr(self, name)!r}'
+                                for name in self._fields)
+        return f'{type(self).__name__}({values})'
+
+
+def record_class(name: str, fields: dict[str, Any],
+                 defaults: dict[str, Any] | None = None) -> type[Record]:
+    """ Slotted record class with the fields (name: type annotation)
+        for schemas of load and loads """
+    return type(name, (Record,), {'__slots__': tuple(fields),
+                                  '__annotations__': dict(fields),
+                                  '_fields': tuple(fields),
+                                  '_field_defaults': dict(defaults or {})})
+
+
+# Compiled schema: ('any', name), ('type', name, type),
+# ('list', name, item), ('dict', name, key, value),
+# ('record', name, class, {field: spec}), ('union', name, (specs))
+_ANY_SPEC: tuple = ('any', 'Any')
+_ANY_LIST: tuple = ('list', 'list', _ANY_SPEC)
+_ANY_DICT: tuple = ('dict', 'dict', _ANY_SPEC, _ANY_SPEC)
+_SCALAR_TYPES: tuple[type, ...] = (str, int, float, bool, NoneType)
+
+
+def _compile_spec(annotation: Any, memo: dict | None = None) -> tuple:
+    """ Compiled schema of the type annotation """
+    # pylint: disable=too-many-return-statements  # one per annotation kind
+    memo = {} if memo is None else memo
+    origin: Any = get_origin(annotation)
+    args: tuple = get_args(annotation)
+    name: str = annotation.__name__ if isinstance(annotation, type) and\
+        origin is None else str(annotation).replace('typing.', '')
+    if annotation is Any or annotation is object:
+        return _ANY_SPEC
+    if annotation is None or annotation is NoneType:
+        return ('type', 'None', NoneType)
+    if origin is Union or origin is UnionType:
+        return ('union', name, tuple(_compile_spec(arg, memo)
+                                     for arg in args))
+    if annotation is list or origin is list:
+        return ('list', name, _compile_spec(args[0], memo) if args
+                else _ANY_SPEC)
+    if annotation is dict or origin is dict:
+        return ('dict', name, *(tuple(_compile_spec(arg, memo)
+                                      for arg in args) if args
+                                else (_ANY_SPEC, _ANY_SPEC)))
+    if isinstance(annotation, type) and hasattr(annotation, '_fields')\
+            and hasattr(annotation, '_make'):
+        if annotation not in memo:  # records may refer to themselves
+            fields: dict[str, tuple] = {}
+            memo[annotation] = ('record', name, annotation, fields)
+            hints: dict[str, Any] = get_type_hints(  # 'Name' of itself
+                annotation, localns={annotation.__name__: annotation})
+            for field in annotation._fields:
+                fields[field] = _compile_spec(hints.get(field, Any), memo)
+        return memo[annotation]
+    if annotation in _SCALAR_TYPES:
+        return ('type', name, annotation)
+    raise TypeError(f'unsupported type in schema: {name}')
+
+
+_MISMATCH = object()
+
+
+def _match_value(spec: tuple, value: Any) -> Any:
+    """ Scalar value matching the spec or _MISMATCH """
+    kind: str = spec[0]
+    if kind == 'any':
+        return value
+    if kind == 'type':
+        expected: type = spec[2]
+        # bool is an int, but not a value of int and float fields
+        if isinstance(value, bool) and expected is not bool:
+            return _MISMATCH
+        if isinstance(value, expected):
+            return value
+        if expected is float and isinstance(value, int):
+            return float(value)
+    elif kind == 'union':
+        for member in spec[2]:
+            res: Any = _match_value(member, value)
+            if res is not _MISMATCH:
+                return res
+    return _MISMATCH
+
+
+def _match_container(spec: tuple, is_dict: bool) -> tuple | None:
+    """ Spec of the container matching the spec or None """
+    kind: str = spec[0]
+    if kind == 'any':
+        return _ANY_DICT if is_dict else _ANY_LIST
+    if kind == 'union':
+        for member in spec[2]:
+            res: tuple | None = _match_container(member, is_dict)
+            if res is not None:
+                return res
+    elif kind != 'type' and (kind in ('dict', 'record')) == is_dict:
+        return spec
+    return None
+
+
+class UBMLTypedScanner(UBMLScanner):
+    """ Scanning engine of load and loads with a schema
+        The schema is a type annotation: str, int, float, bool, None,
+        Any, list[...], dict[..., ...], unions and record types
+        (record_class or NamedTuple classes). Values are checked as soon
+        as they are parsed, dicts of record types become records when
+        they are closed, keys of other dicts are interned """
+
+    def __init__(self, text: str, filename: str, schema: Any):
+        super().__init__(text, filename)
+        self._schema: tuple = _compile_spec(schema)
+
+    def _mismatch(self, spec: tuple, got: str, pos: int) -> SchemaError:
+        return SchemaError(f'expected {spec[1]}, got {got} in '
+                           f'{self._where(pos)} (pos: {self._offset(pos)})')
+
+    def _check(self, spec: tuple, value: Any, pos: int) -> Any:
+        """ Scalar value matching the spec """
+        res: Any = _match_value(spec, value)
+        if res is _MISMATCH:
+            raise self._mismatch(spec, type(value).__name__, pos)
+        return res
+
+    def _container(self, spec: tuple, is_dict: bool, pos: int) -> tuple:
+        """ Spec of the container which is opened at pos """
+        res: tuple | None = _match_container(spec, is_dict)
+        if res is None:
+            raise self._mismatch(spec, 'dict' if is_dict else 'list', pos)
+        return res
+
+    def _key(self, spec: tuple, key: Any, pos: int) -> Any:
+        if spec[0] == 'record':
+            if key not in spec[3]:
+                raise SchemaError(f'unknown field {key!r} of {spec[1]} in '
+                                  f'{self._where(pos)} '
+                                  f'(pos: {self._offset(pos)})')
+            return key
+        key = self._check(spec[2], key, pos)
+        return sys.intern(key) if isinstance(key, str) else key
+
+    def _finish(self, spec: tuple, container: dict | list, pos: int) -> Any:
+        """ Closed container, a record for record types """
+        if spec[0] != 'record':
+            return container
+        cls: type = spec[2]
+        # _field_defaults is NamedTuple API, named so to avoid field names
+        # pylint: disable=protected-access
+        defaults: dict[str, Any] = cls._field_defaults
+        try:
+            return cls._make([container[name] if name in container
+                              else defaults[name] for name in cls._fields])
+        except KeyError as err:
+            raise SchemaError(f'missing field {err} of {spec[1]} in '
+                              f'{self._where(pos)} '
+                              f'(pos: {self._offset(pos)})') from None
+
+    # pylint: disable=too-many-branches, too-many-statements
+    # pylint: disable=too-many-locals
+    def result(self) -> Any:
+        """ Result of parsing """
+        text: str = self._text
+        size: int = len(text)
+        find = text.find
+        dict_skip = _DICT_SKIP_RE.match
+        list_skip = _LIST_SKIP_RE.match
+        number = _NUMBER_RE.match
+        is_dict: bool = _detect_object_type(text) is dict
+        skip = dict_skip if is_dict else list_skip
+        spec: tuple = self._container(self._schema, is_dict, 0)
+        container: dict | list = {} if is_dict else []
+        pos: int = 1 if text[0] in '{[' else 0  # ]}
+        key: Any = _NO_KEY
+        # parents of the container: (parent, its key, is it a dict, spec)
+        stack: list[tuple[dict | list, Any, bool, tuple]] = []
+        value: Any = None
+
+        while True:
+            pos = skip(text, pos).end()
+            start: int = pos
+            ch: str = text[pos] if pos < size else ''
+            checked: bool = False
+            if ch == '"':
+                end: int = find('"', pos + 1)
+                value = text[pos + 1:end]
+                if end < 0 or '\\' in value:
+                    value, pos = self._word(pos)
+                else:
+                    pos = end + 1
+            elif ch in '+-0123456789' and ch:
+                match: re.Match | None = number(text, pos)
+                end = match.end() if match else pos
+                if match and (end >= size or text[end] in _NUMBER_ENDS):
+                    value = float(match.group()) if match.group(1)\
+                        else int(match.group())
+                    pos = end
+                else:
+                    value, pos = self._number(pos)
+            elif not ch or (ch == ']' and not is_dict) or\
+                    (ch == '}' and is_dict):
+                pos += 1
+                closed: str = type(container).__name__
+                value = self._finish(spec, container, start)
+                if not stack:
+                    return value
+                container, key, is_dict, spec = stack.pop()
+                skip = dict_skip if is_dict else list_skip
+                if is_dict and key is _NO_KEY:
+                    raise TypeError(f'unhashable type: \'{closed}\'')
+                checked = True  # when it was opened
+            elif ch in '[{':  # }]
+                if not is_dict:
+                    child: tuple = spec[2]
+                elif key is _NO_KEY:
+                    child = _ANY_SPEC  # fails as a key when closed
+                else:
+                    child = spec[3][key] if spec[0] == 'record' else spec[3]
+                stack.append((container, key, is_dict, spec))
+                is_dict = ch == '{'  # }
+                spec = self._container(child, is_dict, start)
+                skip = dict_skip if is_dict else list_skip
+                container = {} if is_dict else []
+                key = _NO_KEY
+                pos += 1
+                continue
+            elif ch == '#':
+                pos = self._comment_end(pos)
+                continue
+            elif ch.isalpha() or ch in '\'\\':
+                value, pos = self._word(pos)
+            elif ch in ':=':
+                raise InvalidSymbolError(f"unexpected '{ch}' for object of "
+                                         f"type list in {self._where(pos)} "
+                                         f"(pos: {self._offset(pos)})")
+            else:
+                raise InvalidSymbolError(f"invalid symbol in "
+                                         f"{self._where(pos)} - '{ch}' "
+                                         f"(pos: {self._offset(pos)})")
+            if not is_dict:
+                container.append(value if checked
+                                 else self._check(spec[2], value, start))
+            elif key is _NO_KEY:
+                key = self._key(spec, value, start)
+            else:
+                if not checked:
+                    value = self._check(spec[3][key] if spec[0] == 'record'
+                                        else spec[3], value, start)
+                container[key] = value
+                key = _NO_KEY
+
+
 class UBMLDumper:
-    """ Used to serialize objects """
+    """ Used to serialize objects
+        iterencode yields the output by chunks of about buffer_size pieces,
+        so large objects are never held in memory as a whole """
+
+    buffer_size: int = 4096
 
     # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
     def __init__(self, ident: int = 0, mark_str: str = '',
@@ -271,44 +1179,93 @@ class UBMLDumper:
         self.mark_str = '"' if as_json else mark_str\
             if mark_str in '"\'' else ''
         self.as_json = as_json
+        self._levels: list[tuple[str, str, str, str]] = []
 
-    def _process(self, obj: Any, level: int = 1) -> str:
+    def _level(self, level: int) -> tuple[str, str, str, str]:
+        """ (first item prefix, item separator, setter with space, end)
+            of the container at the level, computed once per level """
+        while len(self._levels) <= level:
+            depth: int = len(self._levels)
+            ident: str = self.ident_str * (self.ident * max(depth, 1))
+            space: str = ' ' if ident or self.as_json else ''
+            newline: str = '\n' if ident else ''
+            self._levels.append((
+                ident,
+                ',' + newline + ident if ident else ',' + space,
+                self.setter + space,
+                newline + ident[:self.ident * max(depth - 1, 0)]
+                if self.as_json or depth > 1 else ''
+            ))
+        return self._levels[level]
+
+    def _scalar(self, obj: Any) -> str:
         if isinstance(obj, tuple | set):
             raise NotSupported(f"type '{type(obj).__name__}' is not supported")
-        ident: str = self.ident_str * (self.ident * max(level, 1))
-        space: str = ' ' if ident or self.as_json else ''
-        nil: str = 'null' if self.as_json else 'nil'
-        newline: str = '\n' if ident else ''
-        res: str = ''
-        if isinstance(obj, dict) and obj:
-            res = '{' + newline if self.as_json or level > 1 else ''
-            items = tuple(obj.items())
-            k, v = items[0]
-            res += ident
-            res += self._process(k)
-            res += f'{self.setter}{space}'
-            res += self._process(v, level + 1)
-            for key, val in items[1:]:
-                res += ',' + newline + ident if ident else ',' + space
-                res += self._process(key)
-                res += f'{self.setter}{space}'
-                res += self._process(val, level + 1)
-            res += newline + ident[:self.ident * max(level - 1, 0)] + '}'\
-                if self.as_json or level > 1 else ''
-        elif isinstance(obj, list) and obj:
-            res = '[' + newline if self.as_json or level > 1 else ''
-            res += ident
-            res += self._process(obj[0], level + 1)
-            for val in obj[1:]:
-                res += ',' + newline + ident if ident else ',' + space
-                res += self._process(val, level + 1)
-            res += newline + ident[:self.ident * max(level - 1, 0)] + ']'\
-                if self.as_json or level > 1 else ''
-        elif isinstance(obj, int | float) and not isinstance(obj, bool):
-            res = str(obj)
+        if isinstance(obj, int | float) and not isinstance(obj, bool):
+            return str(obj)
+        # empty, never quoted: line records load back as containers
+        if isinstance(obj, dict | list | array):
+            return '{}' if isinstance(obj, dict) else '[]'
+        return self._to_processed_str(obj, self.mark_str,
+                                      'null' if self.as_json else 'nil')
+
+    def _iter_container(self, obj: dict | list | array, level: int,
+                        buf: list[str]) -> Iterator[str]:
+        """ Adds the container to buf, yields buf joined when it is full """
+        first, sep, setter, end = self._level(level)
+        framed: bool = self.as_json or level > 1
+        newline: str = '\n' if first else ''
+        buffer_size: int = self.buffer_size
+        if isinstance(obj, dict):
+            if framed:
+                buf.append('{' + newline)
+            prefix: str = first
+            for key, val in obj.items():
+                buf.append(prefix)
+                buf.append(self._scalar(key))
+                buf.append(setter)
+                if val and isinstance(val, dict | list | array):
+                    yield from self._iter_container(val, level + 1, buf)
+                else:
+                    buf.append(self._scalar(val))
+                prefix = sep
+                if len(buf) >= buffer_size:
+                    yield ''.join(buf)
+                    buf.clear()
+            if framed:
+                buf.append(end + '}')
+            return
+        if framed:
+            buf.append('[' + newline)
+        if isinstance(obj, array):  # numbers only, written at once
+            buf.append(first + sep.join(map(str, obj)))
+            if framed:
+                buf.append(end + ']')
+            return
+        prefix = first
+        for val in obj:
+            buf.append(prefix)
+            if val and isinstance(val, dict | list | array):
+                yield from self._iter_container(val, level + 1, buf)
+            else:
+                buf.append(self._scalar(val))
+            prefix = sep
+            if len(buf) >= buffer_size:
+                yield ''.join(buf)
+                buf.clear()
+        if framed:
+            buf.append(end + ']')
+
+    def iterencode(self, obj: Any) -> Iterator[str]:
+        """ Serialize object by chunks """
+        self._levels = []  # options may have changed
+        buf: list[str] = []
+        if obj and isinstance(obj, dict | list | array):
+            yield from self._iter_container(obj, 1, buf)
         else:
-            res = self._to_processed_str(obj, self.mark_str, nil)
-        return res
+            buf.append(self._scalar(obj))
+        if buf:
+            yield ''.join(buf)
 
     @staticmethod
     def _to_processed_str(obj: Any, mark_str: str = '',
@@ -317,7 +1274,8 @@ class UBMLDumper:
             return nil
         if isinstance(obj, bool):
             return str(obj).lower()
-        to_replace: dict = {'\\': '\\\\', '\n': '\\n', '\t': '\\t'}
+        to_replace: dict = {'\\': '\\\\', '\n': '\\n', '\r': '\\r',
+                            '\t': '\\t'}
         if mark_str and mark_str in '"\'':
             to_replace[mark_str] = f'\\{mark_str}'
         res = str(obj)
@@ -327,27 +1285,582 @@ class UBMLDumper:
             return '"' + res + '"'
         return mark_str + res + mark_str
 
+    def encode_line(self, obj: Any) -> str:
+        """ Serialize object into a line of UBML-lines: dicts as {...},
+            other values inside a list of one element. ident must be 0 """
+        self._levels = []
+        buf: list[str] = []
+        chunks: list[str] = list(self._iter_container(
+            obj if isinstance(obj, dict) and obj else [obj], 2, buf))
+        return ''.join(chunks + buf)
+
     def set_ident(self, new_ident: int):
         """ Set ident """
         self.ident = new_ident or self.ident
 
     def result(self, obj: Any) -> str:
         """ Serialize object """
-        return self._process(obj)
+        return ''.join(self.iterencode(obj))
+
+
+########################################################
+# Compiled format
+########################################################
+# .ubmlc: magic, varint mtime_ns and size of the source, string table
+# (varint count, varint blob size, varint lengths of the strings and
+# utf-8 blob of all strings), value.
+# Value is a tag byte followed by a varint (int, string index, length)
+# or 8 bytes of a double
+COMPILED_SUFFIX = '.ubmlc'
+_COMPILED_MAGIC = b'UBMLC\x01'
+_NIL, _FALSE, _TRUE, _INT, _NEG_INT, _FLOAT, _STR, _LIST, _DICT = range(9)
+_DOUBLE = struct.Struct('<d')
+
+
+class InvalidCompiledError(ValueError):
+    """ Error for malformed compiled ubml """
+
+
+def _write_varint(out: bytearray, num: int):
+    while num > 0x7f:
+        out.append(num & 0x7f | 0x80)
+        num >>= 7
+    out.append(num)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    byte: int = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    num: int = byte & 0x7f
+    shift: int = 7
+    while True:
+        pos += 1
+        byte = data[pos]
+        num |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return num, pos + 1
+        shift += 7
+
+
+class UBMLCompiler:
+    """ Used to serialize objects into compiled (binary) ubml """
+
+    def __init__(self):
+        self.strings: dict[str, int] = {}
+        self.out: bytearray = bytearray()
+
+    def _process(self, obj: Any):
+        out: bytearray = self.out
+        if obj is None:
+            out.append(_NIL)
+        elif obj is True or obj is False:
+            out.append(_TRUE if obj else _FALSE)
+        elif isinstance(obj, int):
+            out.append(_INT if obj >= 0 else _NEG_INT)
+            _write_varint(out, obj if obj >= 0 else -obj - 1)
+        elif isinstance(obj, float):
+            out.append(_FLOAT)
+            out += _DOUBLE.pack(obj)
+        elif isinstance(obj, str):
+            out.append(_STR)
+            _write_varint(out, self.strings.setdefault(obj, len(self.strings)))
+        elif isinstance(obj, list | array):
+            out.append(_LIST)
+            _write_varint(out, len(obj))
+            for val in obj:
+                self._process(val)
+        elif isinstance(obj, dict):
+            out.append(_DICT)
+            _write_varint(out, len(obj))
+            for key, val in obj.items():
+                self._process(key)
+                self._process(val)
+        else:
+            raise NotSupported(f"type '{type(obj).__name__}' is not supported")
+
+    def result(self, obj: Any, stamp: tuple[int, int] = (0, 0)) -> bytes:
+        """ Serialize object, stamp is (mtime_ns, size) of the source """
+        self.strings = {}
+        self.out = bytearray()
+        self._process(obj)
+        head: bytearray = bytearray(_COMPILED_MAGIC)
+        _write_varint(head, stamp[0])
+        _write_varint(head, stamp[1])
+        blob: bytes = ''.join(self.strings).encode('utf-8')
+        _write_varint(head, len(self.strings))
+        _write_varint(head, len(blob))
+        for string in self.strings:
+            _write_varint(head, len(string))
+        head += blob
+        return bytes(head + self.out)
+
+
+def _compiled_stamp(data: bytes) -> tuple[tuple[int, int], int]:
+    """ Source (mtime_ns, size) and the position after them """
+    if not data.startswith(_COMPILED_MAGIC):
+        raise InvalidCompiledError('not a compiled ubml')
+    mtime, pos = _read_varint(data, len(_COMPILED_MAGIC))
+    size, pos = _read_varint(data, pos)
+    return (mtime, size), pos
+
+
+# pylint: disable=too-many-branches
+def _decode(data: bytes, pos: int, strings: list[str]) -> tuple[Any, int]:
+    tag: int = data[pos]
+    pos += 1
+    if tag in (_STR, _INT):
+        num: int = data[pos]
+        pos += 1
+        if num > 0x7f:
+            num, pos = _read_varint(data, pos - 1)
+        return (strings[num] if tag == _STR else num), pos
+    if tag == _DICT:
+        count, pos = _read_varint(data, pos)
+        res: dict = {}
+        for _ in range(count):
+            key, pos = _decode(data, pos, strings)
+            res[key], pos = _decode(data, pos, strings)
+        return res, pos
+    if tag == _LIST:
+        count, pos = _read_varint(data, pos)
+        items: list = [None] * count
+        for idx in range(count):
+            items[idx], pos = _decode(data, pos, strings)
+        return items, pos
+    if tag == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+    if tag == _NEG_INT:
+        num, pos = _read_varint(data, pos)
+        return -num - 1, pos
+    if tag > _DICT:
+        raise InvalidCompiledError(f'unknown tag {tag} at {pos - 1}')
+    return (None, False, True)[tag], pos
+
+
+def loads_compiled(data: bytes) -> Any:
+    """ Loads object from compiled ubml """
+    try:
+        _, pos = _compiled_stamp(data)
+        count, pos = _read_varint(data, pos)
+        size, pos = _read_varint(data, pos)
+        strings: list[str] = [''] * count
+        for idx in range(count):
+            strings[idx], pos = _read_varint(data, pos)
+        text: str = data[pos:pos + size].decode('utf-8')
+        pos += size
+        start: int = 0
+        for idx, length in enumerate(strings):
+            strings[idx] = text[start:start + length]
+            start += length
+        if start != len(text):
+            raise InvalidCompiledError('malformed string table')
+        res, pos = _decode(data, pos, strings)
+    except (IndexError, struct.error, UnicodeDecodeError, RecursionError
+            ) as err:
+        raise InvalidCompiledError(f'truncated compiled ubml: {err}') from err
+    if pos != len(data):
+        raise InvalidCompiledError(f'extra data at {pos}')
+    return res
+
+
+def dumps_compiled(obj: Any, stamp: tuple[int, int] = (0, 0)) -> bytes:
+    """ Dumps object into compiled ubml and returns it,
+        stamp is (mtime_ns, size) of the source file """
+    return UBMLCompiler().result(obj, stamp)
+
+
+def compiled_path(path: str) -> str:
+    """ Path of the compiled file next to the source """
+    return splitext(path)[0] + COMPILED_SUFFIX
+
+
+def _load_fresh_compiled(path: str, stamp: tuple[int, int] | None = None
+                         ) -> tuple[bool, Any]:
+    """ (True, object) from the compiled file of the source if it was
+        compiled from the source as it is now, (False, None) otherwise """
+    if path.endswith(COMPILED_SUFFIX):
+        return False, None
+    try:
+        if stamp is None:
+            stat: os.stat_result = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        with open(compiled_path(path), 'rb') as fd:
+            data: bytes = fd.read()
+        if _compiled_stamp(data)[0] != stamp:
+            return False, None
+        return True, loads_compiled(data)
+    except (OSError, InvalidCompiledError):
+        return False, None
+
+
+########################################################
+# UBML-lines
+########################################################
+# One value per line, see UBMLDumper.encode_line. Newlines of strings
+# are escaped, so files may be opened in any newline mode
+DEFAULT_LINES_CHUNK = 1024 * 1024  # bytes per range of parallel reader
+
+
+class _LineScanner(UBMLScanner):
+    """ Scanner of one line, errors point to the line of the file """
+
+    def __init__(self, text: str, filename: str, line: int):
+        super().__init__(text, filename)
+        self._line: int = line
+        self._indent: int = len(text) - len(text.lstrip())
+
+    def _where(self, pos: int) -> str:
+        return f'{self._filename}:{self._line}:{pos + self._indent + 1}'
+
+
+def _decode_line(text: str, filename: str, line: int) -> Any:
+    """ Value of the line of UBML-lines """
+    res: Any = _LineScanner(text, filename, line).result()
+    if isinstance(res, dict):
+        return res
+    if len(res) != 1:
+        raise InvalidSymbolError(f'Expected one value in line, got '
+                                 f'{len(res)} in {filename or "<stdin>"}:'
+                                 f'{line}')
+    return res[0]
+
+
+def _decode_lines(text: str, filename: str, line: int) -> list:
+    """ Values of the lines, the first one is the line of the file """
+    return [_decode_line(row, filename, line + idx)
+            for idx, row in enumerate(text.split('\n')) if row.strip()]
+
+
+def _line_ranges(path: str, chunk_size: int) -> list[tuple[int, int]]:
+    """ Byte ranges of about chunk_size ending at line ends """
+    size: int = getsize(path)
+    ranges: list[tuple[int, int]] = []
+    start: int = 0
+    with open(path, 'rb') as fd:
+        while start < size:
+            fd.seek(start + max(chunk_size, 1) - 1)
+            fd.readline()
+            end: int = min(fd.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _load_line_range(path: str, start: int, end: int,
+                     line: int = 1) -> tuple[list, int]:
+    """ Values of the lines in the byte range and number of lines in it """
+    with open(path, 'rb') as fd:
+        fd.seek(start)
+        text: str = _decode_text(fd.read(end - start))
+    return _decode_lines(text, path, line), text.count('\n')
+
+
+########################################################
+# Load cache
+########################################################
+DEFAULT_CACHE_ENTRIES = 256
+DEFAULT_CACHE_BYTES = 16 * 1024 * 1024
+
+
+class _CacheEntry(NamedTuple):
+    stamp: tuple[int, int]  # (mtime_ns, size) of the file
+    digest: str  # SHA-256 of the file
+    data: Any
+    frozen: list  # read-only view, built on first request
+
+
+def _deepcopy(obj: Any) -> Any:
+    """ Copy of parsed UBML (dicts, lists and scalars) """
+    if isinstance(obj, dict):
+        return {key: _deepcopy(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_deepcopy(value) for value in obj]
+    return obj
+
+
+def _freeze(obj: Any) -> Any:
+    """ Read-only view of parsed UBML: dicts become mapping proxies,
+        lists become tuples """
+    if isinstance(obj, dict):
+        return MappingProxyType({key: _freeze(value)
+                                 for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(value) for value in obj)
+    return obj
+
+
+class LoadCache:
+    """ Cache of parsed UBML files
+        Entries are keyed by absolute path and validated by
+        (mtime_ns, size) of the file, with check_hash also by SHA-256
+        of its content. Least recently used entries are evicted when
+        there are more than max_entries or their files take more than
+        max_bytes. Cached data is never given away: load returns a deep
+        copy or a read-only view """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES,
+                 max_bytes: int = DEFAULT_CACHE_BYTES,
+                 check_hash: bool = False):
+        self.max_entries: int = max(max_entries, 0)
+        self.max_bytes: int = max(max_bytes, 0)
+        self.check_hash: bool = check_hash
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+        self.evictions: int = 0
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._bytes: int = 0
+        self._lock = threading.Lock()
+
+    def load(self, path: str, readonly: bool = False) -> Any:
+        """ Object from UBML file, parsed only if the file changed """
+        path = abspath(path)
+        stat: os.stat_result = os.stat(path)
+        stamp: tuple[int, int] = (stat.st_mtime_ns, stat.st_size)
+        data: bytes | None = None
+        with self._lock:
+            entry: _CacheEntry | None = self._entries.get(path)
+        if entry and entry.stamp == stamp and self.check_hash:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+            if hashlib.sha256(data).hexdigest() != entry.digest:
+                entry = None  # changed in place, same mtime and size
+        with self._lock:
+            if entry and entry.stamp == stamp:
+                self.hits += 1
+                self._entries.move_to_end(path)
+                return self._view(entry, readonly)
+            self.misses += 1
+            if path in self._entries:
+                self.invalidations += 1
+                self._drop(path)
+        if data is None:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        found, obj = _load_fresh_compiled(path, stamp)
+        if not found:
+            obj = UBMLScanner(_decode_text(data), path).result()
+        entry = _CacheEntry(stamp, hashlib.sha256(data).hexdigest(), obj, [])
+        with self._lock:
+            if stamp[1] <= self.max_bytes and self.max_entries:
+                if path in self._entries:
+                    self._drop(path)
+                self._entries[path] = entry
+                self._bytes += stamp[1]
+                self._evict()
+            return self._view(entry, readonly)
+
+    @staticmethod
+    def _view(entry: _CacheEntry, readonly: bool) -> Any:
+        if not readonly:
+            return _deepcopy(entry.data)
+        if not entry.frozen:
+            entry.frozen.append(_freeze(entry.data))
+        return entry.frozen[0]
+
+    def _drop(self, path: str):
+        self._bytes -= self._entries.pop(path).stamp[1]
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or\
+                self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, path: str | None = None):
+        """ Forget the file or all files """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif abspath(path) in self._entries:
+                self._drop(abspath(path))
+
+    def stats(self) -> dict[str, int]:
+        """ Hit/miss counters and current size of the cache """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+
+LOAD_CACHE = LoadCache()
 
 
 ########################################################
 # Main functions
 ########################################################
-def loads(text: str) -> Any:
-    """ Loads object from the string of UBML format and returns it """
-    return UBMLParser(text, '').result()
+def loads(text: str, workers: int = 1, schema: Any = None,
+          arrays: bool = False) -> Any:
+    """ Loads object from the string of UBML format and returns it,
+        with workers > 1 a large top level list is parsed by slices
+        across a process pool (see UBMLScanner.parallel_result).
+        With schema the object is decoded into it in one process
+        (see UBMLTypedScanner), otherwise with arrays lists of numbers
+        only are returned as array.array ('q' or 'd' if there is
+        a float) """
+    if schema is not None:
+        return UBMLTypedScanner(text, '', schema).result()
+    return UBMLScanner(text, '', arrays).parallel_result(workers)
 
 
-def load(fd: IO) -> Any:
-    """ Loads object from UBML file and returns it """
+def load(fd: IO, schema: Any = None, arrays: bool = False) -> Any:
+    """ Loads object from UBML file and returns it,
+        a fresh compiled file next to it (see compile) is preferred.
+        schema and arrays are the same as of loads """
+    name: Any = getattr(fd, 'name', '')
+    if schema is not None:
+        return UBMLTypedScanner(fd.read(), name, schema).result()
+    if arrays:
+        return UBMLScanner(fd.read(), name, arrays).result()
+    if name and isinstance(name, str):
+        found, res = _load_fresh_compiled(name)
+        if found:
+            return res
     text: str = fd.read()
-    return UBMLParser(text, fd.name).result()
+    return UBMLScanner(text, name).result()
+
+
+# pylint: disable=redefined-builtin
+def compile(path: str) -> str:
+    """ Compiles UBML file into .ubmlc next to it, which load and
+        load_cached prefer while the source is unchanged.
+        Returns path of the compiled file """
+    stat: os.stat_result = os.stat(path)
+    with open(path, 'r', encoding='utf-8') as fd:
+        obj: Any = UBMLScanner(fd.read(), path).result()
+    target: str = compiled_path(path)
+    tmp: str = f'{target}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fd:
+        fd.write(dumps_compiled(obj, (stat.st_mtime_ns, stat.st_size)))
+    os.replace(tmp, target)
+    return target
+
+
+def load_cached(path: str, readonly: bool = False) -> Any:
+    """ Loads object from UBML file through the process-wide LOAD_CACHE,
+        returns a deep copy or with readonly a read-only view """
+    return LOAD_CACHE.load(path, readonly)
+
+
+def load_lines(fd: IO) -> Iterator[Any]:
+    """ Yields values of UBML-lines file one by one """
+    name: Any = getattr(fd, 'name', '')
+    line: int = 1
+    rest: str = ''
+    while block := fd.read(DEFAULT_CHUNK_SIZE):
+        rows: list[str] = (rest + block).split('\n')
+        rest = rows.pop()  # iterating fd would split at \r as well
+        for row in rows:
+            if row.strip():
+                yield _decode_line(row, name, line)
+            line += 1
+    if rest.strip():
+        yield _decode_line(rest, name, line)
+
+
+def load_lines_parallel(path: str, workers: int | None = None,
+                        chunk_size: int = DEFAULT_LINES_CHUNK
+                        ) -> Iterator[Any]:
+    """ Yields values of UBML-lines file in order, decoding byte ranges
+        of about chunk_size across a process pool of workers processes
+        (cpu count by default and at most, 1 decodes in this process) """
+    ranges: list[tuple[int, int]] = _line_ranges(path, chunk_size)
+    workers = _usable_workers(workers or os.cpu_count() or 1, len(ranges))
+    line: int = 1
+    if workers == 1:
+        for start, end in ranges:
+            values, lines = _load_line_range(path, start, end, line)
+            line += lines
+            yield from values
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures: list[Future] = [pool.submit(_load_line_range, path, *rng)
+                                 for rng in ranges]
+        for rng, future in zip(ranges, futures):
+            if future.exception() is not None:
+                for rest in futures:
+                    rest.cancel()
+                # workers do not know the line numbers, decode it here
+                _load_line_range(path, *rng, line)
+            values, lines = future.result()
+            line += lines
+            yield from values
+
+
+def dump_lines(iterable: Any, fd: IO) -> int:
+    """ Dumps every value of iterable into a line of UBML-lines file
+        (strings are quoted) and returns number of bytes written """
+    dumper = UBMLDumper(mark_str='"')
+    size: int = 0
+    buf: list[str] = []
+    for obj in iterable:
+        buf.append(dumper.encode_line(obj))
+        buf.append('\n')
+        if len(buf) >= dumper.buffer_size:
+            size += fd.write(''.join(buf))
+            buf.clear()
+    if buf:
+        size += fd.write(''.join(buf))
+    return size
+
+
+def append_lines(path: str, iterable: Any) -> int:
+    """ Appends values to UBML-lines file without rewriting it and
+        returns number of bytes written. Values start on a line of
+        their own even if the last write to the file was cut short """
+    try:
+        with open(path, 'rb') as fd:
+            fd.seek(-1, os.SEEK_END)
+            cut: bool = fd.read(1) != b'\n'
+    except OSError:  # no file or it is empty
+        cut = False
+    with open(path, 'a', encoding='utf-8', newline='') as fd:
+        return (fd.write('\n') if cut else 0) + dump_lines(iterable, fd)
+
+
+def iterparse(fd: IO, chunk_size: int = DEFAULT_CHUNK_SIZE
+              ) -> Iterator[tuple[str, Any]]:
+    """ Parses UBML file by chunks and yields (event, value) pairs,
+        see UBMLEvents """
+    return iter(UBMLEvents(fd, chunk_size))
+
+
+def iter_items(fd: IO, path: tuple | list | str = (),
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """ Yields elements of the list one by one, memory use is
+        proportional to one element. path is the keys of the dicts
+        leading to the list (one key may be given as is),
+        empty path is the top level list """
+    path = (path,) if isinstance(path, str) else tuple(path)
+    events: Iterator[tuple[str, Any]] = iterparse(fd, chunk_size)
+    event, value = _next_event(events)
+    for key in path:
+        if event != 'start_map':
+            raise TypeError(f'{path} does not lead to a list')
+        while True:
+            event, value = _next_event(events)
+            if event in _CONTAINER_EVENTS:
+                _skip(events)  # value without a key fails in the parser
+                continue
+            if event != 'key':
+                return  # end of dict, no such key
+            found: bool = value == key
+            event, value = _next_event(events)
+            if event == 'end_map':
+                return
+            if found:
+                break
+            if event in _CONTAINER_EVENTS:
+                _skip(events)
+    if event != 'start_list':
+        raise TypeError(f'{path} does not lead to a list')
+    for event, value in events:
+        if event == 'end_list':
+            return
+        yield _build(event, value, events)
 
 
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
@@ -361,7 +1874,10 @@ def dumps(obj: Any, ident: int = 0, mark_str: str = '',
 def dump(obj: Any, fd: IO, ident: int = 0, mark_str: str = '',
          ident_str: str = ' ', setter: str = '=',
          as_json: bool = False) -> int:
-    """ Dumps object into UBML file and returns number of bytes written """
-    text: str = UBMLDumper(ident, mark_str, ident_str,
-                           setter, as_json).result(obj)
-    return fd.write(text)
+    """ Dumps object into UBML file by chunks and returns number
+        of bytes written """
+    size: int = 0
+    for chunk in UBMLDumper(ident, mark_str, ident_str,
+                            setter, as_json).iterencode(obj):
+        size += fd.write(chunk)
+    return size